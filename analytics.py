@@ -0,0 +1,103 @@
+"""Section attendance analytics over a students x dates status matrix.
+
+The section's history is loaded once into an int8 matrix (one row per
+student, one column per attendance day). All statistics are then whole-array
+numpy operations, with no per-student loop over days.
+"""
+import numpy as np
+
+NO_RECORD, PRESENT, ABSENT, EXCUSED = 0, 1, 2, 3
+CODES = {'present': PRESENT, 'absent': ABSENT, 'excused': EXCUSED}
+
+
+def status_matrix(days, students=()):
+    """Return (matrix, students, dates) for days as produced by iter_section_attendance.
+
+    Rows follow `students` (e.g. the enrolled roster), then any other student
+    that appears in the records. Unknown statuses are treated as no record.
+    """
+    students = list(students)
+    index = {sid: i for i, sid in enumerate(students)}
+    rows, cols, codes = [], [], []
+    for j, day in enumerate(days):
+        for rec in day['records']:
+            sid, code = rec.get('student_id'), CODES.get(rec.get('status'))
+            if not sid or code is None:
+                continue
+            if sid not in index:
+                index[sid] = len(students)
+                students.append(sid)
+            rows.append(index[sid])
+            cols.append(j)
+            codes.append(code)
+
+    matrix = np.zeros((len(students), len(days)), dtype=np.int8)
+    matrix[rows, cols] = codes
+    return matrix, students, [day['date'] for day in days]
+
+
+def _rate(present, absent):
+    counted = present + absent
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counted > 0, present / np.maximum(counted, 1), np.nan)
+
+
+def section_analytics(matrix, window=14, risk_rate=0.8, risk_streak=3):
+    """Per-student and per-day statistics for a status matrix.
+
+    rate:    present / (present + absent); excused days are not counted.
+    streak:  absences since the student's last present day (excused days neither
+             break nor extend a streak).
+    trend:   rate over the last `window` days minus the rate over the `window`
+             days before that (NaN when either window has no counted days).
+    at_risk: rate below risk_rate or a streak of at least risk_streak.
+    """
+    n_students, n_days = matrix.shape
+    present = matrix == PRESENT
+    absent = matrix == ABSENT
+
+    n_present = present.sum(axis=1)
+    n_absent = absent.sum(axis=1)
+    n_excused = (matrix == EXCUSED).sum(axis=1)
+    rate = _rate(n_present, n_absent)
+
+    if n_days:
+        cum_absent = np.cumsum(absent, axis=1, dtype=np.int32)
+        last_present = np.where(present.any(axis=1),
+                                n_days - 1 - np.argmax(present[:, ::-1], axis=1), -1)
+        absent_before = np.where(last_present >= 0,
+                                 cum_absent[np.arange(n_students), np.maximum(last_present, 0)], 0)
+        streak = cum_absent[:, -1] - absent_before
+    else:
+        streak = np.zeros(n_students, dtype=np.int32)
+
+    recent = slice(max(n_days - window, 0), n_days)
+    prior = slice(max(n_days - 2 * window, 0), max(n_days - window, 0))
+    trend = (_rate(present[:, recent].sum(axis=1), absent[:, recent].sum(axis=1))
+             - _rate(present[:, prior].sum(axis=1), absent[:, prior].sum(axis=1)))
+
+    with np.errstate(invalid='ignore'):
+        at_risk = (rate < risk_rate) | (streak >= risk_streak)
+
+    return {
+        'present': n_present,
+        'absent': n_absent,
+        'excused': n_excused,
+        'rate': rate,
+        'streak': streak,
+        'trend': trend,
+        'at_risk': at_risk,
+        'daily_rate': _rate(present.sum(axis=0), absent.sum(axis=0)),
+        'section_rate': _rate(n_present.sum(), n_absent.sum()),
+    }
+
+
+def to_python(value):
+    """Convert numpy scalars/arrays to JSON-friendly values (NaN becomes None)."""
+    if isinstance(value, np.ndarray) and value.ndim:
+        return [to_python(v) for v in value.tolist()]
+    if isinstance(value, (np.ndarray, np.generic)):
+        value = value.item()
+    if isinstance(value, float):
+        return None if np.isnan(value) else round(value, 4)
+    return value
@@ -1,46 +1,723 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-import firebase_admin
-from firebase_admin import credentials, firestore
+import time
+_import_started = time.perf_counter()  # keep first: measures module import time
+
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, g,
+                   has_app_context, make_response, Response, stream_with_context)
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from cachetools import LRUCache, TTLCache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import quote
+from instrumentation import InstrumentedStore, Histogram, estimate_size, new_tally
+from live_updates import AttendanceBroker, FirestoreChangeSource, LocalChangeSource, StreamsFull
+from jobs import JobQueueFull, JobRunner
+from write_buffer import CoalescingWriter
+from user_search import FIELDS as USER_INDEX_FIELDS, UserIndex
+from settings import Settings
+import click
+import contextvars
+import csv
+import functools
+import hashlib
+import importlib
+import io
+import logging
+import multiprocessing
 import os
-from datetime import datetime
+import queue
+import random
+import socket
+import threading
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+class LazyModule:
+    """Import a module on first attribute access (keeps gRPC/google-auth out of import time)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+firestore = LazyModule('firebase_admin.firestore')
+api_exceptions = LazyModule('google.api_core.exceptions')
+analytics = LazyModule('analytics')  # numpy
 
 # ---------- Configuration ----------
-APP_SECRET = os.environ.get('TRACKIT_SECRET', 'dev-secret-change-me')
-ADMIN_EMAIL = os.environ.get('TRACKIT_ADMIN_EMAIL', 'admin@trackit.com')
-ADMIN_PASSWORD = os.environ.get('TRACKIT_ADMIN_PASSWORD', 'admin123')
+# Every TRACKIT_* environment variable is read into `settings` (see settings.py).
+settings = Settings()
+ATTENDANCE_PAGE_MAX = 366
+USER_SEARCH_MAX_RESULTS = 50
 
 # ---------- Flask init ----------
 app = Flask(__name__)
-app.secret_key = APP_SECRET
+app.secret_key = settings.secret
+if settings.jinja_bytecode_cache:
+    # Set before the first render: Flask builds jinja_env from jinja_options once.
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(settings.jinja_cache_dir))
 
 # ---------- Firebase Admin / Firestore init ----------
 import json
 
 # ---------- Firebase Admin / Firestore init ----------
-if not firebase_admin._apps:
-    firebase_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
+def open_firestore():
+    import firebase_admin
+    from firebase_admin import credentials
 
-    if firebase_json:
-        cred = credentials.Certificate(json.loads(firebase_json))
-        firebase_admin.initialize_app(cred)
-    else:
-        # Local development fallback
-        cred_path = os.path.join(os.path.dirname(__file__), "firebase", "config.json")
-        if not os.path.exists(cred_path):
-            raise RuntimeError("Firebase credentials missing")
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
+    if os.environ.get("FIRESTORE_EMULATOR_HOST") and not os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON"):
+        # Local emulator: no credentials needed.
+        from google.cloud import firestore as cloud_firestore
+        return cloud_firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "trackit-dev"))
 
-db = firestore.client()
+    if not firebase_admin._apps:
+        firebase_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
+
+        if firebase_json:
+            cred = credentials.Certificate(json.loads(firebase_json))
+            firebase_admin.initialize_app(cred)
+        else:
+            # Local development fallback
+            cred_path = os.path.join(os.path.dirname(__file__), "firebase", "config.json")
+            if not os.path.exists(cred_path):
+                raise RuntimeError("Firebase credentials missing")
+            cred = credentials.Certificate(cred_path)
+            firebase_admin.initialize_app(cred)
+
+    return firestore.client()
+
+# ---------- Storage backend ----------
+# Every helper below talks to `db` through the Firestore client API. The
+# SQLite backend (sqlite_store.SQLiteStore) implements the same surface.
+def open_storage():
+    if settings.storage_backend == 'sqlite':
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(settings.sqlite_path, latency=settings.sqlite_latency_ms / 1000,
+                           slow_rate=settings.sqlite_slow_rate, slow_latency=settings.sqlite_slow_ms / 1000)
+    if settings.storage_backend != 'firestore':
+        raise RuntimeError(f"Unknown TRACKIT_STORAGE backend: {settings.storage_backend}")
+    return open_firestore()
+
+# `db` resolves to this process's client (state.storage), opened on first use.
+def get_db():
+    if state.storage is None:
+        with state.storage_lock:
+            if state.storage is None:
+                store = open_storage()
+                state.storage = InstrumentedStore(store, current_io) if settings.metrics_sample_rate > 0 else store
+    return state.storage
+
+db = LocalProxy(get_db)
+
+# ---------- Request instrumentation ----------
+# Sampled requests carry a tally on flask.g; the storage wrapper adds every
+# read, query and write to it. A hedged read attempt counts into its own tally
+# (_attempt_io) until it wins. Histograms and event counters are per worker process.
+_attempt_io = contextvars.ContextVar('trackit_attempt_io', default=None)
+
+def current_io():
+    tally = _attempt_io.get()
+    if tally is not None:
+        return tally
+    if not has_app_context():
+        return None
+    return g.get('_trackit_io')
+
+def add_io(tally):
+    total = current_io()
+    if total is not None and tally is not None:
+        for key, value in tally.items():
+            total[key] += value
+
+def count_event(stats, event):
+    with state.stats_lock:
+        stats[event] += 1
+
+# ---------- Live attendance updates ----------
+def open_attendance_source():
+    if settings.live_source == 'local':
+        return LocalChangeSource()
+    if settings.live_source != 'firestore':
+        raise RuntimeError(f"Unknown TRACKIT_LIVE_SOURCE: {settings.live_source}")
+    return FirestoreChangeSource(lambda class_code, section: (
+        db.collection('attendance_counters')
+        .where('class_code', '==', class_code)
+        .where('section', '==', section)))
+
+request_log = app.logger.getChild('requests')
+request_log.setLevel(logging.INFO)
+startup_log = app.logger.getChild('startup')
+startup_log.setLevel(logging.INFO)
+STARTUP_SECONDS = {}
+
+_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REQUEST_SECONDS = Histogram('trackit_request_duration_seconds', 'Request latency.',
+                            ('endpoint', 'method', 'status'), _SECONDS_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('trackit_request_db_seconds', 'Time spent in storage calls per sampled request.',
+                               ('endpoint', 'method'), _SECONDS_BUCKETS)
+REQUEST_DB_CALLS = Histogram('trackit_request_db_calls', 'Storage calls per sampled request.',
+                             ('endpoint', 'method'), (1, 2, 5, 10, 25, 50, 100, 250))
+REQUEST_DOCS_READ = Histogram('trackit_request_docs_read', 'Documents read per sampled request.',
+                              ('endpoint', 'method'), (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+REQUEST_BYTES_READ = Histogram('trackit_request_bytes_read', 'Estimated document bytes read per sampled request.',
+                               ('endpoint', 'method'), (1e3, 1e4, 1e5, 2.5e5, 1e6, 2.5e6, 1e7))
+REQUEST_WRITES = Histogram('trackit_request_writes', 'Documents written per sampled request.',
+                           ('endpoint', 'method'), (0, 1, 2, 5, 10, 25, 100, 500))
+CLASS_WRITE_SECONDS = Histogram('trackit_class_write_seconds',
+                                'Time from queueing a class-document update to its commit.',
+                                ('document',), _SECONDS_BUCKETS)
+CLASS_WRITE_COALESCED = Histogram('trackit_class_write_coalesced', 'Queued updates folded into one class-document commit.',
+                                  ('document',), (1, 2, 5, 10, 25, 50, 100))
+CLASS_WRITE_ATTEMPTS_USED = Histogram('trackit_class_write_attempts', 'Commit attempts per coalesced class-document write.',
+                                      ('document',), (1, 2, 3, 5, 10))
+METRIC_HISTOGRAMS = (REQUEST_SECONDS, REQUEST_DB_SECONDS, REQUEST_DB_CALLS, REQUEST_DOCS_READ,
+                     REQUEST_BYTES_READ, REQUEST_WRITES, CLASS_WRITE_SECONDS, CLASS_WRITE_COALESCED,
+                     CLASS_WRITE_ATTEMPTS_USED)
+
+def _record_hash_time(started):
+    tally = current_io()
+    if tally is not None:
+        tally['hash_ms'] += (time.perf_counter() - started) * 1000
 
 
 # ============================================================================================
 #                                      HELPER FUNCTIONS
 # ============================================================================================
+# ---------- Password hashing ----------
+class HashingBusy(Exception):
+    """Raised when the password hashing queue is full."""
+
+def _get_hash_pool():
+    with state.hash_pool_lock:
+        if state.hash_pool is None:
+            # spawn, not fork: the worker already holds gRPC channels and threads.
+            state.hash_pool = ProcessPoolExecutor(max_workers=settings.hash_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return state.hash_pool
+
+def _submit_hash(fn, *args):
+    """Run fn in the pool. If a hashing process died, replace the pool and try once more."""
+    pool = _get_hash_pool()
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        app.logger.warning("Password hashing pool broke; starting a new one")
+        with state.hash_pool_lock:
+            if state.hash_pool is pool:
+                state.hash_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        return _get_hash_pool().submit(fn, *args).result()
+
+def _run_hash_job(fn, *args):
+    started = time.perf_counter()
+    if settings.hash_workers <= 0:
+        try:
+            return fn(*args)
+        finally:
+            _record_hash_time(started)
+    if not state.hash_slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return _submit_hash(fn, *args)
+    finally:
+        state.hash_slots.release()
+        _record_hash_time(started)
+
+def hash_password(password):
+    return _run_hash_job(generate_password_hash, password, settings.password_hash_method)
+
+def hash_passwords(passwords):
+    """Hash many passwords for a bulk import.
+
+    At most settings.hash_workers of them are queued on the pool at a time, so
+    login and signup hashes wait behind a few import jobs rather than the whole file.
+    """
+    started = time.perf_counter()
+    try:
+        if settings.hash_workers <= 0 or not passwords:
+            return [generate_password_hash(pw, settings.password_hash_method) for pw in passwords]
+        with ThreadPoolExecutor(max_workers=settings.hash_workers, thread_name_prefix='trackit-import-hash') as feeders:
+            return list(feeders.map(lambda pw: _submit_hash(generate_password_hash, pw, settings.password_hash_method),
+                                    passwords))
+    finally:
+        _record_hash_time(started)
+
+def verify_password(pw_hash, password):
+    return _run_hash_job(check_password_hash, pw_hash, password)
+
+@functools.lru_cache(maxsize=1)
+def _hash_prefix():
+    # Werkzeug expands a bare method ("scrypt", "pbkdf2:sha256") with its
+    # default parameters, so the stored prefix is taken from a real hash.
+    return generate_password_hash('x', settings.password_hash_method).split('$', 1)[0]
+
+def needs_rehash(pw_hash):
+    return pw_hash.split('$', 1)[0] != _hash_prefix()
+
+# ---------- Read deadlines ----------
+# A route's budget is stored on flask.g as an absolute deadline. Every read it
+# makes gets the time left as its timeout, capped at settings.read_attempt_deadline
+# so one slow read cannot use up the budget of the hedge and fallbacks after it. Reads
+# of classes, users, section rosters and attendance counters go through
+# hedged_read() and read_snapshots(), which fall back to the last known good copy
+# when the deadline passes; so do attendance pages read for class details.
+class ReadDeadlineExceeded(Exception):
+    """Raised when a read misses its deadline and there is no last known good copy to serve."""
+
+HEDGED_COLLECTIONS = ('classes', 'users', 'sections', 'attendance_counters')
+
+def latency_budget(seconds):
+    """Bound every storage read a GET of the view makes to `seconds` from the start of the view.
+
+    Form posts keep the full settings.read_deadline: what they write depends on what they read.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                g._trackit_deadline = time.monotonic() + seconds
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def read_timeout():
+    """Seconds left in the route's budget, capped at read_attempt_deadline (read_deadline outside one)."""
+    deadline = g.get('_trackit_deadline') if has_app_context() else None
+    if deadline is None:
+        return settings.read_deadline
+    return max(0.0, min(settings.read_attempt_deadline, deadline - time.monotonic()))
+
+def is_hedged(collection):
+    # Subcollections are named by their last segment: classes/<code>/sections.
+    return collection.rsplit('/', 1)[-1] in HEDGED_COLLECTIONS
+
+def _get_read_pool():
+    with state.read_pool_lock:
+        if state.read_pool is None:
+            state.read_pool = ThreadPoolExecutor(max_workers=settings.hedge_workers, thread_name_prefix='trackit-read')
+        return state.read_pool
+
+def _get_refresh_pool():
+    with state.read_pool_lock:
+        if state.refresh_pool is None:
+            state.refresh_pool = ThreadPoolExecutor(max_workers=settings.refresh_workers,
+                                                    thread_name_prefix='trackit-refresh')
+        return state.refresh_pool
+
+def _submit_read(read, deadline):
+    # Each attempt runs in a copy of the request context with a tally of its
+    # own; only the attempt that wins is added to the request's I/O.
+    ctx = contextvars.copy_context()
+    tally = new_tally() if current_io() is not None else None
+    ctx.run(_attempt_io.set, tally)
+    future = _get_read_pool().submit(ctx.run, read, max(0.0, deadline - time.monotonic()))
+    future.trackit_io = tally
+    return future
+
+def hedged_read(read, timeout):
+    """Call read(timeout) and, if it has not answered after settings.hedge_after_ms, once more in parallel.
+
+    The first attempt to succeed wins. Raises FutureTimeout when neither answers
+    in time, or the last error when every attempt fails.
+    """
+    if settings.hedge_after_ms <= 0:
+        return read(timeout)
+    deadline = time.monotonic() + timeout
+    attempts = [_submit_read(read, deadline)]
+    done, _ = wait(attempts, timeout=min(settings.hedge_after_ms / 1000, timeout))
+    if (not done or attempts[0].exception() is not None) and time.monotonic() < deadline:
+        attempts.append(_submit_read(read, deadline))
+        count_event(state.read_stats, 'hedged')
+    error = None
+    for future in as_completed(attempts, timeout=max(0.0, deadline - time.monotonic())):
+        try:
+            result = future.result()
+        except Exception as e:
+            error = e
+            continue
+        if future is not attempts[0]:
+            count_event(state.read_stats, 'hedge_wins')
+        add_io(future.trackit_io)
+        return result
+    raise error
+
+def _is_deadline_error(error):
+    return isinstance(error, (FutureTimeout, api_exceptions.DeadlineExceeded, api_exceptions.ServiceUnavailable))
+
+def _refresh_last_good(keys, reload):
+    """Store reload(keys) -> {key: copy} from a background thread; one refresh per key at a time.
+
+    reload reads with the full settings.read_deadline. When settings.refresh_queue_limit
+    batches are already waiting this one is dropped; the next deadline miss schedules it again.
+    """
+    if not state.refresh_slots.acquire(blocking=False):
+        return
+    with state.last_good_lock:
+        keys = [key for key in keys if key not in state.refreshing]
+        state.refreshing.update(keys)
+    if not keys:
+        state.refresh_slots.release()
+        return
+
+    def refresh():
+        try:
+            fresh = reload(keys)
+            with state.last_good_lock:
+                state.last_good.update(fresh)
+            count_event(state.read_stats, 'refreshes')
+        except Exception as e:
+            app.logger.warning("Background refresh of %d last good copies failed: %s", len(keys), e)
+        finally:
+            with state.last_good_lock:
+                state.refreshing.difference_update(keys)
+            state.refresh_slots.release()
+
+    _get_refresh_pool().submit(refresh)
+
+def _serve_last_good(keys, reload):
+    """Return {key: copy} for the keys that have a last known good copy, and refresh them all."""
+    count_event(state.read_stats, 'deadline_misses')
+    with state.last_good_lock:
+        found = {key: state.last_good[key] for key in keys if key in state.last_good}
+    _refresh_last_good(keys, reload)
+    return found
+
+def _mark_stale():
+    count_event(state.read_stats, 'stale_served')
+    if has_app_context():
+        g._trackit_stale = True
+
+def query_within_budget(query, last_good_key=None):
+    """Run query within the route's read budget; a miss raises ReadDeadlineExceeded.
+
+    With last_good_key the result is remembered under that key, and a miss
+    serves the remembered result, marked stale, instead of raising.
+    """
+    try:
+        snaps = list(query.stream(timeout=read_timeout()))
+    except Exception as e:
+        if not _is_deadline_error(e):
+            raise
+        if last_good_key is not None:
+            found = _serve_last_good([last_good_key], lambda keys: {
+                last_good_key: list(query.stream(timeout=settings.read_deadline))})
+            if found:
+                _mark_stale()
+                return found[last_good_key]
+        raise ReadDeadlineExceeded("Query missed its deadline") from e
+    if last_good_key is not None:
+        with state.last_good_lock:
+            state.last_good[last_good_key] = snaps
+    return snaps
+
+def served_stale():
+    return has_app_context() and g.get('_trackit_stale', False)
+
+def _reload_docs(keys):
+    refs = [db.collection(collection).document(doc_id) for collection, doc_id in keys]
+    return {(keys[0][0], snap.id): snap for snap in db.get_all(refs, timeout=settings.read_deadline)}
+
+def read_snapshots(collection, doc_ids, timeout=None, partial=False):
+    """Return {id: snapshot} for doc_ids, read within timeout (default: the route's budget).
+
+    Hedged collections are read with hedged_read() and remembered as last known
+    good. When they miss the deadline the remembered copies are returned instead
+    and the response is marked stale. Without a copy for every id this raises
+    ReadDeadlineExceeded, unless partial is set, in which case the ids without
+    one are left out.
+    """
+    if timeout is None:
+        timeout = read_timeout()
+    refs = [db.collection(collection).document(doc_id) for doc_id in doc_ids]
+    if len(refs) == 1:
+        read = lambda t: [refs[0].get(timeout=t)]
+    else:
+        read = lambda t: list(db.get_all(refs, timeout=t))
+    if not is_hedged(collection):
+        return {snap.id: snap for snap in read(timeout)}
+    try:
+        snaps = hedged_read(read, timeout)
+    except Exception as e:
+        if not _is_deadline_error(e):
+            raise
+        found = _serve_last_good([(collection, doc_id) for doc_id in doc_ids], _reload_docs)
+        if len(found) < len(doc_ids) and not partial:
+            raise ReadDeadlineExceeded(f"Reading {collection} missed its deadline") from e
+        if found:
+            _mark_stale()
+        return {doc_id: snap for (_, doc_id), snap in found.items()}
+    with state.last_good_lock:
+        for snap in snaps:
+            state.last_good[(collection, snap.id)] = snap
+    return {snap.id: snap for snap in snaps}
+
+# ---------- Request-scoped identity map ----------
+# Document snapshots read while handling a request are kept on flask.g, so
+# each document is fetched at most once per request. Writes made through the
+# helpers below forget the affected document so later reads see fresh data.
+def _request_docs():
+    if not has_app_context():
+        return None
+    return g.setdefault('_trackit_docs', {})
+
+def get_doc(collection, doc_id):
+    docs = _request_docs()
+    key = (collection, doc_id)
+    if docs is not None and key in docs:
+        return docs[key]
+    snap = read_snapshots(collection, [doc_id])[doc_id]
+    if docs is not None:
+        docs[key] = snap
+    return snap
+
+def get_docs(collection, doc_ids, timeout=None):
+    """Return snapshots for doc_ids in the given order.
+
+    Ids not already in the identity map are fetched with one multi-get bounded
+    by timeout (default: the route's budget). If that read fails, those entries
+    come back as None, or as their last known good copy, so callers can render
+    what they have instead of failing the whole page.
+    """
+    docs = _request_docs()
+    found = {}
+    missing = []
+    for doc_id in doc_ids:
+        key = (collection, doc_id)
+        if docs is not None and key in docs:
+            found[doc_id] = docs[key]
+        elif doc_id not in missing:
+            missing.append(doc_id)
+
+    if missing:
+        try:
+            for snap in read_snapshots(collection, missing, timeout, partial=True).values():
+                found[snap.id] = snap
+                remember_doc(collection, snap)
+        except Exception as e:
+            app.logger.warning("Multi-get of %d %s documents failed: %s", len(missing), collection, e)
+
+    return [found.get(doc_id) for doc_id in doc_ids]
+
+def remember_doc(collection, snap):
+    docs = _request_docs()
+    if docs is not None:
+        docs[(collection, snap.id)] = snap
+
+def forget_doc(collection, doc_id):
+    docs = _request_docs()
+    if docs is not None:
+        docs.pop((collection, doc_id), None)
+
+def run_in_transaction(fn, *args):
+    if isinstance(db, InstrumentedStore):
+        fn = db.trace_transaction(fn)
+    if settings.storage_backend == 'sqlite':
+        return db.run_transaction(fn, *args)
+    return firestore.transactional(fn)(db.transaction(), *args)
+
+BATCH_LIMIT = 500
+
+def commit_writes(writes):
+    """Apply (op, ref, data) tuples in WriteBatch chunks of at most BATCH_LIMIT writes."""
+    for i in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for op, ref, data in writes[i:i + BATCH_LIMIT]:
+            if op == 'delete':
+                batch.delete(ref)
+            else:
+                getattr(batch, op)(ref, data)
+        batch.commit()
+
+# ---------- Class document write buffer ----------
+# Every section of a class shares classes/<code>, so saves at the bell contend
+# on it. The section versions are validators (ETags, analytics, fragments) and
+# stay in the save transaction, which is retried on contention. Other field
+# updates are queued per class and merged (increments summed, other values
+# last-wins), then committed in one batch per window.
+def combine_field_updates(old, new):
+    merged = dict(old)
+    for field, value in new.items():
+        previous = merged.get(field)
+        if isinstance(value, firestore.Increment) and isinstance(previous, firestore.Increment):
+            value = firestore.Increment(previous.value + value.value)
+        merged[field] = value
+    return merged
+
+def commit_class_updates(updates):
+    batch = db.batch()
+    for class_code, fields in updates.items():
+        batch.update(db.collection('classes').document(class_code), fields)
+    batch.commit()
+
+def is_contention_error(error):
+    return isinstance(error, (api_exceptions.Aborted, api_exceptions.ResourceExhausted,
+                              api_exceptions.DeadlineExceeded, api_exceptions.ServiceUnavailable))
+
+def run_contended_transaction(fn, *args):
+    """run_in_transaction, retried with jittered exponential backoff while the commit is contended."""
+    for attempt in range(1, settings.class_write_attempts + 1):
+        try:
+            return run_in_transaction(fn, *args)
+        except Exception as e:
+            if attempt >= settings.class_write_attempts or not is_contention_error(e):
+                raise
+            app.logger.info("Transaction contended (attempt %d): %s", attempt, e)
+            time.sleep(min(1.0, 0.05 * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+
+def _observe_class_flush(updates, attempts):
+    CLASS_WRITE_COALESCED.observe(('class',), updates)
+    CLASS_WRITE_ATTEMPTS_USED.observe(('class',), attempts)
+
+def open_class_writer():
+    return CoalescingWriter(commit_class_updates, combine_field_updates, window=settings.class_write_window_ms / 1000,
+                            is_retryable=is_contention_error, max_attempts=settings.class_write_attempts,
+                            on_flush=_observe_class_flush, logger=app.logger)
+
+def update_classes(updates):
+    """Apply {class_code: field updates} through the write buffer; returns once committed.
+
+    Only for fields nothing is validated against: a buffered update can land
+    after the write it belongs to, so section versions are never sent here.
+
+    Raises NotFound for an unknown class, or the last error once retries run out.
+    """
+    started = time.perf_counter()
+    futures = [state.class_writer.submit(code, fields) for code, fields in updates.items()]
+    try:
+        for future in futures:
+            future.result(timeout=settings.class_write_timeout)
+    finally:
+        CLASS_WRITE_SECONDS.observe(('class',), time.perf_counter() - started)
+        for code in updates:
+            forget_doc('classes', code)
+
+def invalidate_user(user_id):
+    forget_doc('users', user_id)
+    with state.user_cache_lock:
+        state.user_cache.pop(user_id, None)
+
+def get_user_doc(user_id):
+    return get_doc('users', user_id)
+
+def get_users_by_ids(user_ids):
+    """Return {user_id: profile} for user_ids; cache misses are fetched in one multi-get."""
+    profiles = {}
+    missing = []
+    with state.user_cache_lock:
+        for uid in user_ids:
+            if uid in state.user_cache:
+                profiles[uid] = state.user_cache[uid]
+            elif uid not in missing:
+                missing.append(uid)
+
+    if missing:
+        fetched = {}
+        for snap in read_snapshots('users', missing).values():
+            if snap.exists:
+                data = snap.to_dict()
+                data.pop('password_hash', None)
+                fetched[snap.id] = data
+        if not served_stale():
+            with state.user_cache_lock:
+                state.user_cache.update(fetched)
+        profiles.update(fetched)
+
+    return profiles
+
+def email_index_ref(email):
+    return db.collection('user_emails').document(quote(email, safe='@+'))
+
 def get_user_by_email(email):
+    with state.email_misses_lock:
+        if email in state.email_misses:
+            return None
+
+    idx = email_index_ref(email).get()
+    if idx.exists:
+        doc = get_user_doc(idx.to_dict().get('user_id', ''))
+        if doc.exists:
+            return doc
+
+    # Accounts created before the index existed: find them once and index them.
     docs = list(db.collection('users').where('email', '==', email).limit(1).stream())
-    return docs[0] if docs else None
+    if docs:
+        email_index_ref(email).set({'user_id': docs[0].id})
+        return docs[0]
+
+    with state.email_misses_lock:
+        state.email_misses[email] = True
+    return None
+
+def _create_user_txn(transaction, data):
+    user_ref = db.collection('users').document()
+    # create() fails if the email is already indexed, which makes the
+    # duplicate check race-free across concurrent signups.
+    transaction.create(email_index_ref(data['email']), {'user_id': user_ref.id})
+    transaction.create(user_ref, dict(data, created_at=firestore.SERVER_TIMESTAMP))
+    return user_ref.id
+
+def insert_user(data):
+    """Create the user and its email index entry; return the new id, or None if the email is taken."""
+    try:
+        user_id = run_in_transaction(_create_user_txn, data)
+    except api_exceptions.AlreadyExists:
+        return None
+    with state.email_misses_lock:
+        state.email_misses.pop(data['email'], None)
+    state.user_index.upsert(user_id, data)
+    return user_id
+
+# ---------- User search ----------
+def load_user_index(index):
+    """Read the searchable fields of every user, one page at a time, into index."""
+    started = time.perf_counter()
+    query = (db.collection('users').select(list(USER_INDEX_FIELDS))
+             .order_by('__name__').limit(settings.user_index_page_size))
+    users, last = [], None
+    while True:
+        page = (query.start_after(last) if last is not None else query).get()
+        users.extend((snap.id, snap.to_dict()) for snap in page)
+        if len(page) < settings.user_index_page_size:
+            break
+        last = page[-1]
+    index.load(users)
+    STARTUP_SECONDS['user_index'] = time.perf_counter() - started
+    startup_log.info("pid %d indexed %d users in %.0f ms", os.getpid(), len(users),
+                     STARTUP_SECONDS['user_index'] * 1000)
+
+def watch_new_users(index, since):
+    """Upsert users created by other workers (Firestore only)."""
+    def on_snapshot(docs, changes, read_time):
+        for change in changes:
+            if change.type.name != 'REMOVED':
+                index.upsert(change.document.id, change.document.to_dict() or {})
+
+    db.collection('users').where('created_at', '>=', since).on_snapshot(on_snapshot)
+
+def _build_user_index(index):
+    try:
+        since = datetime.now(timezone.utc)
+        if settings.storage_backend == 'firestore':
+            watch_new_users(index, since)
+        load_user_index(index)
+    except Exception:
+        app.logger.exception("Building the user search index failed")
+        with state.user_index_lock:
+            state.user_index_started = False
+
+def start_user_index():
+    """Load this process's user index in the background (once per process)."""
+    with state.user_index_lock:
+        if state.user_index_started:
+            return
+        state.user_index_started = True
+    threading.Thread(target=_build_user_index, args=(state.user_index,), name='trackit-user-index', daemon=True).start()
 
 def create_user_record(name, email, pw_hash, role, extra_id_field=None):
     data = {
@@ -54,7 +731,7 @@ def create_user_record(name, email, pw_hash, role, extra_id_field=None):
         data['student_id'] = extra_id_field or ''
     if role == 'teacher':
         data['teacher_id'] = extra_id_field or ''
-    return db.collection('users').add(data)
+    return insert_user(data)
 
 def create_user_record_student(name, email, pw_hash, role, extra_id_field=None, gender=None):
     data = {
@@ -69,52 +746,108 @@ def create_user_record_student(name, email, pw_hash, role, extra_id_field=None,
         data['student_id'] = extra_id_field or ''
     if role == 'teacher':
         data['teacher_id'] = extra_id_field or ''
-    return db.collection('users').add(data)
+    return insert_user(data)
 
 def get_class_doc(class_code):
-    return db.collection('classes').document(class_code).get()
+    return get_doc('classes', class_code)
 
 def create_class(class_code, subject_name, sections):
     sections_map = {}
     for s in sections:
         if s.strip():
-            sections_map[s.strip()] = {"teacher": None, "students": [], "attendance": {}}
+            sections_map[s.strip()] = {"teacher": None, "students": []}
 
     new_class = {
         "classCode": class_code,
         "subjectName": subject_name,
-        "sections": sections_map
+        "sections": sections_map,
+        "student_count": 0,
+        "teacher_count": 0,
+        # Section versions restart when a class is (re)created; the generation
+        # keeps fragment cache keys from the old class from matching.
+        "generation": uuid.uuid4().hex
     }
     db.collection('classes').document(class_code).set(new_class)
+    forget_doc('classes', class_code)
     return new_class
 
-def add_section_if_missing(class_code, section):
+def _claim_section_txn(transaction, teacher_id, class_code, section, subject):
     class_ref = db.collection('classes').document(class_code)
-    doc = class_ref.get()
-    if not doc.exists:
-        return False
-
-    sections = doc.to_dict().get('sections', {})
-    if section not in sections:
-        class_ref.update({
-            f"sections.{section}": {"teacher": None, "students": [], "attendance": {}}
+    snap = class_ref.get(transaction=transaction)
+    if not snap.exists:
+        transaction.set(class_ref, {
+            "classCode": class_code,
+            "subjectName": subject or class_code,
+            "sections": {section: {"teacher": teacher_id, "students": []}},
+            "student_count": 0,
+            "teacher_count": 1,
+            "generation": uuid.uuid4().hex
         })
-    return True
+    else:
+        sec_data = snap.to_dict().get('sections', {}).get(section)
+        if sec_data is None:
+            updates = {f"sections.{section}": {"teacher": teacher_id, "students": [], "version": 1}}
+        else:
+            updates = {f"sections.{section}.teacher": teacher_id,
+                       f"sections.{section}.version": firestore.Increment(1)}
+        if not (sec_data or {}).get('teacher'):
+            updates['teacher_count'] = firestore.Increment(1)
+        transaction.update(class_ref, updates)
+    transaction.update(db.collection('users').document(teacher_id), {
+        'classes': firestore.ArrayUnion([{'class_code': class_code, 'section': section}])
+    })
+    return not snap.exists
+
+def claim_section(teacher_id, class_code, section, subject=None):
+    """Create the class/section if needed and assign the teacher, in one commit.
+
+    Returns True if the class was created.
+    """
+    created = run_in_transaction(_claim_section_txn, teacher_id, class_code, section, subject)
+    forget_doc('classes', class_code)
+    invalidate_user(teacher_id)
+    return created
 
 def add_class_to_user(user_id, class_code, section):
     db.collection('users').document(user_id).update({
         'classes': firestore.ArrayUnion([{'class_code': class_code, 'section': section}])
     })
+    invalidate_user(user_id)
+
+# student_count / teacher_count on the class document are denormalized totals
+# for the admin listing; they only change when a section gains a new student
+# or its first teacher, so both writes check the current section first.
+def _assign_teacher_txn(transaction, teacher_id, class_code, section):
+    class_ref = db.collection('classes').document(class_code)
+    snap = class_ref.get(transaction=transaction)
+    sec_data = snap.to_dict().get('sections', {}).get(section, {}) if snap.exists else {}
+
+    updates = {f"sections.{section}.teacher": teacher_id,
+               f"sections.{section}.version": firestore.Increment(1)}
+    if not sec_data.get('teacher'):
+        updates['teacher_count'] = firestore.Increment(1)
+    transaction.update(class_ref, updates)
 
 def assign_teacher_to_section(teacher_id, class_code, section):
-    db.collection('classes').document(class_code).update({
-        f"sections.{section}.teacher": teacher_id
+    run_in_transaction(_assign_teacher_txn, teacher_id, class_code, section)
+    forget_doc('classes', class_code)
+
+def _add_student_txn(transaction, student_id, class_code, section):
+    class_ref = db.collection('classes').document(class_code)
+    snap = class_ref.get(transaction=transaction)
+    sec_data = snap.to_dict().get('sections', {}).get(section, {}) if snap.exists else {}
+    if student_id in sec_data.get('students', []):
+        return
+
+    transaction.update(class_ref, {
+        f"sections.{section}.students": firestore.ArrayUnion([student_id]),
+        f"sections.{section}.version": firestore.Increment(1),
+        'student_count': firestore.Increment(1)
     })
 
 def add_student_to_section(student_id, class_code, section):
-    db.collection('classes').document(class_code).update({
-        f"sections.{section}.students": firestore.ArrayUnion([student_id])
-    })
+    run_in_transaction(_add_student_txn, student_id, class_code, section)
+    forget_doc('classes', class_code)
 
 def get_sections(class_code):
     doc = get_class_doc(class_code)
@@ -128,12 +861,13 @@ def get_students_in_section(class_code, section):
         return []
 
     sec_data = doc.to_dict().get('sections', {}).get(section, {})
+    student_ids = sec_data.get('students', [])
+    profiles = get_users_by_ids(student_ids)
     students = []
 
-    for sid in sec_data.get('students', []):
-        s_doc = db.collection('users').document(sid).get()
-        if s_doc.exists:
-            s_data = s_doc.to_dict()
+    for sid in student_ids:
+        s_data = profiles.get(sid)
+        if s_data is not None:
             students.append({
                 'id': sid,
                 'name': s_data.get('name', 'Unknown')
@@ -141,69 +875,410 @@ def get_students_in_section(class_code, section):
 
     return students
 
+# ---------- Attendance history ----------
+# Each attendance day is its own document at
+# classes/<class_code>/sections/<section>/attendance/<YYYY-MM-DD>
+# holding {'date', 'records'}, so class documents stay small and history can
+# be read by date range a page at a time.
+def section_ref(class_code, section):
+    return db.collection('classes').document(class_code).collection('sections').document(section)
+
+def attendance_collection(class_code, section):
+    return section_ref(class_code, section).collection('attendance')
+
+# ---------- Packed attendance days ----------
+# A packed day is {'date', 'format': 'packed', 'count', 'codes', 'extra'}:
+# codes holds one 2-bit status per student, four per byte, in the order of
+# the append-only roster on the section document (classes/<code>/sections/<sec>).
+# 0 means no record. Unknown statuses and extra record fields go in 'extra'
+# keyed by student id.
+STATUS_CODES = {'present': 1, 'absent': 2, 'excused': 3}
+CODE_STATUSES = {code: status for status, code in STATUS_CODES.items()}
+_UNPACKED_BYTES = [tuple((b >> shift) & 3 for shift in (0, 2, 4, 6)) for b in range(256)]
+
+def pack_attendance(records, roster):
+    """Return a packed day body for records. Unknown students are appended to roster in place."""
+    index = {sid: i for i, sid in enumerate(roster)}
+    codes, extra = {}, {}
+    for rec in records:
+        sid = rec.get('student_id')
+        if not sid:
+            continue
+        if sid not in index:
+            index[sid] = len(roster)
+            roster.append(sid)
+        code = STATUS_CODES.get(rec.get('status'), 0)
+        codes[index[sid]] = code
+        rest = {k: v for k, v in rec.items() if k != 'student_id' and (k != 'status' or not code)}
+        if rest:
+            extra[sid] = rest
+        else:
+            extra.pop(sid, None)
+
+    packed = bytearray((len(roster) + 3) // 4)
+    for i, code in codes.items():
+        packed[i >> 2] |= code << ((i & 3) * 2)
+    body = {'format': 'packed', 'count': len(roster), 'codes': bytes(packed)}
+    if extra:
+        body['extra'] = extra
+    return body
+
+def unpack_attendance(data, roster):
+    """Records for a packed day body, in roster order."""
+    count = min(data.get('count', 0), len(roster))
+    codes = [c for b in data.get('codes', b'') for c in _UNPACKED_BYTES[b]]
+    extra = data.get('extra', {})
+    records = []
+    for sid, code in zip(roster[:count], codes):
+        if code:
+            records.append({'student_id': sid, 'status': CODE_STATUSES[code], **extra.get(sid, {})})
+    coded = {r['student_id'] for r in records}
+    records.extend({'student_id': sid, **rest} for sid, rest in extra.items() if sid not in coded)
+    return records
+
+def is_packed(data):
+    return data.get('format') == 'packed'
+
+def day_records(data, roster):
+    return unpack_attendance(data, roster) if is_packed(data) else data.get('records', [])
+
+def encode_day(date_str, records, roster):
+    """Day document body in settings.attendance_format; packing may grow roster."""
+    if settings.attendance_format == 'packed':
+        return {'date': date_str, **pack_attendance(records, roster)}
+    return {'date': date_str, 'records': records}
+
+def get_section_roster(class_code, section):
+    snap = get_doc(f"classes/{class_code}/sections", section)
+    return (snap.to_dict() or {}).get('roster', []) if snap.exists else []
+
+def get_attendance_page(class_code, section, date_from=None, date_to=None,
+                        limit=settings.attendance_page_size, cursor=None, newest_first=False, last_good=False):
+    """Return (days, next_cursor) with days sorted by date; next_cursor is None on the last page.
+
+    With newest_first the pages walk back in time, each continuing before its cursor.
+    With last_good a page that misses its deadline is served from the last copy read.
+    """
+    query = attendance_collection(class_code, section)
+    if date_from:
+        query = query.where('date', '>=', date_from)
+    if date_to:
+        query = query.where('date', '<=', date_to)
+    query = query.order_by('date', direction=firestore.Query.DESCENDING if newest_first else firestore.Query.ASCENDING)
+    if cursor:
+        query = query.start_after({'date': cursor})
+
+    key = ('attendance_page', class_code, section, date_from, date_to, limit, cursor, newest_first) if last_good else None
+    docs = [d.to_dict() | {'id': d.id} for d in query_within_budget(query.limit(limit + 1), key)]
+    page = docs[:limit]
+    roster = get_section_roster(class_code, section) if any(is_packed(d) for d in page) else []
+    days = [{'date': d['id'], 'records': day_records(d, roster)} for d in page]
+    next_cursor = days[-1]['date'] if len(docs) > limit else None
+    return days, next_cursor
+
+def iter_section_attendance(class_code, section, date_from=None, date_to=None,
+                            page_size=settings.attendance_page_size):
+    """Yield attendance days in date order, reading one page at a time."""
+    cursor = None
+    while True:
+        days, cursor = get_attendance_page(class_code, section, date_from, date_to, page_size, cursor)
+        yield from days
+        if cursor is None:
+            return
+
+# ---------- Attendance counters ----------
+# Per-student, per-section totals live in the attendance_counters collection
+# and are kept current by save_attendance_to_section, so summaries never have
+# to walk the attendance history.
+ATTENDANCE_STATUSES = ('present', 'absent', 'excused')
+
+def counter_doc_id(student_id, class_code, section):
+    return f"{student_id}__{class_code}__{section}"
+
+def attendance_deltas(old_records, new_records):
+    """Return {student_id: {status: delta}} for replacing old_records with new_records."""
+    old = {r.get('student_id'): r.get('status') for r in old_records or [] if r.get('student_id')}
+    new = {r.get('student_id'): r.get('status') for r in new_records or [] if r.get('student_id')}
+    deltas = {}
+    for sid in set(old) | set(new):
+        before, after = old.get(sid), new.get(sid)
+        if before == after:
+            continue
+        d = {}
+        if before in ATTENDANCE_STATUSES:
+            d[before] = -1
+        if after in ATTENDANCE_STATUSES:
+            d[after] = 1
+        if d:
+            deltas[sid] = d
+    return deltas
+
+def apply_counter_deltas(writer, class_code, section, deltas):
+    for sid, d in deltas.items():
+        ref = db.collection('attendance_counters').document(counter_doc_id(sid, class_code, section))
+        data = {'student_id': sid, 'class_code': class_code, 'section': section}
+        for status, n in d.items():
+            data[status] = firestore.Increment(n)
+        writer.set(ref, data, merge=True)
+
+def merge_attendance(old_records, patch):
+    """Apply per-student patch records on top of old_records; a null status removes the student."""
+    merged = {}
+    for rec in old_records:
+        if rec.get('student_id'):
+            merged[rec['student_id']] = rec
+    for rec in patch:
+        sid = rec['student_id']
+        if rec.get('status') is None:
+            merged.pop(sid, None)
+        else:
+            merged[sid] = {**merged.get(sid, {}), **rec}
+    return list(merged.values())
+
+def _write_attendance_txn(transaction, entries, idempotency=None):
+    """Apply attendance entries in one transaction; return {(class_code, section): deltas}.
+
+    Each entry is {class_code, section, date, mode, attendance} where mode is
+    'replace' (the list becomes the day's records) or 'merge' (per-student
+    patch). Entries for the same day are applied in order.
+    """
+    refs, keys = {}, {}
+    for e in entries:
+        ref = attendance_collection(e['class_code'], e['section']).document(e['date'])
+        refs.setdefault(ref.path, ref)
+        keys[ref.path] = (e['class_code'], e['section'], e['date'])
+
+    # Packed days decode against the section roster, read in the same transaction.
+    sections = {(e['class_code'], e['section']) for e in entries}
+    roster_refs = {section_ref(*key).path: key for key in sections} if settings.attendance_format == 'packed' else {}
+    rosters = {}
+    stored = {}
+    read_refs = list(refs.values()) + [section_ref(*key) for key in roster_refs.values()]
+    for snap in db.get_all(read_refs, transaction=transaction):
+        if snap.reference.path in roster_refs:
+            rosters[roster_refs[snap.reference.path]] = (snap.to_dict() or {}).get('roster', []) if snap.exists else []
+        elif snap.exists:
+            stored[snap.reference.path] = snap.to_dict()
+
+    def roster_for(key):
+        if key not in rosters:
+            snap = section_ref(*key).get(transaction=transaction)
+            rosters[key] = (snap.to_dict() or {}).get('roster', []) if snap.exists else []
+        return rosters[key]
+
+    original = {path: [] for path in refs}
+    for path, data in stored.items():
+        original[path] = day_records(data, roster_for(keys[path][:2]) if is_packed(data) else [])
+
+    current = dict(original)
+    for e in entries:
+        path = attendance_collection(e['class_code'], e['section']).document(e['date']).path
+        if e.get('mode') == 'merge':
+            current[path] = merge_attendance(current[path], e['attendance'])
+        else:
+            current[path] = e['attendance']
+
+    roster_sizes = {key: len(roster) for key, roster in rosters.items()}
+    totals = {}
+    for path, records in current.items():
+        class_code, section, date_str = keys[path]
+        roster = roster_for((class_code, section)) if settings.attendance_format == 'packed' else None
+        transaction.set(refs[path], encode_day(date_str, records, roster))
+        section_totals = totals.setdefault((class_code, section), {})
+        day_totals = dict.fromkeys(ATTENDANCE_STATUSES, 0)
+        for sid, d in attendance_deltas(original[path], records).items():
+            bucket = section_totals.setdefault(sid, {})
+            for status, n in d.items():
+                bucket[status] = bucket.get(status, 0) + n
+                if status in day_totals:
+                    day_totals[status] += n
+        apply_rollup_deltas(transaction, class_code, section, date_str, day_totals)
+
+    for (class_code, section), section_totals in totals.items():
+        deltas = {}
+        for sid, d in section_totals.items():
+            d = {status: n for status, n in d.items() if n}
+            if d:
+                deltas[sid] = d
+        section_totals.clear()
+        section_totals.update(deltas)
+        apply_counter_deltas(transaction, class_code, section, deltas)
+
+    for key, roster in rosters.items():
+        if len(roster) != roster_sizes.get(key, 0):
+            transaction.set(section_ref(*key), {'roster': roster}, merge=True)
+
+    # Bumping the section's version also moves the class doc's update_time,
+    # which the API ETags are derived from, so it commits with the attendance.
+    bumps = {}
+    for class_code, section in totals:
+        bumps.setdefault(class_code, {}).update({
+            f"sections.{section}.attendance_version": firestore.Increment(1),
+            f"sections.{section}.version": firestore.Increment(1),
+        })
+    for class_code, fields in bumps.items():
+        transaction.update(db.collection('classes').document(class_code), fields)
+
+    if idempotency is not None:
+        transaction.create(*idempotency)
+    return totals
+
+def write_attendance(entries, idempotency=None):
+    totals = run_contended_transaction(_write_attendance_txn, entries, idempotency)
+    for class_code, section in totals:
+        forget_doc('classes', class_code)
+    state.attendance_broker.source.publish(totals)
+    return totals
+
 def save_attendance_to_section(class_code, section, date_str, attendance_list):
-    db.collection('classes').document(class_code).update({
-        f"sections.{section}.attendance.{date_str}": attendance_list
-    })
+    write_attendance([{'class_code': class_code, 'section': section, 'date': date_str,
+                       'mode': 'replace', 'attendance': attendance_list}])
+
+# ---------- Attendance rollups ----------
+# rollups_daily/<date>__<class>__<section> holds per-day status totals for a
+# section. It is updated by the same transaction as the attendance day, and
+# each update also bumps a rollup_dirty marker. compact_rollups() turns dirty
+# markers into rollups_weekly, rollups_term and school-wide rollups_school docs.
+def rollup_id(date_str, class_code, section):
+    return f"{date_str}__{class_code}__{section}"
+
+def week_of(date_str):
+    year, week, _ = date.fromisoformat(date_str).isocalendar()
+    return f"{year}-W{week:02d}"
+
+def term_of(date_str):
+    """Start date of the configured term containing date_str, or YYYY-H1 / YYYY-H2."""
+    if settings.term_starts:
+        started = [t for t in settings.term_starts if t <= date_str]
+        return started[-1] if started else None
+    return f"{date_str[:4]}-H{1 if date_str[5:7] <= '06' else 2}"
+
+def apply_rollup_deltas(writer, class_code, section, date_str, day_totals):
+    changed = {status: n for status, n in day_totals.items() if n}
+    if not changed:
+        return
+    rid = rollup_id(date_str, class_code, section)
+    key = {'date': date_str, 'class_code': class_code, 'section': section}
+    data = dict(key, week=week_of(date_str), term=term_of(date_str))
+    for status, n in changed.items():
+        data[status] = firestore.Increment(n)
+    writer.set(db.collection('rollups_daily').document(rid), data, merge=True)
+    writer.set(db.collection('rollup_dirty').document(rid), dict(key, rev=firestore.Increment(1)), merge=True)
+
+# ---------- Bulk attendance ingest ----------
+# Each transaction stays under Firestore's 500-write limit. The estimate counts,
+# per day: the day document, its daily rollup and its rollup marker; one write
+# per distinct (student, section) counter; per section, a possible roster
+# update; and per class, one class-doc version bump.
+BULK_WRITE_BUDGET = 450
+
+def estimated_attendance_writes(days, students):
+    sections = {(class_code, section) for class_code, section, _ in days}
+    classes = {class_code for class_code, _ in sections}
+    return 3 * len(days) + len(students) + len(sections) + len(classes)
+
+def validate_attendance_entries(payload):
+    """Return (entries, errors) for a bulk ingest payload."""
+    raw = payload.get('entries') if isinstance(payload, dict) else None
+    if not isinstance(raw, list) or not raw:
+        return [], [{'entry': None, 'error': 'Expected a non-empty entries list'}]
+    if len(raw) > settings.bulk_attendance_max_entries:
+        return [], [{'entry': None, 'error': f'At most {settings.bulk_attendance_max_entries} entries per request'}]
+
+    entries, errors = [], []
+    for i, e in enumerate(raw):
+        if not isinstance(e, dict):
+            errors.append({'entry': i, 'error': 'Entry must be an object'})
+            continue
+        class_code = str(e.get('class_code') or '').strip().upper()
+        section = str(e.get('section') or '').strip()
+        date_str = str(e.get('date') or '').strip()
+        mode = e.get('mode', 'replace')
+        records = e.get('attendance')
+        try:
+            datetime.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            errors.append({'entry': i, 'error': 'date must be YYYY-MM-DD'})
+            continue
+        if not class_code or not section:
+            errors.append({'entry': i, 'error': 'class_code and section are required'})
+            continue
+        if mode not in ('replace', 'merge'):
+            errors.append({'entry': i, 'error': "mode must be 'replace' or 'merge'"})
+            continue
+        if not isinstance(records, list):
+            errors.append({'entry': i, 'error': 'attendance must be a list'})
+            continue
+        allowed = ATTENDANCE_STATUSES + ((None,) if mode == 'merge' else ())
+        if any(not isinstance(r, dict) or not r.get('student_id') or r.get('status') not in allowed
+               for r in records):
+            errors.append({'entry': i, 'error': 'Each record needs student_id and a valid status'})
+            continue
+        entries.append({'class_code': class_code, 'section': section, 'date': date_str,
+                        'mode': mode, 'attendance': records})
+    return entries, errors
+
+def plan_attendance_chunks(entries):
+    """Split entries into transactions whose estimated write count fits BULK_WRITE_BUDGET."""
+    ordered = sorted(entries, key=lambda e: (e['class_code'], e['section'], e['date']))
+    chunks, chunk, days, students = [], [], set(), set()
+    for e in ordered:
+        day = (e['class_code'], e['section'], e['date'])
+        sids = {(e['class_code'], e['section'], r['student_id']) for r in e['attendance']}
+        if chunk and estimated_attendance_writes(days | {day}, students | sids) > BULK_WRITE_BUDGET:
+            chunks.append(chunk)
+            chunk, days, students = [], set(), set()
+        chunk.append(e)
+        days.add(day)
+        students |= sids
+    if chunk:
+        chunks.append(chunk)
+    return chunks
 
 def get_attendance_summary_for_student(user_id):
-    user_doc = db.collection('users').document(user_id).get()
+    user_doc = get_user_doc(user_id)
     if not user_doc.exists:
         return []
 
     classes = user_doc.to_dict().get('classes', [])
     results = []
 
-    for entry in classes:
+    class_docs = get_docs('classes', [entry.get('class_code') for entry in classes])
+    counter_docs = get_docs('attendance_counters', [
+        counter_doc_id(user_id, entry.get('class_code'), entry.get('section')) for entry in classes
+    ])
+
+    for entry, class_doc, counter_doc in zip(classes, class_docs, counter_docs):
         class_code = entry.get('class_code')
         section = entry.get('section')
 
-        class_doc = get_class_doc(class_code)
-        if not class_doc.exists:
+        # A failed read (None) still lists the class; a deleted class is skipped.
+        if class_doc is not None and not class_doc.exists:
             continue
 
-        cd = class_doc.to_dict()
-        subject = cd.get('subjectName', '')
-
-        attendance_map = cd.get('sections', {}).get(section, {}).get('attendance', {})
-
-        present = absent = excused = 0
-
-        for date_key, records in attendance_map.items():
-            for rec in records:
-                if rec.get('student_id') != user_id:
-                    continue
-                if rec.get('status') == 'present':
-                    present += 1
-                elif rec.get('status') == 'absent':
-                    absent += 1
-                elif rec.get('status') == 'excused':
-                    excused += 1
+        if counter_doc is None:
+            # No copy at all, not even a stale one; zeros would look like real counts.
+            raise ReadDeadlineExceeded("Reading attendance counters failed")
+        subject = class_doc.to_dict().get('subjectName', '') if class_doc is not None else ''
+        counts = counter_doc.to_dict() if counter_doc.exists else {}
 
         results.append({
             'class_code': class_code,
             'subjectName': subject,
             'section': section,
-            'present': present,
-            'absent': absent,
-            'excused': excused
+            'present': counts.get('present', 0),
+            'absent': counts.get('absent', 0),
+            'excused': counts.get('excused', 0)
         })
 
     return results
 
-def count_students_and_teachers(class_code):
-    doc = get_class_doc(class_code)
-    if not doc.exists:
-        return {'student_count': 0, 'teacher_count': 0}
-
-    d = doc.to_dict()
-    secs = d.get('sections', {})
+def tally_class_counts(class_data):
+    secs = class_data.get('sections', {})
 
     student_count = 0
     teacher_count = 0
 
-
-
     for sec_name, sec_data in secs.items():
         student_count += len(sec_data.get('students', []))
         if sec_data.get('teacher'):
@@ -211,21 +1286,771 @@ def count_students_and_teachers(class_code):
 
     return {'student_count': student_count, 'teacher_count': teacher_count}
 
-
-
-def count_students_in_section(class_code, section):
+def count_students_and_teachers(class_code):
     doc = get_class_doc(class_code)
     if not doc.exists:
-        return 0
+        return {'student_count': 0, 'teacher_count': 0}
 
-    sections = doc.to_dict().get('sections', {})
-    section_data = sections.get(section, {})
-    return len(section_data.get('students', []))
+    d = doc.to_dict()
+    if 'student_count' in d and 'teacher_count' in d:
+        return {'student_count': d['student_count'], 'teacher_count': d['teacher_count']}
+    return tally_class_counts(d)
+
+# ---------- Conditional GET ----------
+# API ETags hash the update times of the documents a response is built from,
+# so a matching If-None-Match is answered before any aggregation runs.
+def make_etag(*parts):
+    return hashlib.sha1('\x1f'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+def student_summary_etag(user_id, kind):
+    """ETag for the student summaries, or None if a class read failed.
+
+    Counters only change together with their class doc (attendance_version),
+    so the user doc and class docs are enough to validate the summary.
+    """
+    user_doc = get_user_doc(user_id)
+    if not user_doc.exists:
+        return make_etag(kind, user_id, 'missing')
+    classes = user_doc.to_dict().get('classes', [])
+    class_docs = get_docs('classes', [entry.get('class_code') for entry in classes])
+    if any(doc is None for doc in class_docs):
+        return None
+    return make_etag(kind, user_id, user_doc.update_time,
+                     *(f"{doc.id}@{doc.update_time if doc.exists else '-'}" for doc in class_docs))
+
+def conditional_json(etag, build):
+    """jsonify(build()) with an ETag; answers a matching If-None-Match with 304 without calling build.
+
+    A response built from stale copies gets no ETag and is not stored: its
+    ETag could match the fresh body and keep the stale one cached after recovery.
+    """
+    if etag is not None and not served_stale() and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    if served_stale():
+        response.headers['Cache-Control'] = 'no-store'
+    else:
+        if etag is not None:
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+# ---------- Admin class listing ----------
+ADMIN_SORT_FIELDS = {
+    'code': 'classCode',
+    'subject': 'subjectName',
+    'students': 'student_count',
+    'teachers': 'teacher_count',
+}
+
+def list_classes_page(sort='code', direction='asc', limit=settings.admin_page_size, cursor=None):
+    """Return (classes, next_cursor) for one page of the admin listing.
+
+    The cursor is the class code of the last row on the previous page, so each
+    page costs one query of limit + 1 documents plus one cursor lookup.
+    """
+    field = ADMIN_SORT_FIELDS.get(sort, 'classCode')
+    order = firestore.Query.DESCENDING if direction == 'desc' else firestore.Query.ASCENDING
+    query = db.collection('classes').order_by(field, direction=order)
+    if cursor:
+        cursor_doc = get_class_doc(cursor)
+        if cursor_doc.exists:
+            query = query.start_after(cursor_doc)
+
+    docs = query_within_budget(query.limit(limit + 1))
+    classes = []
+    for c in docs[:limit]:
+        remember_doc('classes', c)
+        cdict = c.to_dict()
+        cdict.update(count_students_and_teachers(c.id))
+        classes.append(cdict)
+    next_cursor = docs[limit - 1].id if len(docs) > limit else None
+    return classes, next_cursor
+
+# ---------- Rendered fragments ----------
+def fragment_version(class_data, section=None):
+    """Cache key part for a class (all sections) or one section of it."""
+    sections = class_data.get('sections', {})
+    if section is not None:
+        return (class_data.get('generation'), section, sections.get(section, {}).get('version', 0))
+    return (class_data.get('generation'),) + tuple(sorted((sec, data.get('version', 0)) for sec, data in sections.items()))
+
+def cached_fragment(template, key, build):
+    """Return template rendered with build()'s context, cached per (template, key).
+
+    key must identify the class/section and include fragment_version(); build
+    only runs on a miss, so the data it assembles is skipped on a hit too.
+    """
+    key = (template,) + key
+    with state.fragment_cache_lock:
+        html = state.fragment_cache.get(key)
+    if html is not None:
+        count_event(state.fragment_stats, 'hits')
+        return html
+    count_event(state.fragment_stats, 'misses')
+    html = Markup(render_template(template, **build()))
+    with state.fragment_cache_lock:
+        state.fragment_cache[key] = html
+    return html
+
+def class_card(template, class_code, section, class_doc):
+    """A teacher's card for one section; class_doc may be None or missing."""
+    if class_doc is None or not class_doc.exists:
+        return Markup(render_template(template, c={'class_code': class_code, 'section': section,
+                                                   'subjectName': '', 'student_count': 0}))
+    cd = class_doc.to_dict()
+    return cached_fragment(template, (class_code,) + fragment_version(cd, section), lambda: {'c': {
+        'class_code': class_code,
+        'section': section,
+        'subjectName': cd.get('subjectName', ''),
+        'student_count': len(cd.get('sections', {}).get(section, {}).get('students', [])),
+    }})
+
+# ---------- Roster import ----------
+# Rows are {name, email, password, role, student_id/teacher_id, gender,
+# class_code, section}. Several rows may share an email to enroll one user in
+# several sections. The whole file is validated before anything is written.
+ROSTER_ROLES = ('student', 'teacher')
+
+def parse_roster_rows(upload, payload):
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+        return list(csv.DictReader(io.StringIO(text)))
+    if isinstance(payload, dict):
+        payload = payload.get('rows')
+    if not isinstance(payload, list) or not all(isinstance(r, dict) for r in payload):
+        raise ValueError("Expected a CSV upload or a JSON list of rows")
+    return payload
+
+def _normalize_roster_row(raw):
+    row = {k: (str(v).strip() if v is not None else '') for k, v in raw.items() if k}
+    row['email'] = row.get('email', '').lower()
+    row['role'] = row.get('role', '').lower() or 'student'
+    row['class_code'] = row.get('class_code', '').upper()
+    return row
+
+EMAIL_IN_CHUNK = 30  # Firestore's limit on values in an 'in' filter
+
+def validate_roster(rows):
+    """Return (errors, existing_user_ids, class_docs) for normalized rows."""
+    errors = []
+    roles = {}
+    for i, row in enumerate(rows, start=1):
+        if '@' not in row['email']:
+            errors.append({'row': i, 'error': 'Missing or invalid email'})
+        if row['role'] not in ROSTER_ROLES:
+            errors.append({'row': i, 'error': f"Unknown role '{row['role']}'"})
+        if bool(row.get('class_code')) != bool(row.get('section')):
+            errors.append({'row': i, 'error': 'class_code and section must be given together'})
+        if roles.setdefault(row['email'], row['role']) != row['role']:
+            errors.append({'row': i, 'error': 'Email appears with different roles'})
+    if errors:
+        return errors, {}, {}
+
+    emails = list(dict.fromkeys(row['email'] for row in rows))
+    index_ids = [email_index_ref(e).id for e in emails]
+    existing = {}
+    for email, snap in zip(emails, get_docs('user_emails', index_ids)):
+        if snap is None:
+            return [{'row': None, 'error': 'Could not read the email index, try again'}], {}, {}
+        if snap.exists:
+            existing[email] = snap.to_dict().get('user_id')
+    # Accounts created before the email index existed, as in get_user_by_email().
+    unindexed = [e for e in emails if e not in existing]
+    for i in range(0, len(unindexed), EMAIL_IN_CHUNK):
+        chunk = unindexed[i:i + EMAIL_IN_CHUNK]
+        for snap in db.collection('users').where('email', 'in', chunk).stream(timeout=settings.read_deadline):
+            existing.setdefault(snap.to_dict().get('email'), snap.id)
+
+    codes = list(dict.fromkeys(row['class_code'] for row in rows if row.get('class_code')))
+    class_docs = {}
+    for code, snap in zip(codes, get_docs('classes', codes)):
+        if snap is None:
+            return [{'row': None, 'error': 'Could not read classes, try again'}], {}, {}
+        if snap.exists:
+            class_docs[code] = snap.to_dict()
+
+    seen_new = set()
+    for i, row in enumerate(rows, start=1):
+        if row['email'] not in existing and row['email'] not in seen_new:
+            seen_new.add(row['email'])
+            if not row.get('name') or not row.get('password'):
+                errors.append({'row': i, 'error': 'New users need a name and password'})
+        code, section = row.get('class_code'), row.get('section')
+        if code:
+            if code not in class_docs:
+                errors.append({'row': i, 'error': f"Class {code} not found"})
+            elif section not in class_docs[code].get('sections', {}):
+                errors.append({'row': i, 'error': f"Section {section} not found in {code}"})
+
+    return errors, existing, class_docs
+
+def import_roster(rows, progress=None):
+    """Create users and enrollments in chunked write batches; return per-row results.
+
+    Users that already exist (by email) are not recreated and enrollments they
+    already have are skipped, so a partially failed import can be re-run.
+    """
+    errors, existing, class_docs = validate_roster(rows)
+    if errors:
+        return errors, []
+    if progress is not None:
+        progress({'stage': 'hashing', 'rows': len(rows)})
+
+    # Enrollment state as of the upfront read, updated as rows are planned.
+    section_students = {(code, sec): set(data.get('students', []))
+                        for code, cd in class_docs.items() for sec, data in cd.get('sections', {}).items()}
+    section_teacher = {(code, sec): data.get('teacher')
+                       for code, cd in class_docs.items() for sec, data in cd.get('sections', {}).items()}
+
+    first_rows = {}
+    for row in rows:
+        first_rows.setdefault(row['email'], row)
+    new_emails = [e for e in first_rows if e not in existing]
+    hashes = dict(zip(new_emails, hash_passwords([first_rows[e]['password'] for e in new_emails])))
+
+    # One unit per user: all of its writes land in the same batch.
+    units = {}
+    results = []
+    for i, row in enumerate(rows, start=1):
+        email = row['email']
+        unit = units.get(email)
+        if unit is None:
+            if email in existing:
+                user_ref = db.collection('users').document(existing[email])
+                unit = {'user_ref': user_ref, 'writes': [], 'rows': [], 'new': False, 'classes': []}
+            else:
+                first = first_rows[email]
+                user_ref = db.collection('users').document()
+                data = {
+                    'name': first['name'],
+                    'email': email,
+                    'role': first['role'],
+                    'classes': [],
+                    'password_hash': hashes[email],
+                    f"{first['role']}_id": first.get(f"{first['role']}_id", ''),
+                    'created_at': firestore.SERVER_TIMESTAMP
+                }
+                if first['role'] == 'student':
+                    data['gender'] = first.get('gender', '')
+                unit = {'user_ref': user_ref, 'writes': [], 'rows': [], 'new': True, 'data': data, 'classes': []}
+                unit['writes'].append(('create', email_index_ref(email), {'user_id': user_ref.id}))
+            units[email] = unit
+
+        result = {'row': i, 'email': email, 'user_id': unit['user_ref'].id,
+                  'status': 'created' if unit['new'] else 'exists'}
+        code, section = row.get('class_code'), row.get('section')
+        if code:
+            key = (code, section)
+            class_ref = db.collection('classes').document(code)
+            uid = unit['user_ref'].id
+            if row['role'] == 'student' and uid not in section_students[key]:
+                section_students[key].add(uid)
+                unit['writes'].append(('update', class_ref, {
+                    f"sections.{section}.students": firestore.ArrayUnion([uid]),
+                    f"sections.{section}.version": firestore.Increment(1),
+                    'student_count': firestore.Increment(1)
+                }))
+                unit['classes'].append({'class_code': code, 'section': section})
+                result['enrolled'] = f"{code}/{section}"
+            elif row['role'] == 'teacher' and section_teacher[key] != uid:
+                updates = {f"sections.{section}.teacher": uid,
+                           f"sections.{section}.version": firestore.Increment(1)}
+                if not section_teacher[key]:
+                    updates['teacher_count'] = firestore.Increment(1)
+                section_teacher[key] = uid
+                unit['writes'].append(('update', class_ref, updates))
+                unit['classes'].append({'class_code': code, 'section': section})
+                result['enrolled'] = f"{code}/{section}"
+            else:
+                result['enrolled'] = 'already enrolled'
+        unit['rows'].append(result)
+        results.append(result)
+
+    for unit in units.values():
+        if unit['new']:
+            unit['data']['classes'] = unit['classes']
+            unit['writes'].append(('create', unit['user_ref'], unit['data']))
+        elif unit['classes']:
+            unit['writes'].append(('update', unit['user_ref'], {
+                'classes': firestore.ArrayUnion(unit['classes'])
+            }))
+
+    # Pack whole units into batches of at most BATCH_LIMIT writes.
+    chunk, chunk_ops, written = [], 0, 0
+    for unit in list(units.values()) + [None]:
+        if unit is not None and chunk_ops + len(unit['writes']) <= BATCH_LIMIT:
+            chunk.append(unit)
+            chunk_ops += len(unit['writes'])
+            continue
+        if chunk:
+            try:
+                commit_writes([w for u in chunk for w in u['writes']])
+            except Exception as e:
+                app.logger.exception("Roster import batch failed")
+                for u in chunk:
+                    for r in u['rows']:
+                        r['status'] = 'failed'
+                        r['error'] = str(e)
+            written += len(chunk)
+            if progress is not None:
+                progress({'stage': 'writing', 'users': written, 'of': len(units)})
+        chunk, chunk_ops = ([unit], len(unit['writes'])) if unit is not None else ([], 0)
+
+    for email, unit in units.items():
+        invalidate_user(unit['user_ref'].id)
+        if unit['new'] and unit['rows'][0]['status'] != 'failed':
+            state.user_index.upsert(unit['user_ref'].id, unit['data'])
+        with state.email_misses_lock:
+            state.email_misses.pop(email, None)
+    for code in class_docs:
+        forget_doc('classes', code)
+
+    return [], results
+
+ROSTER_JOB_MAX_FAILED = 200  # failed rows kept on the job document
+
+def run_roster_import(params, progress):
+    """Job handler: import params['rows'] and return a summary with the failed rows."""
+    errors, results = import_roster(params['rows'], progress)
+    if errors:
+        return {'status': 'error', 'errors': errors[:ROSTER_JOB_MAX_FAILED]}
+    summary = {}
+    for r in results:
+        summary[r['status']] = summary.get(r['status'], 0) + 1
+    failed = [r for r in results if r['status'] == 'failed']
+    return {'status': 'partial' if failed else 'success', 'summary': summary,
+            'failed': failed[:ROSTER_JOB_MAX_FAILED]}
+
+# ---------- Rollup compaction ----------
+# Weekly, term and school totals are recomputed from rollups_daily with
+# equality filters only, so no composite indexes are needed. A marker is
+# cleared only if its rev is unchanged, so a save made during compaction is
+# picked up by the next run.
+ROLLUP_COMPACT_BATCH = 400
+
+def sum_rollups(snaps):
+    totals = dict.fromkeys(ATTENDANCE_STATUSES, 0)
+    count = 0
+    for snap in snaps:
+        data = snap.to_dict()
+        count += 1
+        for status in ATTENDANCE_STATUSES:
+            totals[status] += data.get(status, 0)
+    counted = totals['present'] + totals['absent']
+    return dict(totals, rate=round(totals['present'] / counted, 4) if counted else None), count
+
+def _clear_rollup_markers(transaction, markers):
+    revs = {m.id: m.to_dict().get('rev') for m in markers}
+    cleared = 0
+    for snap in db.get_all([m.reference for m in markers], transaction=transaction):
+        if snap.exists and snap.to_dict().get('rev') == revs[snap.id]:
+            transaction.delete(snap.reference)
+            cleared += 1
+    return cleared
+
+def compact_rollups(params=None, progress=None):
+    """Fold dirty daily rollups into rollups_weekly, rollups_term and rollups_school."""
+    daily = db.collection('rollups_daily')
+    compacted = 0
+    while True:
+        markers = list(db.collection('rollup_dirty').limit(ROLLUP_COMPACT_BATCH).stream())
+        if not markers:
+            break
+        weeks, terms, dates = set(), set(), set()
+        for m in markers:
+            data = m.to_dict()
+            key = (data['class_code'], data['section'])
+            weeks.add(key + (week_of(data['date']),))
+            if term_of(data['date']):
+                terms.add(key + (term_of(data['date']),))
+            dates.add(data['date'])
+
+        writes = []
+        for period, collection, keys in (('week', 'rollups_weekly', weeks), ('term', 'rollups_term', terms)):
+            for class_code, section, value in keys:
+                totals, days = sum_rollups(daily.where('class_code', '==', class_code)
+                                           .where('section', '==', section)
+                                           .where(period, '==', value).stream())
+                writes.append(('set', db.collection(collection).document(f"{value}__{class_code}__{section}"),
+                               {period: value, 'class_code': class_code, 'section': section,
+                                'days': days, **totals}))
+        for date_str in dates:
+            totals, sections = sum_rollups(daily.where('date', '==', date_str).stream())
+            writes.append(('set', db.collection('rollups_school').document(date_str),
+                           {'date': date_str, 'sections': sections, **totals}))
+        commit_writes(writes)
+
+        compacted += run_in_transaction(_clear_rollup_markers, markers)
+        if progress:
+            progress({'compacted': compacted})
+        if len(markers) < ROLLUP_COMPACT_BATCH:
+            break
+    return {'compacted': compacted}
+
+def rebuild_rollups(params=None, progress=None):
+    """Recompute rollups_daily from attendance history, then compact everything.
+
+    Meant for backfills: a save racing the rebuild of its section may be lost
+    from the rollup until the next rebuild.
+    """
+    sections = days = 0
+    for c in db.collection('classes').stream():
+        for sec_name in c.to_dict().get('sections', {}):
+            writes = []
+            for day in iter_section_attendance(c.id, sec_name, page_size=ATTENDANCE_PAGE_MAX):
+                totals = dict.fromkeys(ATTENDANCE_STATUSES, 0)
+                for rec in day['records']:
+                    if rec.get('status') in totals:
+                        totals[rec['status']] += 1
+                rid = rollup_id(day['date'], c.id, sec_name)
+                key = {'date': day['date'], 'class_code': c.id, 'section': sec_name}
+                writes.append(('set', db.collection('rollups_daily').document(rid),
+                               dict(key, week=week_of(day['date']), term=term_of(day['date']), **totals)))
+                writes.append(('set', db.collection('rollup_dirty').document(rid), dict(key, rev=1)))
+            commit_writes(writes)
+            sections += 1
+            days += len(writes) // 2
+            if progress:
+                progress({'sections': sections, 'days': days})
+    return dict(compact_rollups(), days=days, sections=sections)
+
+# ---------- Background jobs ----------
+JOB_HANDLERS = {
+    'compact_rollups': compact_rollups,
+    'rebuild_rollups': rebuild_rollups,
+    'import_roster': run_roster_import,
+}
+# Kinds POST /admin/jobs accepts; roster imports are submitted by their own route.
+ADMIN_JOB_KINDS = ('compact_rollups', 'rebuild_rollups')
+
+
+def acquire_lease(name, seconds):
+    """Take or renew job_leases/<name> for this process; False if another process holds it."""
+    ref = db.collection('job_leases').document(name)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def take(transaction):
+        snap = ref.get(transaction=transaction)
+        lease = snap.to_dict() if snap.exists else {}
+        now = datetime.now(timezone.utc)
+        if lease.get('owner') not in (None, owner) and lease.get('expires_at') and lease['expires_at'] > now:
+            return False
+        transaction.set(ref, {'owner': owner, 'expires_at': now + timedelta(seconds=seconds)})
+        return True
+
+    return run_in_transaction(take)
+
+def start_job_schedule():
+    if settings.rollup_compact_interval <= 0 or state.job_schedule_started:
+        return
+    with state.job_schedule_lock:
+        if state.job_schedule_started:
+            return
+        state.job_schedule_started = True
+    state.job_runner.every(settings.rollup_compact_interval, 'compact_rollups',
+                     should_run=lambda: acquire_lease('compact_rollups', settings.rollup_compact_interval))
+
+# ---------- School reports ----------
+def lowest_attendance_sections(period, value, limit=10):
+    """Sections with the lowest present rate for one week or term, from the compacted rollups."""
+    collection = 'rollups_term' if period == 'term' else 'rollups_weekly'
+    rows = [snap.to_dict() for snap in db.collection(collection).where(period, '==', value).stream()]
+    rows = sorted((r for r in rows if r.get('rate') is not None), key=lambda r: (r['rate'], r['class_code']))[:limit]
+    class_docs = get_docs('classes', [r['class_code'] for r in rows])
+    for row, class_doc in zip(rows, class_docs):
+        row['subjectName'] = class_doc.to_dict().get('subjectName', '') if class_doc is not None and class_doc.exists else ''
+    return rows
+
+def daily_school_rate(date_from, date_to):
+    query = (db.collection('rollups_school')
+             .where('date', '>=', date_from).where('date', '<=', date_to).order_by('date'))
+    return [snap.to_dict() for snap in query.stream()]
+
+# ---------- Section analytics ----------
+def section_analytics_key(class_doc, section):
+    """Changes with every attendance save and every enrollment in the section."""
+    sec = class_doc.to_dict().get('sections', {}).get(section, {})
+    return (class_doc.id, section, sec.get('attendance_version', 0), len(sec.get('students', [])))
+
+def get_section_analytics(class_doc, section):
+    """Per-student rate, absence streak, trend and at-risk flag for one section.
+
+    The whole history is read once into a status matrix; the result is cached
+    per attendance_version.
+    """
+    key = section_analytics_key(class_doc, section)
+    with state.analytics_cache_lock:
+        cached = state.analytics_cache.get(key)
+    if cached is not None:
+        return cached
+
+    enrolled = class_doc.to_dict().get('sections', {}).get(section, {}).get('students', [])
+    days = list(iter_section_attendance(class_doc.id, section, page_size=ATTENDANCE_PAGE_MAX))
+    matrix, student_ids, dates = analytics.status_matrix(days, enrolled)
+    stats = analytics.section_analytics(matrix, window=settings.analytics_trend_window,
+                                        risk_rate=settings.analytics_risk_rate,
+                                        risk_streak=settings.analytics_risk_streak)
+    columns = {name: analytics.to_python(stats[name])
+               for name in ('present', 'absent', 'excused', 'rate', 'streak', 'trend', 'at_risk')}
+
+    profiles = get_users_by_ids(student_ids)
+    students = [{'student_id': sid, 'name': profiles.get(sid, {}).get('name', 'Unknown'),
+                 **{name: values[i] for name, values in columns.items()}}
+                for i, sid in enumerate(student_ids)]
+    # At-risk first, then lowest rate (students with no counted days last).
+    students.sort(key=lambda s: (not s['at_risk'], s['rate'] is None, s['rate'] or 0, s['name']))
+
+    result = {
+        'class_code': class_doc.id,
+        'section': section,
+        'days': len(dates),
+        'section_rate': analytics.to_python(stats['section_rate']),
+        'at_risk_count': sum(1 for s in students if s['at_risk']),
+        'thresholds': {'rate': settings.analytics_risk_rate, 'streak': settings.analytics_risk_streak,
+                       'trend_window': settings.analytics_trend_window},
+        'daily': [{'date': d, 'rate': r} for d, r in zip(dates, analytics.to_python(stats['daily_rate']))],
+        'students': students,
+    }
+    with state.analytics_cache_lock:
+        state.analytics_cache[key] = result
+    return result
+
+def can_view_section(user, class_doc, section):
+    if user['role'] == 'admin':
+        return True
+    sec = class_doc.to_dict().get('sections', {}).get(section)
+    return user['role'] == 'teacher' and sec is not None and sec.get('teacher') == user['id']
+
+# ---------- Attendance export ----------
+EXPORT_COLUMNS = ('date', 'class_code', 'section', 'student_id', 'name', 'status')
+NAME_LOOKUP_CHUNK = 300
+
+def iter_attendance_export_rows(class_code, sections, date_from=None, date_to=None):
+    """Yield export rows section by section, one page of days at a time."""
+    for section in sections:
+        page = []
+        for day in iter_section_attendance(class_code, section, date_from, date_to, settings.export_page_size):
+            page.append(day)
+            if len(page) == settings.export_page_size:
+                yield from _export_page_rows(class_code, section, page)
+                page = []
+        if page:
+            yield from _export_page_rows(class_code, section, page)
+
+def _export_page_rows(class_code, section, days):
+    ids = list(dict.fromkeys(r.get('student_id') for day in days for r in day['records'] if r.get('student_id')))
+    profiles = {}
+    for i in range(0, len(ids), NAME_LOOKUP_CHUNK):
+        profiles.update(get_users_by_ids(ids[i:i + NAME_LOOKUP_CHUNK]))
+    for day in days:
+        for rec in day['records']:
+            sid = rec.get('student_id', '')
+            yield {
+                'date': day['date'],
+                'class_code': class_code,
+                'section': section,
+                'student_id': sid,
+                'name': profiles.get(sid, {}).get('name', ''),
+                'status': rec.get('status', '')
+            }
+
+def format_export_rows(rows, fmt):
+    if fmt == 'ndjson':
+        for row in rows:
+            yield json.dumps(row) + '\n'
+        return
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([row[c] for c in EXPORT_COLUMNS])
+        if buf.tell() > 8192:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+# ---------- Per-process state ----------
+class WorkerState:
+    """Everything a worker process owns: storage client, pools, caches, locks and services.
+
+    One instance, `state`, is built at import and replaced as a whole in a
+    forked child, so nothing a preloading parent created is shared.
+    """
+
+    def __init__(self):
+        # Storage is opened on first use (get_db), never at import: gRPC channels
+        # do not survive fork(), so a preloaded gunicorn master must not hold one.
+        self.storage = None
+        self.storage_lock = threading.Lock()
+
+        # Password hashing process pool (spawned on first use) and its queue slots.
+        self.hash_pool = None
+        self.hash_pool_lock = threading.Lock()
+        self.hash_slots = threading.BoundedSemaphore(settings.hash_queue_limit)
+
+        # LRU of user profiles (minus password hashes) used for roster resolution.
+        # Entries expire after settings.user_cache_ttl seconds and are dropped
+        # whenever this process writes to the user document.
+        self.user_cache = TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+        self.user_cache_lock = threading.Lock()
+        # user_emails/<email> -> {'user_id'} makes login and signup lookups a point
+        # read. Unknown emails are remembered briefly so repeated failed logins and
+        # duplicate checks do not hit Firestore.
+        self.email_misses = TTLCache(maxsize=10000, ttl=settings.email_miss_ttl)
+        self.email_misses_lock = threading.Lock()
+
+        # See start_user_index(). Local user writes upsert into it, and on Firestore
+        # a listener on users.created_at picks up users created elsewhere.
+        self.user_index = UserIndex()
+        self.user_index_started = False
+        self.user_index_lock = threading.Lock()
+
+        # Rendered fragments, keyed by fragment_version(): changes on enrollment,
+        # teacher assignment, attendance saves and class re-creation, so a stale
+        # fragment is never served.
+        self.fragment_cache = LRUCache(maxsize=settings.fragment_cache_size)
+        self.fragment_cache_lock = threading.Lock()
+        self.fragment_stats = {'hits': 0, 'misses': 0}
+
+        # Section analytics, keyed by section_analytics_key(): a save bumps
+        # attendance_version and an enrollment grows the roster, so entries are
+        # never served after either.
+        self.analytics_cache = LRUCache(maxsize=settings.analytics_cache_size)
+        self.analytics_cache_lock = threading.Lock()
+
+        # Last known good copies: (collection, id) -> the newest snapshot of a hedged
+        # document, and ('attendance_page', ...) -> the snapshots of a class-details
+        # page. Only served, marked stale, when a fresh read misses its deadline.
+        self.last_good = LRUCache(maxsize=settings.lkg_cache_size)
+        self.last_good_lock = threading.Lock()
+        self.refreshing = set()
+        self.read_pool = None
+        self.read_pool_lock = threading.Lock()
+        self.refresh_pool = None
+        self.refresh_slots = threading.BoundedSemaphore(settings.refresh_queue_limit)
+        self.read_stats = {'hedged': 0, 'hedge_wins': 0, 'deadline_misses': 0, 'stale_served': 0, 'refreshes': 0}
+        self.stats_lock = threading.Lock()
+
+        self.attendance_broker = AttendanceBroker(open_attendance_source(), max_clients=settings.stream_max_clients)
+        self.class_writer = open_class_writer()
+        self.job_runner = JobRunner(lambda: db.collection('jobs'), JOB_HANDLERS, workers=settings.job_workers,
+                                    max_queued=settings.job_queue_limit, logger=app.logger)
+        self.job_schedule_started = False
+        self.job_schedule_lock = threading.Lock()
+
+state = WorkerState()
+
+def _reset_after_fork():
+    """Drop per-process state inherited from a preloading parent."""
+    global state
+    state = WorkerState()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 # ============================================================================================
 #                                          ROUTES
 # ============================================================================================
 
+@app.before_request
+def start_request_metrics():
+    g._trackit_started = time.perf_counter()
+    if settings.metrics_sample_rate > 0 and random.random() < settings.metrics_sample_rate:
+        g._trackit_io = new_tally()
+
+@app.before_request
+def ensure_job_schedule():
+    start_job_schedule()
+
+@app.after_request
+def finish_request_metrics(response):
+    # Streamed bodies (exports) keep reading after this runs; their tally
+    # covers only the work done before the first chunk.
+    started = g.pop('_trackit_started', None)
+    if started is None or request.endpoint == 'metrics':
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe((endpoint, request.method, str(response.status_code)), elapsed)
+
+    tally = g.pop('_trackit_io', None)
+    if tally is None:
+        return response
+    labels = (endpoint, request.method)
+    REQUEST_DB_SECONDS.observe(labels, tally['db_ms'] / 1000)
+    REQUEST_DB_CALLS.observe(labels, tally['calls'])
+    REQUEST_DOCS_READ.observe(labels, tally['docs'])
+    REQUEST_BYTES_READ.observe(labels, tally['bytes'])
+    REQUEST_WRITES.observe(labels, tally['writes'])
+
+    timings = [f'db;dur={tally["db_ms"]:.2f};desc="{tally["calls"]} calls, {tally["docs"]} docs, '
+               f'{tally["bytes"]} B, {tally["writes"]} writes"']
+    if tally['hash_ms']:
+        timings.append(f'hash;dur={tally["hash_ms"]:.2f}')
+    timings.append(f'total;dur={elapsed * 1000:.2f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+
+    request_log.info(json.dumps({
+        'endpoint': endpoint, 'method': request.method, 'path': request.path,
+        'status': response.status_code, 'duration_ms': round(elapsed * 1000, 2),
+        'db_ms': round(tally['db_ms'], 2), 'db_calls': tally['calls'], 'docs_read': tally['docs'],
+        'bytes_read': tally['bytes'], 'writes': tally['writes'], 'hash_ms': round(tally['hash_ms'], 2),
+    }))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    if settings.metrics_token and request.headers.get('Authorization') != f"Bearer {settings.metrics_token}":
+        return Response("forbidden\n", status=403, mimetype='text/plain')
+    startup = ['# HELP trackit_startup_seconds Time spent in each startup phase of this worker.',
+               '# TYPE trackit_startup_seconds gauge']
+    startup += [f'trackit_startup_seconds{{phase="{phase}"}} {secs:g}' for phase, secs in sorted(STARTUP_SECONDS.items())]
+    buffer = ['# HELP trackit_class_write_buffer_total Class-document write buffer events in this worker.',
+              '# TYPE trackit_class_write_buffer_total counter']
+    buffer += [f'trackit_class_write_buffer_total{{event="{event}"}} {n}'
+               for event, n in sorted(state.class_writer.stats.items())]
+    fragments = ['# HELP trackit_fragment_cache_total Rendered fragment cache lookups in this worker.',
+                 '# TYPE trackit_fragment_cache_total counter']
+    fragments += [f'trackit_fragment_cache_total{{result="{result}"}} {n}'
+                  for result, n in sorted(state.fragment_stats.items())]
+    reads = ['# HELP trackit_read_deadline_total Hedged reads, deadline misses and stale fallbacks in this worker.',
+             '# TYPE trackit_read_deadline_total counter']
+    reads += [f'trackit_read_deadline_total{{event="{event}"}} {n}' for event, n in sorted(state.read_stats.items())]
+    body = '\n'.join([h.render() for h in METRIC_HISTOGRAMS] + startup + buffer + fragments + reads) + '\n'
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.after_request
+def mark_stale_response(response):
+    if served_stale() and response.status_code < 400:
+        response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
+
+@app.errorhandler(ReadDeadlineExceeded)
+def handle_read_deadline(e):
+    message = "The data store is slow to respond, please try again in a moment."
+    if request.path.startswith('/api/') or request.endpoint == 'ajax_get_students':
+        response = make_response(jsonify({'status': 'error', 'message': message}), 503)
+    else:
+        response = make_response(message, 503)
+        response.mimetype = 'text/plain'
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(e):
+    message = "The server is busy, please try again in a moment."
+    if request.endpoint in ('login', 'signup_student', 'signup_teacher'):
+        flash(message, "warning")
+        response = make_response(render_template(f"{request.endpoint}.html"), 503)
+    else:
+        response = make_response(jsonify({'status': 'error', 'message': message}), 503)
+    response.headers['Retry-After'] = str(settings.hash_retry_after)
+    return response
+
 @app.route('/')
 def index():
     if 'user' in session:
@@ -239,7 +2064,7 @@ def login():
         email = request.form.get('email','').strip().lower()
         password = request.form.get('password','')
 
-        if email == ADMIN_EMAIL and password == ADMIN_PASSWORD:
+        if email == settings.admin_email and password == settings.admin_password:
             session['user'] = {'id':'admin','role':'admin','name':'Administrator'}
             return redirect(url_for('dashboard'))
 
@@ -249,10 +2074,17 @@ def login():
             return render_template('login.html')
 
         user = doc.to_dict()
-        if not check_password_hash(user.get('password_hash',''), password):
+        if not verify_password(user.get('password_hash',''), password):
             flash("Incorrect password", "danger")
             return render_template('login.html')
 
+        if needs_rehash(user.get('password_hash','')):
+            try:
+                db.collection('users').document(doc.id).update({'password_hash': hash_password(password)})
+                invalidate_user(doc.id)
+            except HashingBusy:
+                pass  # upgrade on a later login
+
         session['user'] = {
             'id': doc.id,
             'email': user.get('email'),
@@ -280,8 +2112,10 @@ def signup_student():
             flash("Email already exists!", "warning")
             return redirect(url_for('signup_student'))
 
-        pw_hash = generate_password_hash(password)
-        create_user_record_student(name, email, pw_hash, 'student', student_id, gender)
+        pw_hash = hash_password(password)
+        if not create_user_record_student(name, email, pw_hash, 'student', student_id, gender):
+            flash("Email already exists!", "warning")
+            return redirect(url_for('signup_student'))
 
         flash("Student account created!", "success")
         return redirect(url_for('login'))
@@ -300,8 +2134,10 @@ def signup_teacher():
             flash("Email already exists!", "warning")
             return redirect(url_for('signup_teacher'))
 
-        pw_hash = generate_password_hash(password)
-        create_user_record(name, email, pw_hash, 'teacher', teacher_id)
+        pw_hash = hash_password(password)
+        if not create_user_record(name, email, pw_hash, 'teacher', teacher_id):
+            flash("Email already exists!", "warning")
+            return redirect(url_for('signup_teacher'))
 
         flash("Teacher account created!", "success")
         return redirect(url_for('login'))
@@ -309,11 +2145,12 @@ def signup_teacher():
     return render_template('signup_teacher.html')
 
 @app.route('/profile')
+@latency_budget(settings.page_budget)
 def profile():
     if 'user' not in session:
         return redirect(url_for('login'))
     user_id = session['user']['id']
-    doc = db.collection('users').document(user_id).get()
+    doc = get_user_doc(user_id)
     if not doc.exists:
         flash("User profile not found.", "danger")
         return redirect(url_for('dashboard'))
@@ -324,41 +2161,24 @@ def profile():
 # TEACHER CLASS VIEW (RENAMED TO SINGULAR PATH)
 # ============================================================================================
 @app.route('/dashboard/teacher/class')
+@latency_budget(settings.page_budget)
 def dashboard_teacher_class():
     if 'user' not in session or session['user']['role'] != 'teacher':
         return redirect(url_for('login'))
     user_id = session['user']['id']
-    user_doc = db.collection('users').document(user_id).get()
-    classes_list = []
+    user_doc = get_user_doc(user_id)
+    cards = []
     if user_doc.exists:
         raw_classes = user_doc.to_dict().get('classes', [])
-        for entry in raw_classes:
-            class_code = entry.get('class_code')
-            section = entry.get('section')
-            class_doc = db.collection('classes').document(class_code).get()
-            if class_doc.exists:
-                cd = class_doc.to_dict()
-                subject = cd.get('subjectName', '')
-                
-                student_count = count_students_in_section(class_code, section)
-
-                classes_list.append({
-                    'class_code': class_code,
-                    'section': section,
-                    'subjectName': subject,
-                    'student_count': student_count
-                })
-            else:
-                classes_list.append({
-                    'class_code': class_code,
-                    'section': section,
-                    'subjectName': '',
-                    'student_count': 0
-                })
-    return render_template('dashboard_teacher_class.html', classes=classes_list, user=session['user'])
+        class_docs = get_docs('classes', [entry.get('class_code') for entry in raw_classes])
+        for entry, class_doc in zip(raw_classes, class_docs):
+            cards.append(class_card('fragments/teacher_class_list_card.html',
+                                    entry.get('class_code'), entry.get('section'), class_doc))
+    return render_template('dashboard_teacher_class.html', cards=cards, user=session['user'])
 
 
 @app.route('/dashboard/teacher/view_class/<class_code>/<section>')
+@latency_budget(settings.page_budget)
 def dashboard_teacher_view_class(class_code, section):
     if 'user' not in session or session['user']['role'] != 'teacher':
         return redirect(url_for('login'))
@@ -374,20 +2194,35 @@ def dashboard_teacher_view_class(class_code, section):
     class_data = class_doc.to_dict()
     subject = class_data.get('subjectName', '')
 
-    raw_students = get_students_in_section(class_code, section)
-    students = []
-    for s in raw_students:
-        students.append({
-            'student_id': s.get('id',''),
-            'name': s.get('name','Unknown'),
-            'status': ''
-        })
+    def roster():
+        return {'students': [{'student_id': s.get('id', ''), 'name': s.get('name', 'Unknown'), 'status': ''}
+                             for s in get_students_in_section(class_code, section)]}
 
+    roster_rows = cached_fragment('fragments/roster_rows.html',
+                                  (class_code,) + fragment_version(class_data, section), roster)
     return render_template('dashboard_teacher_view_class.html',
                            class_code=class_code,
                            section=section,
                            subjectName=subject,
-                           students=students,
+                           roster_rows=roster_rows,
+                           user=session['user'])
+
+@app.route('/dashboard/teacher/analytics/<class_code>/<section>')
+@latency_budget(settings.page_budget)
+def dashboard_teacher_analytics(class_code, section):
+    if 'user' not in session or session['user']['role'] not in ('teacher', 'admin'):
+        return redirect(url_for('login'))
+
+    class_doc = get_class_doc(class_code.strip().upper())
+    if not class_doc.exists or not can_view_section(session['user'], class_doc, section.strip()):
+        flash("Section not found.", "danger")
+        return redirect(url_for('dashboard'))
+
+    return render_template('dashboard_teacher_analytics.html',
+                           class_code=class_doc.id,
+                           section=section.strip(),
+                           subjectName=class_doc.to_dict().get('subjectName', ''),
+                           report=get_section_analytics(class_doc, section.strip()),
                            user=session['user'])
 
 # ============================================================================================
@@ -409,27 +2244,14 @@ def add_class_teacher():
         flash("Please provide class code and section.", "warning")
         return redirect(url_for('dashboard_teacher_class'))
 
-    # If class doc exists: just add section if missing and assign teacher
-    class_doc_ref = db.collection('classes').document(class_code)
-    class_doc = class_doc_ref.get()
-
+    # Creates the class (subject defaults to the class code) or adds the section
+    # if missing, assigns the teacher and records the class on the teacher, in
+    # one transaction.
     try:
-        if class_doc.exists:
-            # add section if missing
-            add_section_if_missing(class_code, section)
-            # assign teacher to the section and add to teacher's user record
-            assign_teacher_to_section(user_id, class_code, section)
-            add_class_to_user(user_id, class_code, section)
-            flash("Class assigned to you.", "success")
-        else:
-            # create new class with the given subject and section
-            # if subject missing, use class_code as fallback name
-            subj = subject if subject else class_code
-            create_class(class_code, subj, [section])
-            # assign teacher and add class to teacher user doc
-            assign_teacher_to_section(user_id, class_code, section)
-            add_class_to_user(user_id, class_code, section)
+        if claim_section(user_id, class_code, section, subject):
             flash("Class created and assigned to you.", "success")
+        else:
+            flash("Class assigned to you.", "success")
     except Exception as e:
         app.logger.exception("Error adding/assigning class")
         flash("An error occurred while adding class.", "danger")
@@ -440,6 +2262,7 @@ def add_class_teacher():
 # DASHBOARD
 # ============================================================================================
 @app.route('/dashboard', methods=['GET','POST'])
+@latency_budget(settings.page_budget)
 def dashboard():
     if 'user' not in session:
         return redirect(url_for('login'))
@@ -463,19 +2286,23 @@ def dashboard():
             flash("Class created!", "success")
             return redirect(url_for('dashboard'))
 
-        classes_list = []
-        for c in db.collection('classes').stream():
-            cdict = c.to_dict()
-            counts = count_students_and_teachers(c.id)
-            cdict['student_count'] = counts['student_count']
-            cdict['teacher_count'] = counts['teacher_count']
-            classes_list.append(cdict)
+        sort = request.args.get('sort', 'code')
+        if sort not in ADMIN_SORT_FIELDS:
+            sort = 'code'
+        direction = 'desc' if request.args.get('dir') == 'desc' else 'asc'
+        cursor = request.args.get('cursor', '').strip().upper() or None
 
-        return render_template('dashboard_admin.html', classes=classes_list, user=user)
+        classes_list, next_cursor = list_classes_page(sort, direction, settings.admin_page_size, cursor)
+        rows = [cached_fragment('fragments/admin_class_row.html', (c.get('classCode'),) + fragment_version(c),
+                                lambda c=c: {'c': c})
+                for c in classes_list]
+        return render_template('dashboard_admin.html', rows=rows, user=user,
+                               sort=sort, direction=direction, cursor=cursor,
+                               next_cursor=next_cursor)
 
     # -------- TEACHER --------
     if role == 'teacher':
-        user_doc = db.collection('users').document(user_id).get().to_dict()
+        user_doc = get_user_doc(user_id).to_dict()
         classes_list = user_doc.get('classes', [])
 
         if request.method == 'POST':
@@ -492,37 +2319,19 @@ def dashboard():
                     flash("Class not found!", "danger")
                     return redirect(url_for('dashboard'))
 
-                add_section_if_missing(class_code, section)
-                assign_teacher_to_section(user_id, class_code, section)
-                add_class_to_user(user_id, class_code, section)
+                claim_section(user_id, class_code, section)
                 flash("Class assigned!", "success")
                 return redirect(url_for('dashboard'))
 
-        teacher_classes = []
-        for entry in classes_list:
-            class_code = entry.get('class_code')
-            section = entry.get('section')
-
-            class_doc = get_class_doc(class_code)
-            if class_doc.exists:
-                subj = class_doc.to_dict().get('subjectName','')
-                student_count = count_students_in_section(class_code, section)
-            else:
-                subj = ''
-                student_count = 0
-
-            teacher_classes.append({
-                'class_code': class_code,
-                'section': section,
-                'subjectName': subj,
-                'student_count': student_count
-            })
+        class_docs = get_docs('classes', [entry.get('class_code') for entry in classes_list])
+        cards = [class_card('fragments/teacher_class_card.html', entry.get('class_code'), entry.get('section'), class_doc)
+                 for entry, class_doc in zip(classes_list, class_docs)]
 
-        return render_template('dashboard_teacher.html', classes=teacher_classes, user=user)
+        return render_template('dashboard_teacher.html', cards=cards, user=user)
 
     # -------- STUDENT --------
     if role == 'student':
-        user_doc = db.collection('users').document(user_id).get().to_dict()
+        user_doc = get_user_doc(user_id).to_dict()
         classes_list = user_doc.get('classes', [])
         if request.method == 'POST':
             action = request.form.get('action','')
@@ -550,10 +2359,47 @@ def dashboard():
 # SUPPORT / AJAX ROUTES
 # ============================================================================================
 @app.route('/api/class/<class_code>/sections')
+@latency_budget(settings.api_budget)
 def api_get_sections(class_code):
-    return jsonify({'sections': get_sections(class_code.strip().upper())})
+    class_doc = get_class_doc(class_code.strip().upper())
+    etag = make_etag('sections', class_doc.id, class_doc.update_time if class_doc.exists else '-')
+    return conditional_json(etag, lambda: {'sections': get_sections(class_doc.id)})
+
+@app.route('/api/search/users')
+def api_search_users():
+    # Results carry every user's email and ids, so this is the admin directory only.
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    role = request.args.get('role') or None
+    if role not in (None, 'student', 'teacher', 'admin'):
+        return jsonify({'status': 'error', 'message': 'role must be student, teacher or admin'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), USER_SEARCH_MAX_RESULTS))
+
+    start_user_index()
+    if not state.user_index.ready.wait(settings.user_index_wait):
+        response = jsonify({'status': 'error', 'message': 'Search index is still loading'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    q = request.args.get('q', '')
+    return jsonify({'query': q, 'users': state.user_index.search(q, limit=limit, role=role)})
+
+@app.route('/api/class/<class_code>/<section>/analytics')
+@latency_budget(settings.api_budget)
+def api_section_analytics(class_code, section):
+    if 'user' not in session or session['user']['role'] not in ('teacher', 'admin'):
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    class_doc = get_class_doc(class_code.strip().upper())
+    section = section.strip()
+    if not class_doc.exists or not can_view_section(session['user'], class_doc, section):
+        return jsonify({'error': 'Section not found'}), 404
+
+    etag = make_etag('analytics', *section_analytics_key(class_doc, section), settings.analytics_trend_window,
+                     settings.analytics_risk_rate, settings.analytics_risk_streak)
+    return conditional_json(etag, lambda: get_section_analytics(class_doc, section))
 
 @app.route('/get_students/<class_code>/<section>')
+@latency_budget(settings.api_budget)
 def ajax_get_students(class_code, section):
     return jsonify({'students': get_students_in_section(class_code.strip().upper(), section.strip())})
 
@@ -565,47 +2411,311 @@ def save_attendance_route(class_code, section):
     data = request.get_json()
     date_str = data.get('date') or datetime.now().strftime("%Y-%m-%d")
     attendance = data.get('attendance', [])
-    save_attendance_to_section(class_code.strip().upper(), section.strip(), date_str, attendance)
+    try:
+        datetime.strptime(date_str, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'date must be YYYY-MM-DD'}), 400
+    class_code = class_code.strip().upper()
+    if not get_class_doc(class_code).exists:
+        return jsonify({'status': 'error', 'message': 'Class not found'}), 404
+    try:
+        save_attendance_to_section(class_code, section.strip(), date_str, attendance)
+    except api_exceptions.NotFound:
+        return jsonify({'status': 'error', 'message': 'Class not found'}), 404
     return jsonify({'status': 'success'})
 
+@app.route('/api/attendance/bulk', methods=['POST'])
+def bulk_attendance_route():
+    if 'user' not in session or session['user']['role'] != 'teacher':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+
+    payload = request.get_json(silent=True) or {}
+    key = (request.headers.get('Idempotency-Key') or payload.get('idempotency_key') or '').strip()
+    idem_ref = None
+    if key:
+        idem_ref = db.collection('idempotency_keys').document(
+            quote(f"{session['user']['id']}__{key}", safe=''))
+        previous = idem_ref.get()
+        if previous.exists:
+            response = jsonify(previous.to_dict().get('response', {}))
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+    entries, errors = validate_attendance_entries(payload)
+    if errors:
+        return jsonify({'status': 'error', 'errors': errors}), 400
+    codes = sorted({e['class_code'] for e in entries})
+    class_docs = dict(zip(codes, get_docs('classes', codes)))
+    if any(doc is None for doc in class_docs.values()):
+        raise ReadDeadlineExceeded("Reading classes for a bulk save failed")
+    unknown = [code for code, doc in class_docs.items() if not doc.exists]
+    if unknown:
+        return jsonify({'status': 'error', 'errors': [
+            {'entry': None, 'error': f'Class not found: {code}'} for code in unknown]}), 404
+    # A section the caller does not teach (or one that does not exist) would
+    # otherwise be created on the class document by the version bump.
+    forbidden = [{'entry': i, 'error': f"Not your section: {e['class_code']} {e['section']}"}
+                 for i, e in enumerate(entries)
+                 if not can_view_section(session['user'], class_docs[e['class_code']], e['section'])]
+    if forbidden:
+        return jsonify({'status': 'error', 'errors': forbidden}), 403
+
+    chunks = plan_attendance_chunks(entries)
+    result = {
+        'status': 'success',
+        'entries': len(entries),
+        'days': len({(e['class_code'], e['section'], e['date']) for e in entries}),
+        'commits': len(chunks)
+    }
+    for i, chunk in enumerate(chunks):
+        # The key is recorded with the last chunk. Re-applying earlier chunks on
+        # a retry is harmless: counters only move by the old -> new diff.
+        idempotency = None
+        if idem_ref is not None and i == len(chunks) - 1:
+            idempotency = (idem_ref, {'response': result, 'created_at': firestore.SERVER_TIMESTAMP})
+        try:
+            write_attendance(chunk, idempotency)
+        except api_exceptions.AlreadyExists:
+            # A concurrent retry with the same key finished first.
+            response = jsonify(idem_ref.get().to_dict().get('response', {}))
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+    return jsonify(result)
+
 @app.route('/api/student/attendance-summary')
+@latency_budget(settings.api_budget)
 def api_student_attendance_summary():
     if 'user' not in session or session['user']['role'] != 'student':
         return jsonify({'error': 'Unauthorized'}), 403
 
     user_id = session['user']['id']
-    summary = get_attendance_summary_for_student(user_id)
-    return jsonify({
-        'present': sum(item['present'] for item in summary),
-        'absent': sum(item['absent'] for item in summary),
-        'excused': sum(item['excused'] for item in summary)
-    })
+
+    def build():
+        summary = get_attendance_summary_for_student(user_id)
+        return {
+            'present': sum(item['present'] for item in summary),
+            'absent': sum(item['absent'] for item in summary),
+            'excused': sum(item['excused'] for item in summary)
+        }
+    return conditional_json(student_summary_etag(user_id, 'attendance-summary'), build)
 
 @app.route('/api/student/joined-classes-summary')
+@latency_budget(settings.api_budget)
 def api_student_joined_classes():
     if 'user' not in session or session['user']['role'] != 'student':
         return jsonify([])
     user_id = session['user']['id']
-    return jsonify(get_attendance_summary_for_student(user_id))
+    return conditional_json(student_summary_etag(user_id, 'joined-classes'),
+                            lambda: get_attendance_summary_for_student(user_id))
+
+@app.route('/api/student/stream')
+def api_student_stream():
+    """Server-Sent Events: one 'attendance' event per counter change of this student."""
+    if 'user' not in session or session['user']['role'] != 'student':
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    user_doc = get_user_doc(session['user']['id'])
+    classes = user_doc.to_dict().get('classes', []) if user_doc.exists else []
+    keys = [(entry.get('class_code'), entry.get('section')) for entry in classes]
+    try:
+        if not request.environ.get('wsgi.multithread'):
+            # A sync worker would be pinned to this stream for settings.stream_max_age.
+            raise StreamsFull()
+        sub = state.attendance_broker.subscribe(user_doc.id, keys)
+    except StreamsFull:
+        response = jsonify({'error': 'Too many live connections'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(settings.stream_heartbeat)
+        return response
+
+    def generate():
+        deadline = time.monotonic() + settings.stream_max_age
+        yield f"retry: {settings.stream_heartbeat * 1000}\n\n"
+        while time.monotonic() < deadline:
+            if sub.overflowed:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            try:
+                event = sub.get(timeout=min(settings.stream_heartbeat, max(deadline - time.monotonic(), 0.1)))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: attendance\ndata: {json.dumps(event)}\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream')
+    # Runs when the server closes the response, including client disconnects.
+    response.call_on_close(sub.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/student/class-details/<class_code>/<section>')
+@latency_budget(settings.api_budget)
 def api_student_class_details(class_code, section):
     if 'user' not in session or session['user']['role'] != 'student':
         return jsonify({'error': 'Unauthorized'}), 403
 
+    date_from = request.args.get('from', '').strip() or None
+    date_to = request.args.get('to', '').strip() or None
+    cursor = request.args.get('cursor', '').strip() or None
+    # Newest first by default, so the first page shows recent attendance.
+    newest_first = request.args.get('order', 'desc') != 'asc'
+    try:
+        for value in (date_from, date_to, cursor):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+        limit = int(request.args.get('limit', settings.attendance_page_size))
+    except ValueError:
+        return jsonify({'error': 'Invalid date range or limit'}), 400
+    limit = max(1, min(limit, ATTENDANCE_PAGE_MAX))
+
     class_doc = get_class_doc(class_code.upper())
     if not class_doc.exists:
         return jsonify({'error': 'Class not found'}), 404
 
-    data = class_doc.to_dict()
-    sec_data = data.get('sections', {}).get(section.strip(), {})
-    attendance_list = [{'date': k, 'records': v} for k,v in sec_data.get('attendance', {}).items()]
-    return jsonify({
-        'subjectName': data.get('subjectName'),
-        'classCode': class_code.upper(),
-        'section': section.strip(),
-        'attendance': attendance_list
-    })
+    def build():
+        attendance_list, next_cursor = get_attendance_page(
+            class_code.upper(), section.strip(), date_from, date_to, limit, cursor, newest_first, last_good=True)
+        return {
+            'subjectName': class_doc.to_dict().get('subjectName'),
+            'classCode': class_code.upper(),
+            'section': section.strip(),
+            'attendance': attendance_list,
+            'next_cursor': next_cursor
+        }
+    etag = make_etag('class-details', class_doc.id, section.strip(), class_doc.update_time,
+                     date_from, date_to, limit, cursor, newest_first)
+    return conditional_json(etag, build)
+
+# ============================================================================================
+# ATTENDANCE EXPORT
+# ============================================================================================
+@app.route('/export/attendance/<class_code>')
+def export_attendance(class_code):
+    if 'user' not in session or session['user']['role'] not in ('teacher', 'admin'):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+
+    class_code = class_code.strip().upper()
+    fmt = request.args.get('format', 'csv').lower()
+    date_from = request.args.get('from', '').strip() or None
+    date_to = request.args.get('to', '').strip() or None
+    section = request.args.get('section', '').strip() or None
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'status': 'error', 'message': "format must be 'csv' or 'ndjson'"}), 400
+    try:
+        for value in (date_from, date_to):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Dates must be YYYY-MM-DD'}), 400
+
+    class_doc = get_class_doc(class_code)
+    if not class_doc.exists:
+        return jsonify({'status': 'error', 'message': 'Class not found'}), 404
+
+    sections = class_doc.to_dict().get('sections', {})
+    if session['user']['role'] == 'teacher':
+        # Teachers export only the sections they teach.
+        sections = {k: v for k, v in sections.items() if v.get('teacher') == session['user']['id']}
+    if section:
+        if section not in sections:
+            return jsonify({'status': 'error', 'message': 'Section not found'}), 404
+        sections = {section: sections[section]}
+
+    rows = iter_attendance_export_rows(class_code, sorted(sections), date_from, date_to)
+    filename = f"attendance_{class_code}{'_' + section if section else ''}.{fmt}"
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    return Response(stream_with_context(format_export_rows(rows, fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# ============================================================================================
+# ADMIN REPORTS / BACKGROUND JOBS
+# ============================================================================================
+@app.route('/admin/reports/lowest-sections')
+@latency_budget(settings.api_budget)
+def admin_lowest_sections():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    period = request.args.get('period', 'term')
+    if period not in ('term', 'week'):
+        return jsonify({'status': 'error', 'message': 'period must be term or week'}), 400
+    today = date.today().isoformat()
+    value = request.args.get(period) or (term_of(today) if period == 'term' else week_of(today))
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    return jsonify({'period': period, period: value,
+                    'sections': lowest_attendance_sections(period, value, limit)})
+
+@app.route('/admin/reports/daily-rate')
+@latency_budget(settings.api_budget)
+def admin_daily_rate():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    try:
+        date_to = date.fromisoformat(request.args.get('to') or date.today().isoformat())
+        date_from = date.fromisoformat(request.args.get('from') or (date_to - timedelta(days=29)).isoformat())
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Dates must be YYYY-MM-DD'}), 400
+    return jsonify({'from': date_from.isoformat(), 'to': date_to.isoformat(),
+                    'days': daily_school_rate(date_from.isoformat(), date_to.isoformat())})
+
+@app.route('/admin/jobs', methods=['POST'])
+def admin_submit_job():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    kind = (request.get_json(silent=True) or {}).get('kind') or request.form.get('kind')
+    if kind not in ADMIN_JOB_KINDS:
+        return jsonify({'status': 'error', 'message': f"kind must be one of {', '.join(ADMIN_JOB_KINDS)}"}), 400
+    try:
+        job_id = state.job_runner.submit(kind, submitted_by=session['user']['id'])
+    except JobQueueFull:
+        return jsonify({'status': 'error', 'message': 'Too many jobs queued, try again later'}), 503
+    status_url = url_for('admin_job_status', job_id=job_id)
+    return jsonify({'status': 'queued', 'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
+
+@app.route('/admin/jobs/<job_id>')
+def admin_job_status(job_id):
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    job = state.job_runner.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    for field in ('created_at', 'started_at', 'finished_at'):
+        if job.get(field) is not None:
+            job[field] = job[field].isoformat()
+    return jsonify(job)
+
+# ============================================================================================
+# ADMIN ROSTER IMPORT
+# ============================================================================================
+@app.route('/admin/import_roster', methods=['POST'])
+def admin_import_roster():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+
+    try:
+        raw_rows = parse_roster_rows(request.files.get('roster'), request.get_json(silent=True))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if not raw_rows:
+        return jsonify({'status': 'error', 'message': 'Roster is empty'}), 400
+    if len(raw_rows) > settings.import_max_rows:
+        return jsonify({'status': 'error', 'message': f'Roster exceeds {settings.import_max_rows} rows'}), 400
+
+    rows = [_normalize_roster_row(r) for r in raw_rows]
+    errors, _, _ = validate_roster(rows)
+    if errors:
+        return jsonify({'status': 'error', 'errors': errors}), 400
+
+    # Hashing thousands of passwords outlasts the worker timeout, so the
+    # import runs as a job; the rows stay off the job document.
+    try:
+        job_id = state.job_runner.submit('import_roster', {'rows': len(rows)},
+                                   submitted_by=session['user']['id'], private={'rows': rows})
+    except JobQueueFull:
+        return jsonify({'status': 'error', 'message': 'Too many jobs queued, try again later'}), 503
+    status_url = url_for('admin_job_status', job_id=job_id)
+    return jsonify({'status': 'queued', 'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
 
 @app.route('/logout')
 def logout():
@@ -613,8 +2723,223 @@ def logout():
     flash("Logged out", "info")
     return redirect(url_for('login'))
 
+# ============================================================================================
+# MAINTENANCE COMMANDS  (run with: flask --app app <command>)
+# ============================================================================================
+@app.cli.command('backfill-attendance-counters')
+def backfill_attendance_counters():
+    """Rebuild attendance_counters from the attendance history of every section."""
+    batch = db.batch()
+    pending = written = 0
+
+    for c in db.collection('classes').stream():
+        for sec_name in c.to_dict().get('sections', {}):
+            totals = {}
+            for day in iter_section_attendance(c.id, sec_name):
+                for rec in day['records']:
+                    sid, status = rec.get('student_id'), rec.get('status')
+                    if not sid:
+                        continue
+                    counts = totals.setdefault(sid, dict.fromkeys(ATTENDANCE_STATUSES, 0))
+                    if status in counts:
+                        counts[status] += 1
+
+            writes = [(db.collection('attendance_counters').document(counter_doc_id(sid, c.id, sec_name)),
+                       {'student_id': sid, 'class_code': c.id, 'section': sec_name, **counts}, False)
+                      for sid, counts in totals.items()]
+            # Invalidate the summary ETags that depend on these counters.
+            writes.append((c.reference, {'sections': {sec_name: {'attendance_version': firestore.Increment(1)}}}, True))
+            for ref, data, merge in writes:
+                batch.set(ref, data, merge=merge)
+                pending += 1
+                if pending == 500:
+                    batch.commit()
+                    written += pending
+                    batch, pending = db.batch(), 0
+
+    if pending:
+        batch.commit()
+        written += pending
+    click.echo(f"Wrote {written} attendance counters.")
+
+@app.cli.command('migrate-attendance')
+def migrate_attendance():
+    """Move sections.<section>.attendance maps out of class documents into per-day documents."""
+    moved = 0
+    for c in db.collection('classes').stream():
+        for sec_name, sec_data in c.to_dict().get('sections', {}).items():
+            legacy = sec_data.get('attendance')
+            if legacy is None:
+                continue
+
+            # Days saved since the new layout went live are newer than the legacy copy.
+            col = attendance_collection(c.id, sec_name)
+            existing = {ref.id for ref in col.list_documents()}
+            batch, pending = db.batch(), 0
+            for date_str, records in legacy.items():
+                if date_str in existing:
+                    continue
+                batch.set(col.document(date_str), {'date': date_str, 'records': records})
+                pending += 1
+                moved += 1
+                if pending == 500:
+                    batch.commit()
+                    batch, pending = db.batch(), 0
+            if pending:
+                batch.commit()
+
+            db.collection('classes').document(c.id).update({
+                f"sections.{sec_name}.attendance": firestore.DELETE_FIELD
+            })
+    click.echo(f"Moved {moved} attendance days.")
+
+CONVERT_BATCH = 400
+
+def _convert_days_txn(transaction, class_code, section, day_refs, target):
+    """Re-encode day_refs against the section roster, read and extended in the same transaction.
+
+    A packed-mode save that appends to the roster meanwhile conflicts with this
+    transaction, so neither overwrites the other's roster.
+    """
+    roster_snap = section_ref(class_code, section).get(transaction=transaction)
+    roster = (roster_snap.to_dict() or {}).get('roster', []) if roster_snap.exists else []
+    size = len(roster)
+    snaps = [snap for snap in db.get_all(day_refs, transaction=transaction) if snap.exists]
+    converted, before, after = 0, 0, 0
+    for snap in snaps:
+        data = snap.to_dict()
+        if is_packed(data) == (target == 'packed'):
+            continue
+        body = encode_day(data.get('date', snap.id), day_records(data, roster), roster)
+        before += estimate_size(data)
+        after += estimate_size(body)
+        transaction.set(snap.reference, body)
+        converted += 1
+    if len(roster) != size:
+        transaction.set(section_ref(class_code, section), {'roster': roster}, merge=True)
+    return converted, before, after
+
+@app.cli.command('convert-attendance')
+@click.option('--to', 'target', type=click.Choice(['packed', 'records']), required=True)
+@click.option('--class-code', default=None, help='Only convert this class.')
+def convert_attendance(target, class_code):
+    """Rewrite attendance day documents in the packed or the records format.
+
+    Safe to run while the app is saving attendance: each batch of days is
+    converted in a transaction together with its section roster.
+    """
+    settings.attendance_format = target
+    classes = [get_class_doc(class_code.upper())] if class_code else db.collection('classes').stream()
+    converted = 0
+    before = after = 0
+    for c in classes:
+        if not c.exists:
+            continue
+        for sec_name in c.to_dict().get('sections', {}):
+            day_refs = list(attendance_collection(c.id, sec_name).list_documents())
+            for i in range(0, len(day_refs), CONVERT_BATCH):
+                n, b, a = run_in_transaction(_convert_days_txn, c.id, sec_name,
+                                             day_refs[i:i + CONVERT_BATCH], target)
+                converted += n
+                before += b
+                after += a
+    click.echo(f"Converted {converted} attendance days to {target} ({before} -> {after} bytes).")
+
+@app.cli.command('compact-rollups')
+def compact_rollups_command():
+    """Fold dirty daily attendance rollups into weekly, term and school totals."""
+    click.echo(f"Compacted {compact_rollups()['compacted']} daily rollups.")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute every attendance rollup from the attendance history."""
+    result = rebuild_rollups()
+    click.echo(f"Rebuilt rollups for {result['days']} days in {result['sections']} sections.")
+
+@app.cli.command('backfill-class-counts')
+def backfill_class_counts():
+    """Recompute student_count / teacher_count on every class document.
+
+    Classes whose counts change also get their section versions bumped in the
+    same write, so cached admin rows and class cards are rebuilt.
+    """
+    writes = []
+    for c in db.collection('classes').stream():
+        data = c.to_dict()
+        counts = tally_class_counts(data)
+        if all(data.get(field) == n for field, n in counts.items()):
+            continue
+        for sec in data.get('sections', {}):
+            counts[f"sections.{sec}.version"] = firestore.Increment(1)
+        writes.append(('update', c.reference, counts))
+    commit_writes(writes)
+    click.echo(f"Updated counts on {len(writes)} classes.")
+
+@app.cli.command('rebuild-email-index')
+def rebuild_email_index():
+    """Rebuild user_emails from the users collection and drop stale entries."""
+    indexed = {}
+    writes = []
+    for u in db.collection('users').stream():
+        email = (u.to_dict().get('email') or '').lower()
+        if not email:
+            continue
+        if email in indexed:
+            click.echo(f"Duplicate email {email}: keeping {indexed[email]}, skipping {u.id}")
+            continue
+        indexed[email] = u.id
+        writes.append(('set', email_index_ref(email), {'user_id': u.id}))
+
+    keep = {email_index_ref(e).id for e in indexed}
+    stale = [entry.reference for entry in db.collection('user_emails').stream() if entry.id not in keep]
+    writes.extend(('delete', ref, None) for ref in stale)
+
+    commit_writes(writes)
+    with state.email_misses_lock:
+        state.email_misses.clear()
+    click.echo(f"Indexed {len(indexed)} emails, removed {len(stale)} stale entries.")
+
+# ============================================================================================
+# APP FACTORY / STARTUP
+# ============================================================================================
+def import_storage_modules():
+    """Import the storage client libraries without opening a client.
+
+    A preloading gunicorn master calls this so that workers share these pages.
+    No channels or threads exist yet, so fork stays safe.
+    """
+    started = time.perf_counter()
+    if settings.storage_backend == 'sqlite':
+        import sqlite_store  # noqa: F401
+    else:
+        firestore.client  # resolves the lazy module
+    api_exceptions.AlreadyExists
+    STARTUP_SECONDS['libraries'] = time.perf_counter() - started
+
+def warm_up():
+    """Open this process's storage client and make one round trip (channel, auth token)."""
+    started = time.perf_counter()
+    db.collection('classes').limit(1).get()
+    STARTUP_SECONDS['storage'] = time.perf_counter() - started
+    startup_log.info("pid %d storage ready in %.0f ms (%s)", os.getpid(),
+                     STARTUP_SECONDS['storage'] * 1000, settings.storage_backend)
+    start_user_index()
+
+def create_app(warm=False):
+    """Return the TrackIt WSGI app (gunicorn: "app:create_app()").
+
+    Routes live on the module-level app. The factory only decides when
+    storage is opened: lazily on first use, or immediately with warm=True.
+    """
+    if warm:
+        warm_up()
+    return app
+
+STARTUP_SECONDS['import'] = time.perf_counter() - _import_started
+startup_log.info("app imported in %.0f ms", STARTUP_SECONDS['import'] * 1000)
+
 # ============================================================================================
 # RUN SERVER
 # ============================================================================================
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,377 @@
+"""Route-level load and read-amplification benchmark for TrackIt.
+
+Seeds a synthetic school (classes x sections x students x attendance days)
+into an in-memory SQLite store, a SQLite file, or a local Firestore emulator.
+It then drives the main routes and reports p50/p95/p99 latency, throughput
+and documents read/written per request.
+
+    python bench.py                                   # in-memory, default size
+    python bench.py --classes 20 --students 40 --days 90
+    python bench.py --save-baseline bench_baseline.json
+    python bench.py --baseline bench_baseline.json    # exit 1 on regression
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python bench.py --emulator
+
+With --base-url the requests go to a running server (e.g. gunicorn) over
+HTTP. The server must use the same backend (--sqlite-path or --emulator).
+Read/write counts are only available in-process.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+PASSWORD = 'bench-password'
+STATUSES = ('present', 'present', 'present', 'present', 'absent', 'excused')
+TRACKED = ('p95_ms', 'reads_per_req', 'writes_per_req')
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--classes', type=int, default=8)
+    p.add_argument('--sections', type=int, default=3)
+    p.add_argument('--students', type=int, default=30, help='students per section')
+    p.add_argument('--days', type=int, default=40, help='attendance days per section')
+    p.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    p.add_argument('--concurrency', type=int, default=1)
+    p.add_argument('--seed', type=int, default=7)
+    p.add_argument('--only', help='comma-separated scenario names')
+    p.add_argument('--emulator', action='store_true', help='use FIRESTORE_EMULATOR_HOST')
+    p.add_argument('--sqlite-path', default=':memory:')
+    p.add_argument('--base-url', help='drive a running server instead of the Flask test client')
+    p.add_argument('--baseline', help='JSON baseline to compare against')
+    p.add_argument('--save-baseline', help='write this run as a baseline')
+    p.add_argument('--tolerance', type=float, default=0.25,
+                   help='allowed relative regression for latency (default 25%%)')
+    p.add_argument('--count-tolerance', type=float, default=0.0,
+                   help='allowed relative regression for reads/writes per request')
+    p.add_argument('--output', help='also write the report to this file')
+    return p.parse_args(argv)
+
+
+def configure_backend(args):
+    if args.emulator:
+        if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+            sys.exit('--emulator needs FIRESTORE_EMULATOR_HOST')
+        os.environ['TRACKIT_STORAGE'] = 'firestore'
+    else:
+        os.environ['TRACKIT_STORAGE'] = 'sqlite'
+        os.environ['TRACKIT_SQLITE_PATH'] = args.sqlite_path
+
+
+# ---------- Seeding ----------
+def seed_school(trackit, args):
+    """Create the synthetic school through the app's own helpers."""
+    rng = random.Random(args.seed)
+    pw_hash = trackit.generate_password_hash(PASSWORD, trackit.settings.password_hash_method)
+    sections = [f"S{i + 1}" for i in range(args.sections)]
+
+    # Student i sits in section i // students of every class, so each
+    # student dashboard covers `classes` classes.
+    students = []
+    for i in range(args.sections * args.students):
+        email = f"student{i}@bench.trackit"
+        uid = trackit.insert_user({'name': f"Student {i}", 'email': email, 'role': 'student',
+                                   'classes': [], 'password_hash': pw_hash,
+                                   'student_id': f"ST{i:05d}", 'gender': ''})
+        students.append({'id': uid, 'email': email, 'section': sections[i // args.students]})
+
+    classes, teachers = [], []
+    days = [date(2024, 1, 1) + timedelta(days=d) for d in range(args.days)]
+    for c in range(args.classes):
+        code = f"BENCH{c:03d}"
+        trackit.create_class(code, f"Subject {c}", sections)
+        email = f"teacher{c}@bench.trackit"
+        tid = trackit.insert_user({'name': f"Teacher {c}", 'email': email, 'role': 'teacher',
+                                   'classes': [], 'password_hash': pw_hash, 'teacher_id': f"T{c:04d}"})
+        teachers.append({'id': tid, 'email': email, 'class_code': code})
+        for sec in sections:
+            trackit.assign_teacher_to_section(tid, code, sec)
+            trackit.add_class_to_user(tid, code, sec)
+
+        for s in students:
+            trackit.add_student_to_section(s['id'], code, s['section'])
+            trackit.add_class_to_user(s['id'], code, s['section'])
+
+        for sec in sections:
+            roster = [s['id'] for s in students if s['section'] == sec]
+            entries = [{'class_code': code, 'section': sec, 'date': d.isoformat(), 'mode': 'replace',
+                        'attendance': [{'student_id': sid, 'status': rng.choice(STATUSES)} for sid in roster]}
+                       for d in days]
+            for chunk in trackit.plan_attendance_chunks(entries):
+                trackit.write_attendance(chunk)
+        classes.append({'class_code': code, 'sections': sections})
+
+    return {'students': students, 'teachers': teachers, 'classes': classes, 'sections': sections}
+
+
+# ---------- Clients ----------
+class TestClientDriver:
+    """Requests through app.test_client(); sessions are set directly to skip login."""
+
+    def __init__(self, trackit):
+        self.trackit = trackit
+        self.flask_app = trackit.create_app() if hasattr(trackit, 'create_app') else trackit.app
+        self.local = threading.local()
+
+    def client(self, user):
+        key = user['id'] if user else None
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = {}
+        if key not in clients:
+            c = self.flask_app.test_client()
+            if user:
+                with c.session_transaction() as sess:
+                    sess['user'] = user
+            clients[key] = c
+        return clients[key]
+
+    def request(self, user, method, path, **kwargs):
+        resp = self.client(user).open(path, method=method, **kwargs)
+        return resp.status_code
+
+    def counts(self):
+        stats = getattr(self.trackit.db, 'stats', None)
+        return dict(stats) if stats is not None else None
+
+
+class HTTPDriver:
+    """Requests against a live server; each user logs in once with the bench password."""
+
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def client(self, user):
+        sessions = getattr(self.local, 'sessions', None)
+        if sessions is None:
+            sessions = self.local.sessions = {}
+        key = user['id'] if user else None
+        if key not in sessions:
+            s = self.requests.Session()
+            if user:
+                s.post(self.base_url + '/login', data={'email': user['email'], 'password': PASSWORD},
+                       allow_redirects=False)
+            sessions[key] = s
+        return sessions[key]
+
+    def request(self, user, method, path, data=None, json=None, **kwargs):
+        resp = self.client(user).request(method, self.base_url + path, data=data, json=json,
+                                         allow_redirects=False)
+        return resp.status_code
+
+    def counts(self):
+        return None
+
+
+# ---------- Scenarios ----------
+def build_scenarios(school, rng):
+    def session_user(u, role):
+        return {'id': u['id'], 'email': u['email'], 'name': u['email'], 'role': role}
+
+    admin = {'id': 'admin', 'email': 'admin', 'name': 'Administrator', 'role': 'admin'}
+    students = [session_user(s, 'student') for s in school['students']]
+    teachers = [(session_user(t, 'teacher'), t['class_code']) for t in school['teachers']]
+    sections = school['sections']
+    today = date(2024, 1, 1).isoformat()
+
+    def pick_student():
+        return rng.choice(students)
+
+    def pick_teacher():
+        return rng.choice(teachers)
+
+    def roster_payload(section):
+        ids = [s['id'] for s in school['students'] if s['section'] == section]
+        return {'date': today, 'attendance': [{'student_id': sid, 'status': rng.choice(STATUSES)} for sid in ids]}
+
+    def login():
+        s = rng.choice(school['students'])
+        return None, 'POST', '/login', {'data': {'email': s['email'], 'password': PASSWORD}}
+
+    def dashboard_student():
+        return pick_student(), 'GET', '/dashboard', {}
+
+    def dashboard_teacher():
+        return pick_teacher()[0], 'GET', '/dashboard', {}
+
+    def dashboard_admin():
+        return admin, 'GET', '/dashboard', {}
+
+    def view_class():
+        t, code = pick_teacher()
+        return t, 'GET', f"/dashboard/teacher/view_class/{code}/{rng.choice(sections)}", {}
+
+    def save_attendance():
+        t, code = pick_teacher()
+        sec = rng.choice(sections)
+        return t, 'POST', f"/save_attendance/{code}/{sec}", {'json': roster_payload(sec)}
+
+    def api_attendance_summary():
+        return pick_student(), 'GET', '/api/student/attendance-summary', {}
+
+    def api_joined_classes():
+        return pick_student(), 'GET', '/api/student/joined-classes-summary', {}
+
+    def api_class_details():
+        s = rng.choice(school['students'])
+        code = rng.choice(school['classes'])['class_code']
+        return session_user(s, 'student'), 'GET', f"/api/student/class-details/{code}/{s['section']}", {}
+
+    def api_sections():
+        code = rng.choice(school['classes'])['class_code']
+        return pick_student(), 'GET', f"/api/class/{code}/sections", {}
+
+    return {
+        'login': login,
+        'dashboard_student': dashboard_student,
+        'dashboard_teacher': dashboard_teacher,
+        'dashboard_admin': dashboard_admin,
+        'view_class': view_class,
+        'save_attendance': save_attendance,
+        'api_attendance_summary': api_attendance_summary,
+        'api_joined_classes': api_joined_classes,
+        'api_class_details': api_class_details,
+        'api_sections': api_sections,
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def run_scenario(driver, make_request, n, concurrency):
+    # One warm-up call so lazily created pools/caches do not skew the first sample.
+    user, method, path, kwargs = make_request()
+    driver.request(user, method, path, **kwargs)
+
+    requests_ = [make_request() for _ in range(n)]
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(req):
+        nonlocal errors
+        user, method, path, kwargs = req
+        start = time.perf_counter()
+        status = driver.request(user, method, path, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+
+    before = driver.counts()
+    wall = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, requests_))
+    else:
+        for req in requests_:
+            one(req)
+    wall = time.perf_counter() - wall
+    after = driver.counts()
+
+    latencies.sort()
+    result = {
+        'requests': n,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'throughput_rps': round(n / wall, 1) if wall else 0.0,
+    }
+    if before is not None and after is not None:
+        result['reads_per_req'] = round((after['reads'] - before['reads']) / n, 2)
+        result['writes_per_req'] = round((after['writes'] - before['writes']) / n, 2)
+    return result
+
+
+# ---------- Reporting ----------
+def format_report(args, results):
+    lines = [f"TrackIt benchmark: {args.classes} classes x {args.sections} sections x "
+             f"{args.students} students x {args.days} days, {args.requests} requests/scenario, "
+             f"concurrency {args.concurrency}",
+             f"{'scenario':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+             f"{'reads/req':>11}{'writes/req':>12}{'errors':>8}"]
+    for name, r in results.items():
+        lines.append(f"{name:<24}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                     f"{r['throughput_rps']:>10.1f}{r.get('reads_per_req', float('nan')):>11.2f}"
+                     f"{r.get('writes_per_req', float('nan')):>12.2f}{r['errors']:>8}")
+    return '\n'.join(lines)
+
+
+def find_regressions(results, baseline, tolerance, count_tolerance):
+    regressions = []
+    for name, base in baseline.get('results', {}).items():
+        cur = results.get(name)
+        if cur is None:
+            continue
+        for metric in TRACKED:
+            if metric not in base or metric not in cur:
+                continue
+            tol = tolerance if metric.endswith('_ms') else count_tolerance
+            # Half a millisecond of slack keeps sub-millisecond routes from flapping.
+            slack = 0.5 if metric.endswith('_ms') else 0.0
+            limit = base[metric] * (1 + tol) + slack
+            if cur[metric] > limit:
+                regressions.append(f"{name}.{metric}: {cur[metric]} > {base[metric]} (limit {limit:.2f})")
+        if cur['errors'] > base.get('errors', 0):
+            regressions.append(f"{name}.errors: {cur['errors']} > {base.get('errors', 0)}")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_backend(args)
+    import app as trackit
+    # Keep the per-request log lines out of the report; storage counters still run.
+    trackit.request_log.setLevel(logging.WARNING)
+
+    t0 = time.perf_counter()
+    school = seed_school(trackit, args)
+    seed_seconds = time.perf_counter() - t0
+
+    driver = HTTPDriver(args.base_url) if args.base_url else TestClientDriver(trackit)
+    scenarios = build_scenarios(school, random.Random(args.seed))
+    if args.only:
+        wanted = {s.strip() for s in args.only.split(',')}
+        scenarios = {k: v for k, v in scenarios.items() if k in wanted}
+
+    results = {name: run_scenario(driver, make, args.requests, args.concurrency)
+               for name, make in scenarios.items()}
+
+    report = format_report(args, results) + f"\nseeded in {seed_seconds:.1f}s"
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance, args.count_tolerance)
+        if regressions:
+            report += "\nREGRESSIONS:\n  " + "\n  ".join(regressions)
+            status = 1
+        else:
+            report += "\nno regressions against " + args.baseline
+
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': {k: getattr(args, k) for k in ('classes', 'sections', 'students', 'days')},
+                       'results': results}, f, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""Gunicorn settings for TrackIt.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded in the master, so workers share its memory. No storage
+client exists until post_fork, which opens and warms one per worker.
+"""
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('TRACKIT_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Required: a threaded worker class. Each live attendance stream (SSE) holds a
+# request thread for up to TRACKIT_STREAM_MAX_AGE seconds. The app reads the same
+# TRACKIT_THREADS to cap streams per worker at half the threads, so the other
+# half stays free for ordinary requests. Sync workers get no streams at all.
+worker_class = 'gthread'
+threads = int(os.environ.get('TRACKIT_THREADS', '8'))
+timeout = int(os.environ.get('TRACKIT_WORKER_TIMEOUT', '60'))
+preload_app = os.environ.get('TRACKIT_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        import app
+        app.import_storage_modules()
+        server.log.info("Preloaded app in %.0f ms, storage libraries in %.0f ms",
+                        app.STARTUP_SECONDS['import'] * 1000, app.STARTUP_SECONDS['libraries'] * 1000)
+
+
+def post_fork(server, worker):
+    import app
+    app.warm_up()
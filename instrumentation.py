@@ -0,0 +1,269 @@
+"""Per-request data-access accounting and Prometheus-style histograms.
+
+InstrumentedStore wraps the storage client (Firestore or SQLiteStore). It
+counts and times every read, query and write made through it into the dict
+returned by `current`. That dict is the per-request tally in app.py, or None
+when the request is not sampled; unsampled calls pass straight through.
+"""
+import bisect
+import threading
+import time
+
+# Rough Firestore storage-size accounting: strings are their UTF-8 length + 1,
+# numbers/timestamps 8 bytes, booleans/null 1 byte, map keys like strings.
+def estimate_size(value):
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value) + 1
+    if isinstance(value, dict):
+        return sum(len(k.encode('utf-8')) + 1 + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return 8
+
+def snapshot_size(snap):
+    data = getattr(snap, '_data', None)
+    if data is None and getattr(snap, 'exists', False):
+        data = snap.to_dict()
+    # Document name overhead (path + 16) is part of Firestore's document size.
+    return len(snap.reference.path) + 17 + (estimate_size(data) if data else 0)
+
+def new_tally():
+    return {'calls': 0, 'docs': 0, 'bytes': 0, 'writes': 0, 'db_ms': 0.0, 'hash_ms': 0.0}
+
+
+def _unwrap(obj):
+    return getattr(obj, '_wrapped', obj)
+
+
+class _Wrapper:
+    def __init__(self, wrapped, current):
+        self._wrapped = wrapped
+        self._current = current
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def _time_read(self, call, *args, **kwargs):
+        tally = self._current()
+        if tally is None:
+            return call(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            tally['calls'] += 1
+            tally['db_ms'] += (time.perf_counter() - start) * 1000
+
+    def _count_snapshots(self, snaps):
+        """Count snapshots from a list or a lazy stream, timing each step of iteration."""
+        tally = self._current()
+        if tally is None:
+            yield from snaps
+            return
+        tally['calls'] += 1
+        it = iter(snaps)
+        while True:
+            start = time.perf_counter()
+            try:
+                snap = next(it)
+            except StopIteration:
+                tally['db_ms'] += (time.perf_counter() - start) * 1000
+                return
+            tally['db_ms'] += (time.perf_counter() - start) * 1000
+            if snap.exists:
+                tally['docs'] += 1
+                tally['bytes'] += snapshot_size(snap)
+            yield snap
+
+
+class InstrumentedReference(_Wrapper):
+    def __eq__(self, other):
+        return self._wrapped == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._wrapped)
+
+    @property
+    def parent(self):
+        return InstrumentedQuery(self._wrapped.parent, self._current)
+
+    def collection(self, name):
+        return InstrumentedQuery(self._wrapped.collection(name), self._current)
+
+    def get(self, *args, transaction=None, **kwargs):
+        snap = self._time_read(self._wrapped.get, *args, transaction=_unwrap(transaction), **kwargs)
+        tally = self._current()
+        if tally is not None and snap.exists:
+            tally['docs'] += 1
+            tally['bytes'] += snapshot_size(snap)
+        return snap
+
+    def _write(self, op, *args, **kwargs):
+        tally = self._current()
+        start = time.perf_counter()
+        result = getattr(self._wrapped, op)(*args, **kwargs)
+        if tally is not None:
+            tally['calls'] += 1
+            tally['writes'] += 1
+            tally['db_ms'] += (time.perf_counter() - start) * 1000
+        return result
+
+    def set(self, *args, **kwargs):
+        return self._write('set', *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._write('update', *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._write('create', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._write('delete', *args, **kwargs)
+
+
+class InstrumentedQuery(_Wrapper):
+    def _chain(name):
+        def method(self, *args, **kwargs):
+            return InstrumentedQuery(getattr(self._wrapped, name)(*args, **kwargs), self._current)
+        method.__name__ = name
+        return method
+
+    where = _chain('where')
+    order_by = _chain('order_by')
+    limit = _chain('limit')
+    offset = _chain('offset')
+    start_after = _chain('start_after')
+    start_at = _chain('start_at')
+    end_before = _chain('end_before')
+    end_at = _chain('end_at')
+    select = _chain('select')
+    del _chain
+
+    def document(self, *args, **kwargs):
+        return InstrumentedReference(self._wrapped.document(*args, **kwargs), self._current)
+
+    def add(self, *args, **kwargs):
+        tally = self._current()
+        if tally is not None:
+            tally['writes'] += 1
+        update_time, ref = self._time_read(self._wrapped.add, *args, **kwargs)
+        return update_time, InstrumentedReference(ref, self._current)
+
+    def list_documents(self, *args, **kwargs):
+        refs = self._time_read(self._wrapped.list_documents, *args, **kwargs)
+        return [InstrumentedReference(ref, self._current) for ref in refs]
+
+    def stream(self, transaction=None, **kwargs):
+        return self._count_snapshots(self._wrapped.stream(transaction=_unwrap(transaction), **kwargs))
+
+    def get(self, transaction=None, **kwargs):
+        return list(self._count_snapshots(self._wrapped.get(transaction=_unwrap(transaction), **kwargs)))
+
+
+class InstrumentedWriter(_Wrapper):
+    """WriteBatch or Transaction: counts staged writes, times commit()."""
+
+    def __init__(self, wrapped, current):
+        super().__init__(wrapped, current)
+        self._pending = 0
+
+    def _stage(self, op, reference, *args, **kwargs):
+        self._pending += 1
+        return getattr(self._wrapped, op)(_unwrap(reference), *args, **kwargs)
+
+    def set(self, reference, *args, **kwargs):
+        return self._stage('set', reference, *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        return self._stage('update', reference, *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        return self._stage('create', reference, *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        return self._stage('delete', reference, *args, **kwargs)
+
+    def flush_count(self):
+        """Add staged writes to the tally (transactions commit inside the client library)."""
+        tally = self._current()
+        if tally is not None:
+            tally['writes'] += self._pending
+        self._pending = 0
+
+    def commit(self, *args, **kwargs):
+        result = self._time_read(self._wrapped.commit, *args, **kwargs)
+        self.flush_count()
+        return result
+
+    def __len__(self):
+        return len(self._wrapped)
+
+
+class InstrumentedStore(_Wrapper):
+    def collection(self, name):
+        return InstrumentedQuery(self._wrapped.collection(name), self._current)
+
+    def document(self, path):
+        return InstrumentedReference(self._wrapped.document(path), self._current)
+
+    def get_all(self, references, transaction=None, **kwargs):
+        refs = [_unwrap(ref) for ref in references]
+        return self._count_snapshots(self._wrapped.get_all(refs, transaction=_unwrap(transaction), **kwargs))
+
+    def batch(self):
+        return InstrumentedWriter(self._wrapped.batch(), self._current)
+
+    def trace_transaction(self, fn):
+        """Wrap a transaction function so writes staged on the transaction are counted."""
+        def traced(transaction, *args):
+            writer = InstrumentedWriter(transaction, self._current)
+            result = fn(writer, *args)
+            writer.flush_count()
+            return result
+        return traced
+
+
+# ---------- Histograms ----------
+class Histogram:
+    """Cumulative Prometheus histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            idx = bisect.bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for label_values, (counts, total, count) in items:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            running = 0
+            for bound, n in zip(self.buckets, counts):
+                running += n
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {running}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:g}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return '\n'.join(lines)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
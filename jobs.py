@@ -0,0 +1,118 @@
+"""Background jobs: a per-process queue drained by worker threads.
+
+Job state lives in the `jobs` collection, so any worker can answer a status
+poll. The job itself runs in the process that accepted it. Threads start on
+first use in each process; a runner inherited across fork() must be replaced
+(see app._reset_after_fork).
+"""
+import queue
+import threading
+import traceback
+import uuid
+from datetime import datetime, timezone
+
+
+class JobQueueFull(Exception):
+    """Raised when a worker already has its maximum number of queued jobs."""
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class JobRunner:
+    def __init__(self, collection, handlers, workers=2, max_queued=100, logger=None):
+        """collection() returns the jobs collection; handlers maps kind -> fn(params, progress)."""
+        self._collection = collection
+        self._handlers = handlers
+        self._workers = workers
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._threads = []
+        self._timers = []
+        self._lock = threading.Lock()
+        self._logger = logger
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(max(self._workers, 1)):
+                t = threading.Thread(target=self._work, name=f"trackit-job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, kind, params=None, submitted_by=None, private=None):
+        """Queue kind and return its job id.
+
+        private holds extra handler params that are not written to the job
+        document (e.g. an uploaded roster with passwords).
+        """
+        if kind not in self._handlers:
+            raise KeyError(kind)
+        self._start()
+        job_id = uuid.uuid4().hex
+        ref = self._collection().document(job_id)
+        ref.set({'kind': kind, 'params': params or {}, 'status': 'queued', 'progress': None,
+                 'submitted_by': submitted_by, 'created_at': utcnow()})
+        try:
+            self._queue.put_nowait((job_id, kind, dict(params or {}, **(private or {}))))
+        except queue.Full:
+            ref.update({'status': 'failed', 'error': 'Job queue is full', 'finished_at': utcnow()})
+            raise JobQueueFull()
+        return job_id
+
+    def get(self, job_id):
+        snap = self._collection().document(job_id).get()
+        return dict(snap.to_dict(), id=job_id) if snap.exists else None
+
+    def every(self, seconds, kind, params=None, should_run=None):
+        """Submit kind every `seconds`; should_run() may veto a run (e.g. another worker holds the lease)."""
+        def tick():
+            try:
+                if should_run is None or should_run():
+                    self.submit(kind, params, submitted_by='scheduler')
+            except JobQueueFull:
+                pass
+            except Exception:
+                if self._logger:
+                    self._logger.exception("Scheduling %s failed", kind)
+            finally:
+                schedule()
+
+        def schedule():
+            timer = threading.Timer(seconds, tick)
+            timer.daemon = True
+            timer.start()
+            with self._lock:
+                self._timers = [t for t in self._timers if t.is_alive()] + [timer]
+
+        schedule()
+
+    def stop(self):
+        with self._lock:
+            for timer in self._timers:
+                timer.cancel()
+            self._timers = []
+
+    def _work(self):
+        while True:
+            job_id, kind, params = self._queue.get()
+            ref = self._collection().document(job_id)
+
+            def progress(value):
+                ref.update({'progress': value})
+
+            try:
+                ref.update({'status': 'running', 'started_at': utcnow()})
+                result = self._handlers[kind](params, progress)
+                ref.update({'status': 'succeeded', 'result': result, 'finished_at': utcnow()})
+            except Exception as e:
+                if self._logger:
+                    self._logger.error("Job %s (%s) failed:\n%s", job_id, kind, traceback.format_exc())
+                try:
+                    ref.update({'status': 'failed', 'error': str(e) or e.__class__.__name__,
+                                'finished_at': utcnow()})
+                except Exception:
+                    pass
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,182 @@
+"""In-process fan-out of attendance counter changes to student SSE streams.
+
+A change source delivers {student_id: {status: delta}} for one (class_code,
+section) key. The broker keeps at most one source watch per key while anyone
+is subscribed to it. Each delta goes only to the streams of the students it
+names.
+
+FirestoreChangeSource listens to attendance_counters with on_snapshot, so it
+sees saves made by any worker. LocalChangeSource is fed by the app after each
+attendance commit; it serves the SQLite backend and tests.
+"""
+import queue
+import threading
+
+STATUSES = ('present', 'absent', 'excused')
+
+
+class StreamsFull(Exception):
+    """Raised when a worker already holds its maximum number of streams."""
+
+
+class LocalChangeSource:
+    def __init__(self):
+        self._watchers = {}
+        self._lock = threading.Lock()
+
+    def watch(self, key, callback):
+        with self._lock:
+            self._watchers.setdefault(key, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._watchers.get(key, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks:
+                    self._watchers.pop(key, None)
+        return unsubscribe
+
+    def publish(self, totals):
+        """Deliver {(class_code, section): {student_id: {status: delta}}} after a commit."""
+        for key, deltas in totals.items():
+            if not deltas:
+                continue
+            with self._lock:
+                callbacks = list(self._watchers.get(key, ()))
+            for callback in callbacks:
+                callback(key, deltas)
+
+
+class FirestoreChangeSource:
+    """One on_snapshot listener per key on attendance_counters.
+
+    The first snapshot only records the current totals. Later snapshots are
+    diffed against them, so subscribers see deltas.
+    """
+
+    def __init__(self, counters_query):
+        self._counters_query = counters_query
+
+    def watch(self, key, callback):
+        last = {}
+        primed = threading.Event()
+
+        def on_snapshot(docs, changes, read_time):
+            deltas = {}
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    continue
+                data = change.document.to_dict() or {}
+                sid = data.get('student_id')
+                if not sid:
+                    continue
+                counts = {s: data.get(s, 0) for s in STATUSES}
+                previous = last.get(sid)
+                last[sid] = counts
+                if previous is None and not primed.is_set():
+                    continue
+                previous = previous or dict.fromkeys(STATUSES, 0)
+                d = {s: counts[s] - previous[s] for s in STATUSES if counts[s] != previous[s]}
+                if d:
+                    deltas[sid] = d
+            primed.set()
+            if deltas:
+                callback(key, deltas)
+
+        watch = self._counters_query(*key).on_snapshot(on_snapshot)
+        return watch.unsubscribe
+
+    def publish(self, totals):
+        pass  # the listener sees every commit
+
+
+class Subscription:
+    def __init__(self, broker, student_id, keys, queue_size):
+        self.broker = broker
+        self.student_id = student_id
+        self.keys = keys
+        self.overflowed = False
+        self.closed = False
+        self._queue = queue.Queue(maxsize=queue_size)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # The client is not keeping up; tell it to refetch instead.
+            self.overflowed = True
+
+    def get(self, timeout):
+        return self._queue.get(timeout=timeout)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+
+class AttendanceBroker:
+    def __init__(self, source, max_clients=100, queue_size=64):
+        self.source = source
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self._subs = {}          # key -> {student_id: set(Subscription)}
+        self._watches = {}       # key -> unsubscribe callable
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def client_count(self):
+        return self._count
+
+    def subscribe(self, student_id, keys):
+        keys = list(dict.fromkeys(keys))
+        sub = Subscription(self, student_id, keys, self.queue_size)
+        new_keys = []
+        with self._lock:
+            if self._count >= self.max_clients:
+                raise StreamsFull()
+            self._count += 1
+            for key in keys:
+                if key not in self._subs:
+                    self._subs[key] = {}
+                    new_keys.append(key)
+                self._subs[key].setdefault(student_id, set()).add(sub)
+        for key in new_keys:
+            unsubscribe = self.source.watch(key, self._dispatch)
+            with self._lock:
+                if key in self._subs and key not in self._watches:
+                    self._watches[key] = unsubscribe
+                    unsubscribe = None
+            if unsubscribe is not None:
+                unsubscribe()  # everyone left while the watch was starting
+        return sub
+
+    def unsubscribe(self, sub):
+        stop = []
+        with self._lock:
+            self._count -= 1
+            for key in sub.keys:
+                students = self._subs.get(key)
+                if students is None:
+                    continue
+                subs = students.get(sub.student_id)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del students[sub.student_id]
+                if not students:
+                    del self._subs[key]
+                    if key in self._watches:
+                        stop.append(self._watches.pop(key))
+        for unsubscribe in stop:
+            unsubscribe()
+
+    def _dispatch(self, key, deltas):
+        with self._lock:
+            students = self._subs.get(key, {})
+            targets = [(sub, deltas[sid]) for sid in deltas for sub in students.get(sid, ())]
+        class_code, section = key
+        for sub, delta in targets:
+            sub.put({'class_code': class_code, 'section': section, 'delta': delta})
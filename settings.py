@@ -0,0 +1,126 @@
+"""TrackIt configuration.
+
+Every TRACKIT_* environment variable is read here, once, when Settings() is
+built; app.py keeps the process-wide instance as `settings`. Tests build their
+own or patch attributes on it.
+"""
+import os
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class Settings:
+    def __init__(self, environ=None):
+        env = os.environ if environ is None else environ
+
+        self.secret = env.get('TRACKIT_SECRET', 'dev-secret-change-me')
+        self.admin_email = env.get('TRACKIT_ADMIN_EMAIL', 'admin@trackit.com')
+        self.admin_password = env.get('TRACKIT_ADMIN_PASSWORD', 'admin123')
+        # 'firestore' (default) or 'sqlite'; the SQLite store needs no credentials.
+        self.storage_backend = env.get('TRACKIT_STORAGE', 'firestore').lower()
+        self.sqlite_path = env.get('TRACKIT_SQLITE_PATH', os.path.join(ROOT, 'trackit.db'))
+        self.read_deadline = float(env.get('TRACKIT_READ_DEADLINE', '5'))
+        self.attendance_page_size = int(env.get('TRACKIT_ATTENDANCE_PAGE_SIZE', '31'))
+        self.admin_page_size = int(env.get('TRACKIT_ADMIN_PAGE_SIZE', '25'))
+        self.import_max_rows = int(env.get('TRACKIT_IMPORT_MAX_ROWS', '10000'))
+        self.export_page_size = int(env.get('TRACKIT_EXPORT_PAGE_SIZE', '50'))
+        # 'records' stores each day as [{student_id, status}, ...]; 'packed' stores a
+        # 2-bit status code per student in the section roster order. Reads handle both.
+        self.attendance_format = env.get('TRACKIT_ATTENDANCE_FORMAT', 'records').lower()
+        self.bulk_attendance_max_entries = int(env.get('TRACKIT_BULK_ATTENDANCE_MAX_ENTRIES', '1000'))
+        self.user_cache_size = int(env.get('TRACKIT_USER_CACHE_SIZE', '4096'))
+        self.user_cache_ttl = int(env.get('TRACKIT_USER_CACHE_TTL', '300'))
+        self.email_miss_ttl = int(env.get('TRACKIT_EMAIL_MISS_TTL', '30'))
+
+        # Section analytics: trend compares the last N attendance days with the N before;
+        # students under the rate or at/over the absence streak are flagged at risk.
+        self.analytics_trend_window = int(env.get('TRACKIT_ANALYTICS_TREND_WINDOW', '14'))
+        self.analytics_risk_rate = float(env.get('TRACKIT_ANALYTICS_RISK_RATE', '0.8'))
+        self.analytics_risk_streak = int(env.get('TRACKIT_ANALYTICS_RISK_STREAK', '3'))
+        self.analytics_cache_size = int(env.get('TRACKIT_ANALYTICS_CACHE_SIZE', '256'))
+
+        # Background jobs run on job_workers threads per process. Rollup compaction is
+        # scheduled every rollup_compact_interval seconds (0 disables the schedule);
+        # a lease makes sure only one worker runs it per interval.
+        self.job_workers = int(env.get('TRACKIT_JOB_WORKERS', '2'))
+        self.job_queue_limit = int(env.get('TRACKIT_JOB_QUEUE_LIMIT', '100'))
+        self.rollup_compact_interval = int(env.get('TRACKIT_ROLLUP_COMPACT_INTERVAL', '300'))
+        # Comma-separated YYYY-MM-DD term start dates; calendar half-years when unset.
+        self.term_starts = sorted(t.strip() for t in env.get('TRACKIT_TERM_STARTS', '').split(',') if t.strip())
+
+        # Password hashing runs in a per-worker process pool. hash_workers=0 hashes
+        # inline; hash_queue_limit caps running + waiting jobs before requests get a 503.
+        self.password_hash_method = env.get('TRACKIT_HASH_METHOD', 'scrypt:32768:8:1')
+        self.hash_workers = int(env.get('TRACKIT_HASH_WORKERS', '2'))
+        self.hash_queue_limit = int(env.get('TRACKIT_HASH_QUEUE_LIMIT', str(max(self.hash_workers, 1) * 4)))
+        self.hash_retry_after = int(env.get('TRACKIT_HASH_RETRY_AFTER', '2'))
+
+        # Fraction of requests whose storage calls are counted and timed (0 disables the
+        # storage wrapper entirely). Each sampled request also writes a log line, so the
+        # default is 1%; raise it while investigating. /metrics requires metrics_token
+        # as a bearer token when set.
+        self.metrics_sample_rate = float(env.get('TRACKIT_METRICS_SAMPLE_RATE', '0.01'))
+        self.metrics_token = env.get('TRACKIT_METRICS_TOKEN')
+
+        # Live attendance streams. 'firestore' listens to counter changes from every
+        # worker; 'local' only sees saves made by this process (SQLite, tests).
+        self.live_source = env.get('TRACKIT_LIVE_SOURCE', 'firestore' if self.storage_backend == 'firestore' else 'local')
+        # Each open stream holds a request thread, so a worker needs a threaded worker
+        # class (gunicorn gthread, see gunicorn.conf.py). Streams are capped at
+        # stream_max_clients per worker, half of worker_threads by default and never more
+        # than worker_threads - stream_reserved_threads, so other routes keep threads.
+        self.worker_threads = int(env.get('TRACKIT_THREADS', '8'))
+        self.stream_reserved_threads = max(2, self.worker_threads // 2)
+        self.stream_max_clients = max(0, min(int(env.get('TRACKIT_STREAM_MAX_CLIENTS', str(self.worker_threads // 2))),
+                                             self.worker_threads - self.stream_reserved_threads))
+        self.stream_heartbeat = int(env.get('TRACKIT_STREAM_HEARTBEAT', '15'))
+        # Streams are closed after this many seconds and the browser reconnects, so a
+        # worker thread is never pinned indefinitely.
+        self.stream_max_age = int(env.get('TRACKIT_STREAM_MAX_AGE', '300'))
+
+        # User search answers from an in-process prefix index, loaded at worker start in
+        # pages of user_index_page_size users. Searches wait up to user_index_wait
+        # seconds for the first load before answering 503.
+        self.user_index_page_size = int(env.get('TRACKIT_USER_INDEX_PAGE_SIZE', '1000'))
+        self.user_index_wait = float(env.get('TRACKIT_USER_INDEX_WAIT', '2'))
+
+        # Rendered class cards, admin rows and roster tables are cached per worker,
+        # keyed by the section versions they were built from. Compiled templates go to
+        # a bytecode cache in jinja_cache_dir (Jinja's per-user temp dir when unset;
+        # TRACKIT_JINJA_BYTECODE_CACHE=0 disables it).
+        self.fragment_cache_size = int(env.get('TRACKIT_FRAGMENT_CACHE_SIZE', '2048'))
+        self.jinja_bytecode_cache = env.get('TRACKIT_JINJA_BYTECODE_CACHE', '1') == '1'
+        self.jinja_cache_dir = env.get('TRACKIT_JINJA_CACHE_DIR') or None
+
+        # Attendance saves bump their section versions on classes/<code> inside the
+        # save transaction; a save that loses on contention is retried up to
+        # class_write_attempts times with jittered backoff. Class-document counters that
+        # no cache validates against go through the per-worker write buffer instead:
+        # updates queued while a commit is in flight, or within class_write_window_ms of
+        # the first one, go out as one write per class, and callers wait at most
+        # class_write_timeout seconds.
+        self.class_write_window_ms = int(env.get('TRACKIT_CLASS_WRITE_WINDOW_MS', '0'))
+        self.class_write_attempts = int(env.get('TRACKIT_CLASS_WRITE_ATTEMPTS', '5'))
+        self.class_write_timeout = float(env.get('TRACKIT_CLASS_WRITE_TIMEOUT', '10'))
+
+        # Read deadlines. Routes declare a latency budget (page_budget or api_budget
+        # seconds) that bounds every storage read they make; a single read gets at most
+        # read_attempt_deadline of it. Class, user, roster and counter reads are hedged:
+        # a second attempt starts after hedge_after_ms (0 disables) and the first answer
+        # wins. When the deadline passes, the last good copy (lkg_cache_size per worker)
+        # is served marked stale and refreshed in the background.
+        self.page_budget = float(env.get('TRACKIT_PAGE_BUDGET', '2'))
+        self.api_budget = float(env.get('TRACKIT_API_BUDGET', '1'))
+        self.hedge_after_ms = int(env.get('TRACKIT_HEDGE_AFTER_MS', '75'))
+        self.hedge_workers = int(env.get('TRACKIT_HEDGE_WORKERS', '16'))
+        self.read_attempt_deadline = float(env.get('TRACKIT_READ_ATTEMPT_DEADLINE', '0.4'))
+        self.lkg_cache_size = int(env.get('TRACKIT_LKG_CACHE_SIZE', '4096'))
+        # Background refreshes run on their own refresh_workers threads, with at most
+        # refresh_queue_limit batches queued, so they never hold up hedged request reads.
+        self.refresh_workers = int(env.get('TRACKIT_REFRESH_WORKERS', '2'))
+        self.refresh_queue_limit = int(env.get('TRACKIT_REFRESH_QUEUE_LIMIT', '8'))
+        # SQLite only: simulated read latency, with sqlite_slow_rate of reads taking
+        # sqlite_slow_ms, for exercising the deadlines above without Firestore.
+        self.sqlite_latency_ms = float(env.get('TRACKIT_SQLITE_LATENCY_MS', '0'))
+        self.sqlite_slow_rate = float(env.get('TRACKIT_SQLITE_SLOW_RATE', '0'))
+        self.sqlite_slow_ms = float(env.get('TRACKIT_SQLITE_SLOW_MS', '0'))
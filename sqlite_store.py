@@ -0,0 +1,498 @@
+"""SQLite document store implementing the subset of the Firestore client API used by TrackIt.
+
+Documents live in one table keyed by their full path ("classes/CS101",
+"classes/CS101/sections/A/attendance/2024-01-01") with the body stored as
+JSON. Fields used in where()/order_by() get expression indexes on first use,
+so the access patterns in app.py stay indexed without a schema per collection.
+
+For latency testing the store can add a simulated network delay to reads and
+queries made outside a transaction. Reads honour a `timeout` keyword the way
+Firestore does, raising DeadlineExceeded when the delay would exceed it.
+"""
+import base64
+import copy
+import datetime
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from google.api_core.exceptions import AlreadyExists, DeadlineExceeded, NotFound
+from google.cloud.firestore_v1 import transforms
+
+ASCENDING = 'ASCENDING'
+DESCENDING = 'DESCENDING'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path        TEXT PRIMARY KEY,
+    parent      TEXT NOT NULL,
+    doc_id      TEXT NOT NULL,
+    data        TEXT NOT NULL,
+    create_time TEXT NOT NULL,
+    update_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_parent ON documents(parent, doc_id);
+"""
+
+
+# ---------- Encoding ----------
+def _encode(value):
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if len(value) == 1 and '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        if len(value) == 1 and '__datetime__' in value:
+            return datetime.datetime.fromisoformat(value['__datetime__'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _json_path(field):
+    if field == '__name__':
+        return None
+    return '$' + ''.join('."%s"' % part.replace('"', '""') for part in field.split('.'))
+
+
+# ---------- Field transforms ----------
+def _apply_value(target, key, value, now):
+    if value is transforms.DELETE_FIELD:
+        target.pop(key, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        target[key] = now
+    elif isinstance(value, transforms.ArrayUnion):
+        arr = list(target.get(key) or [])
+        for v in value.values:
+            if v not in arr:
+                arr.append(copy.deepcopy(v))
+        target[key] = arr
+    elif isinstance(value, transforms.ArrayRemove):
+        target[key] = [v for v in (target.get(key) or []) if v not in value.values]
+    elif isinstance(value, transforms.Increment):
+        current = target.get(key)
+        target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+    elif isinstance(value, dict):
+        target[key] = _resolve(value, now)
+    else:
+        target[key] = copy.deepcopy(value)
+
+
+def _resolve(data, now):
+    out = {}
+    for k, v in data.items():
+        _apply_value(out, k, v, now)
+    return out
+
+
+def _merge(target, data, now):
+    for k, v in data.items():
+        if isinstance(v, dict) and isinstance(target.get(k), dict):
+            _merge(target[k], v, now)
+        else:
+            _apply_value(target, k, v, now)
+
+
+def _update(target, data, now):
+    for path, v in data.items():
+        parts = path.split('.')
+        cur = target
+        for p in parts[:-1]:
+            if not isinstance(cur.get(p), dict):
+                cur[p] = {}
+            cur = cur[p]
+        _apply_value(cur, parts[-1], v, now)
+
+
+def _get_field(data, field):
+    cur = data
+    for part in field.split('.'):
+        if not isinstance(cur, dict) or part not in cur:
+            raise KeyError(field)
+        cur = cur[part]
+    return cur
+
+
+# ---------- Snapshots / references ----------
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return copy.deepcopy(_get_field(self._data or {}, field))
+
+
+class DocumentReference:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._store, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name):
+        return CollectionReference(self._store, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        if transaction is None:
+            self._store._delay(kwargs.get('timeout'))
+        return self._store._read([self])[0]
+
+    def set(self, data, merge=False):
+        self._store._commit([('set', self, data, merge)])
+
+    def update(self, data):
+        self._store._commit([('update', self, data, False)])
+
+    def create(self, data):
+        self._store._commit([('create', self, data, False)])
+
+    def delete(self):
+        self._store._commit([('delete', self, None, False)])
+
+
+class Query:
+    def __init__(self, store, parent, filters=(), orders=(), limit=None, start_after=None):
+        self._store = store
+        self._parent = parent
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders,
+                     limit=self._limit, start_after=self._start_after)
+        state.update(changes)
+        return Query(self._store, self._parent, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((str(field_path), direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self
+
+    def stream(self, transaction=None, **kwargs):
+        if transaction is None:
+            self._store._delay(kwargs.get('timeout'))
+        return iter(self._store._query(self))
+
+    def get(self, transaction=None, **kwargs):
+        if transaction is None:
+            self._store._delay(kwargs.get('timeout'))
+        return self._store._query(self)
+
+
+class CollectionReference(Query):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._store, f"{self._parent}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data):
+        ref = self.document()
+        ref.create(document_data)
+        return _now(), ref
+
+    def list_documents(self):
+        return self._store._list(self._parent)
+
+
+# ---------- Writes ----------
+class WriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._ops = []
+
+    def __len__(self):
+        return len(self._ops)
+
+    def set(self, reference, document_data, merge=False):
+        self._ops.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._ops.append(('update', reference, field_updates, False))
+
+    def create(self, reference, document_data):
+        self._ops.append(('create', reference, document_data, False))
+
+    def delete(self, reference):
+        self._ops.append(('delete', reference, None, False))
+
+    def commit(self, **kwargs):
+        ops, self._ops = self._ops, []
+        self._store._commit(ops)
+        return []
+
+
+class Transaction(WriteBatch):
+    """Writes are buffered and applied when run_transaction's function returns."""
+
+
+# ---------- Store ----------
+class SQLiteStore:
+    def __init__(self, path=':memory:', latency=0.0, slow_rate=0.0, slow_latency=0.0):
+        """latency: seconds added to each non-transactional read; slow_rate of them take slow_latency instead."""
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.RLock()
+        self._indexed = set()
+        # Documents read / written and queries run, for benchmarks.
+        self.stats = {'reads': 0, 'writes': 0, 'queries': 0}
+        with self._lock:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def collection(self, collection_id):
+        return CollectionReference(self, collection_id)
+
+    def document(self, document_path):
+        return DocumentReference(self, document_path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        if transaction is None:
+            self._delay(kwargs.get('timeout'))
+        unique = list({ref.path: ref for ref in references}.values())
+        return iter(self._read(unique))
+
+    def run_transaction(self, fn, *args):
+        """Run fn(transaction, *args) with the database locked for writing, then apply its writes."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                transaction = Transaction(self)
+                result = fn(transaction, *args)
+                self._apply(transaction._ops)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return result
+
+    def close(self):
+        self._conn.close()
+
+    # ----- internals -----
+    def _delay(self, timeout=None):
+        """Sleep for the simulated round trip, outside the lock so reads overlap like real RPCs."""
+        if not (self.latency or self.slow_rate):
+            return
+        delay = self.slow_latency if random.random() < self.slow_rate else self.latency
+        if timeout is not None and delay > timeout:
+            time.sleep(max(timeout, 0))
+            raise DeadlineExceeded(f"Read did not finish within {timeout:.3f}s")
+        time.sleep(delay)
+
+    def _read(self, refs):
+        if not refs:
+            return []
+        with self._lock:
+            rows = {}
+            for i in range(0, len(refs), 500):
+                chunk = [r.path for r in refs[i:i + 500]]
+                marks = ','.join('?' * len(chunk))
+                for path, data, ct, ut in self._conn.execute(
+                        f'SELECT path, data, create_time, update_time FROM documents WHERE path IN ({marks})', chunk):
+                    rows[path] = (data, ct, ut)
+            self.stats['reads'] += len(refs)
+        snaps = []
+        for ref in refs:
+            row = rows.get(ref.path)
+            if row is None:
+                snaps.append(DocumentSnapshot(ref, None))
+            else:
+                snaps.append(DocumentSnapshot(ref, _decode(json.loads(row[0])),
+                                              datetime.datetime.fromisoformat(row[1]),
+                                              datetime.datetime.fromisoformat(row[2])))
+        return snaps
+
+    def _list(self, parent):
+        with self._lock:
+            rows = self._conn.execute('SELECT path FROM documents WHERE parent = ? ORDER BY doc_id', (parent,))
+            return [DocumentReference(self, path) for (path,) in rows.fetchall()]
+
+    def _ensure_index(self, field):
+        if field == '__name__' or field in self._indexed:
+            return
+        name = 'documents_f_' + ''.join(c if c.isalnum() else '_' for c in field)
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON documents(parent, json_extract(data, '{_json_path(field)}'))")
+        self._indexed.add(field)
+
+    def _field_sql(self, field):
+        if field == '__name__':
+            return 'doc_id'
+        return f"json_extract(data, '{_json_path(field)}')"
+
+    def _query(self, query):
+        sql = ['SELECT path, data, create_time, update_time FROM documents WHERE parent = ?']
+        params = [query._parent]
+        with self._lock:
+            for field, op, value in query._filters:
+                self._ensure_index(field)
+                col = self._field_sql(field)
+                if op in ('==', '<', '<=', '>', '>='):
+                    sql.append(f"AND {col} {'=' if op == '==' else op} ?")
+                    params.append(_encode(value))
+                elif op == 'in':
+                    sql.append(f"AND {col} IN ({','.join('?' * len(value))})")
+                    params.extend(_encode(v) for v in value)
+                elif op == 'array_contains':
+                    sql.append(f"AND EXISTS (SELECT 1 FROM json_each(data, '{_json_path(field)}') WHERE value = ?)")
+                    params.append(_encode(value))
+                else:
+                    raise ValueError(f"Unsupported operator {op!r}")
+
+            orders = list(query._orders)
+            for field, _ in orders:
+                self._ensure_index(field)
+                sql.append(f"AND {self._field_sql(field)} IS NOT NULL")
+            if not any(field == '__name__' for field, _ in orders):
+                orders.append(('__name__', orders[-1][1] if orders else ASCENDING))
+
+            if query._start_after is not None:
+                cursor_sql, cursor_params = self._cursor_clause(orders, query._start_after)
+                sql.append(f"AND ({cursor_sql})")
+                params.extend(cursor_params)
+
+            sql.append('ORDER BY ' + ', '.join(
+                f"{self._field_sql(f)} {'DESC' if d == DESCENDING else 'ASC'}" for f, d in orders))
+            if query._limit is not None:
+                sql.append('LIMIT ?')
+                params.append(query._limit)
+
+            rows = self._conn.execute(' '.join(sql), params).fetchall()
+            self.stats['queries'] += 1
+            self.stats['reads'] += max(len(rows), 1)
+
+        return [DocumentSnapshot(DocumentReference(self, path), _decode(json.loads(data)),
+                                 datetime.datetime.fromisoformat(ct), datetime.datetime.fromisoformat(ut))
+                for path, data, ct, ut in rows]
+
+    def _cursor_clause(self, orders, cursor):
+        if isinstance(cursor, DocumentSnapshot):
+            values = []
+            for field, _ in orders:
+                values.append(cursor.id if field == '__name__' else _get_field(cursor._data or {}, field))
+        else:
+            values = [cursor[field] for field, _ in orders if field in cursor]
+        # Lexicographic "after" over the ordered fields that have cursor values.
+        terms, params = [], []
+        for i, value in enumerate(values):
+            parts = []
+            for field, _ in orders[:i]:
+                parts.append(f"{self._field_sql(field)} = ?")
+            field, direction = orders[i]
+            parts.append(f"{self._field_sql(field)} {'<' if direction == DESCENDING else '>'} ?")
+            terms.append('(' + ' AND '.join(parts) + ')')
+            params.extend(_encode(v) for v in values[:i])
+            params.append(_encode(value))
+        return ' OR '.join(terms) or '1', params
+
+    def _commit(self, ops):
+        if not ops:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._apply(ops)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _apply(self, ops):
+        self.stats['writes'] += len(ops)
+        now = _now()
+        stamp = now.isoformat()
+        docs = {}
+        for kind, ref, data, merge in ops:
+            if ref.path not in docs:
+                row = self._conn.execute('SELECT data, create_time FROM documents WHERE path = ?',
+                                         (ref.path,)).fetchone()
+                docs[ref.path] = (_decode(json.loads(row[0])), row[1]) if row else (None, None)
+            current, created = docs[ref.path]
+
+            if kind == 'create':
+                if current is not None:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                current, created = _resolve(data, now), stamp
+            elif kind == 'set':
+                if merge and current is not None:
+                    _merge(current, data, now)
+                else:
+                    current, created = _resolve(data, now), created or stamp
+            elif kind == 'update':
+                if current is None:
+                    raise NotFound(f"No document to update: {ref.path}")
+                _update(current, data, now)
+            elif kind == 'delete':
+                current = None
+            docs[ref.path] = (current, created)
+
+        for path, (data, created) in docs.items():
+            if data is None:
+                self._conn.execute('DELETE FROM documents WHERE path = ?', (path,))
+                continue
+            parent, doc_id = path.rsplit('/', 1)
+            self._conn.execute(
+                'INSERT INTO documents (path, parent, doc_id, data, create_time, update_time) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET '
+                'data = excluded.data, update_time = excluded.update_time',
+                (path, parent, doc_id, json.dumps(_encode(data)), created, stamp))
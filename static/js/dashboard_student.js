@@ -5,6 +5,7 @@
    - Loading classes summary (API)
    - Ripple/bubble animation on class cards (originates from click point)
    - Fetching class details from Flask API with optional Firestore fallback
+   - Live attendance updates over Server-Sent Events
 */
 
 document.addEventListener("DOMContentLoaded", () => {
@@ -152,31 +153,48 @@ document.addEventListener("DOMContentLoaded", () => {
   // ------------------------
   // Attendance summary (Chart)
   // ------------------------
-  async function loadAttendanceSummary() {
+  let attendanceChart = null;
+  const attendanceTotals = { present: 0, absent: 0, excused: 0 };
+
+  function renderAttendanceSummary() {
     const canvas = document.getElementById("attendanceChart");
     if (!exists(canvas)) return;
+    const values = [attendanceTotals.present, attendanceTotals.absent, attendanceTotals.excused];
 
-    try {
-      const res = await fetch("/api/student/attendance-summary");
-      if (!res.ok) throw new Error("Attendance summary fetch failed");
-      const data = await res.json();
-
-      new Chart(canvas, {
+    if (attendanceChart) {
+      attendanceChart.data.datasets[0].data = values;
+      attendanceChart.update();
+    } else {
+      attendanceChart = new Chart(canvas, {
         type: "doughnut",
         data: {
           labels: ["Present", "Absent", "Excused"],
-          datasets: [{
-            data: [data.present || 0, data.absent || 0, data.excused || 0]
-          }]
+          datasets: [{ data: values }]
         },
         options: { responsive: true, maintainAspectRatio: false }
       });
+    }
+
+    document.getElementById("attendance-stats").innerHTML = `
+      <div class="stat-item">Present: ${attendanceTotals.present}</div>
+      <div class="stat-item">Absent: ${attendanceTotals.absent}</div>
+      <div class="stat-item">Excused: ${attendanceTotals.excused}</div>
+    `;
+  }
+
+  async function loadAttendanceSummary() {
+    const canvas = document.getElementById("attendanceChart");
+    if (!exists(canvas)) return;
+
+    try {
+      const res = await fetch("/api/student/attendance-summary");
+      if (!res.ok) throw new Error("Attendance summary fetch failed");
+      const data = await res.json();
 
-      document.getElementById("attendance-stats").innerHTML = `
-        <div class="stat-item">Present: ${data.present || 0}</div>
-        <div class="stat-item">Absent: ${data.absent || 0}</div>
-        <div class="stat-item">Excused: ${data.excused || 0}</div>
-      `;
+      attendanceTotals.present = data.present || 0;
+      attendanceTotals.absent = data.absent || 0;
+      attendanceTotals.excused = data.excused || 0;
+      renderAttendanceSummary();
     } catch (err) {
       console.error(err);
       document.getElementById("attendance-stats").innerHTML = `<p class="muted">Unable to load attendance summary.</p>`;
@@ -236,6 +254,56 @@ document.addEventListener("DOMContentLoaded", () => {
 
   loadClassesSummary();
 
+  // ------------------------
+  // Live attendance updates (Server-Sent Events)
+  // ------------------------
+  // The server pushes {class_code, section, delta} whenever a teacher saves
+  // attendance that changes this student's totals. After a reconnect we
+  // refetch once; the summaries answer 304 when nothing was missed.
+  function applyAttendanceDelta(event) {
+    const delta = event.delta || {};
+    Object.keys(attendanceTotals).forEach(status => {
+      attendanceTotals[status] += delta[status] || 0;
+    });
+    renderAttendanceSummary();
+
+    if (!exists(classesContainer)) return;
+    const card = Array.from(classesContainer.querySelectorAll(".class-card")).find(c =>
+      c.dataset.classId === event.class_code && c.dataset.section === event.section);
+    if (card) {
+      card.dataset.absent = Number(card.dataset.absent || 0) + (delta.absent || 0);
+      card.dataset.attendance = Number(card.dataset.attendance || 0) + (delta.present || 0);
+    }
+  }
+
+  function startLiveUpdates() {
+    if (!window.EventSource || !exists(document.getElementById("attendanceChart"))) return;
+    const source = new EventSource("/api/student/stream");
+    let connectedBefore = false;
+
+    source.addEventListener("open", () => {
+      if (connectedBefore) {
+        loadAttendanceSummary();
+        loadClassesSummary();
+      }
+      connectedBefore = true;
+    });
+    source.addEventListener("attendance", (ev) => {
+      try {
+        applyAttendanceDelta(JSON.parse(ev.data));
+      } catch (err) {
+        console.error(err);
+      }
+    });
+    // Sent when this page fell behind; the stream closes and reconnects.
+    source.addEventListener("resync", () => {
+      connectedBefore = true;
+    });
+    window.addEventListener("beforeunload", () => source.close());
+  }
+
+  startLiveUpdates();
+
   // ------------------------
   // Ripple helper
   // ------------------------
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# Tests run against the SQLite store; set before app is imported.
+os.environ.setdefault('TRACKIT_STORAGE', 'sqlite')
+os.environ['TRACKIT_SQLITE_PATH'] = ':memory:'
+os.environ.setdefault('TRACKIT_HASH_WORKERS', '0')
+os.environ.setdefault('TRACKIT_HASH_METHOD', 'pbkdf2:sha256:1000')
+os.environ.setdefault('TRACKIT_ROLLUP_COMPACT_INTERVAL', '0')
+os.environ.setdefault('TRACKIT_JINJA_BYTECODE_CACHE', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def trackit():
+    """The app module with an empty in-memory store and fresh per-process state."""
+    import app
+    app._reset_after_fork()
+    return app
+
+
+@pytest.fixture
+def client(trackit):
+    return trackit.app.test_client()
+
+
+def login_as(client, user_id, role, name='Test'):
+    with client.session_transaction() as session:
+        session['user'] = {'id': user_id, 'role': role, 'name': name}
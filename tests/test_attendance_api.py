@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+from conftest import login_as
+
+
+def _student_with_days(trackit, days):
+    trackit.create_class('C1', 'Physics', ['A'])
+    sid = trackit.insert_user({'name': 'Stu', 'email': 's@x', 'role': 'student', 'classes': []})
+    trackit.add_student_to_section(sid, 'C1', 'A')
+    trackit.add_class_to_user(sid, 'C1', 'A')
+    start = date(2024, 1, 1)
+    dates = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    for d in dates:
+        trackit.save_attendance_to_section('C1', 'A', d, [{'student_id': sid, 'status': 'present'}])
+    return sid, dates
+
+
+def test_class_details_default_page_is_newest_first(trackit, client):
+    sid, dates = _student_with_days(trackit, 40)
+    login_as(client, sid, 'student')
+
+    first = client.get('/api/student/class-details/C1/A').get_json()
+    assert [d['date'] for d in first['attendance']] == dates[::-1][:trackit.settings.attendance_page_size]
+    assert first['next_cursor'] == dates[40 - trackit.settings.attendance_page_size]
+
+    rest = client.get(f"/api/student/class-details/C1/A?cursor={first['next_cursor']}").get_json()
+    assert [d['date'] for d in rest['attendance']] == dates[::-1][trackit.settings.attendance_page_size:]
+    assert rest['next_cursor'] is None
+
+
+def test_class_details_oldest_first_on_request(trackit, client):
+    sid, dates = _student_with_days(trackit, 35)
+    login_as(client, sid, 'student')
+
+    page = client.get('/api/student/class-details/C1/A?order=asc&limit=10').get_json()
+    assert [d['date'] for d in page['attendance']] == dates[:10]
+    assert page['next_cursor'] == dates[9]
+
+
+def test_save_bumps_section_versions_in_the_same_commit(trackit):
+    sid, _ = _student_with_days(trackit, 2)
+    section = trackit.db.collection('classes').document('C1').get().to_dict()['sections']['A']
+    assert section['attendance_version'] == 2 and section['version'] >= 2
+
+    before = section['version']
+    trackit.save_attendance_to_section('C1', 'A', '2024-02-01', [{'student_id': sid, 'status': 'absent'}])
+    after = trackit.db.collection('classes').document('C1').get().to_dict()['sections']['A']
+    assert after['attendance_version'] == 3 and after['version'] == before + 1
+
+
+def test_contended_save_is_retried(trackit, monkeypatch):
+    from google.api_core.exceptions import Aborted
+    sid, _ = _student_with_days(trackit, 1)
+    real, calls = trackit.run_in_transaction, []
+
+    def flaky(fn, *args):
+        calls.append(fn)
+        if len(calls) == 1:
+            raise Aborted('contention')
+        return real(fn, *args)
+    monkeypatch.setattr(trackit, 'run_in_transaction', flaky)
+    monkeypatch.setattr(trackit.time, 'sleep', lambda s: None)
+    trackit.save_attendance_to_section('C1', 'A', '2024-02-01', [{'student_id': sid, 'status': 'absent'}])
+    assert len(calls) == 2
+    section = trackit.db.collection('classes').document('C1').get().to_dict()['sections']['A']
+    assert section['attendance_version'] == 2
@@ -0,0 +1,18 @@
+def test_backfill_class_counts_bumps_section_versions(trackit):
+    trackit.create_class('C1', 'Physics', ['A', 'B'])
+    sid = trackit.insert_user({'name': 'Stu', 'email': 's@x', 'role': 'student', 'classes': []})
+    trackit.add_student_to_section(sid, 'C1', 'A')
+    ref = trackit.db.collection('classes').document('C1')
+    ref.update({'student_count': 7})
+    before = ref.get().to_dict()['sections']
+
+    result = trackit.app.test_cli_runner().invoke(args=['backfill-class-counts'])
+    assert 'Updated counts on 1 classes.' in result.output
+
+    after = ref.get().to_dict()
+    assert after['student_count'] == 1
+    for sec in ('A', 'B'):
+        assert after['sections'][sec]['version'] == before[sec].get('version', 0) + 1
+
+    result = trackit.app.test_cli_runner().invoke(args=['backfill-class-counts'])
+    assert 'Updated counts on 0 classes.' in result.output
@@ -0,0 +1,88 @@
+import queue
+
+import pytest
+
+from live_updates import AttendanceBroker, LocalChangeSource, StreamsFull
+
+
+def test_deltas_reach_only_the_students_they_name():
+    source = LocalChangeSource()
+    broker = AttendanceBroker(source, max_clients=10)
+    alice = broker.subscribe('alice', [('C1', 'A'), ('C2', 'B')])
+    bob = broker.subscribe('bob', [('C1', 'A')])
+
+    source.publish({('C1', 'A'): {'alice': {'present': 1}}, ('C2', 'B'): {'bob': {'absent': 1}}})
+
+    assert alice.get(timeout=0) == {'class_code': 'C1', 'section': 'A', 'delta': {'present': 1}}
+    with pytest.raises(queue.Empty):
+        alice.get(timeout=0)
+    with pytest.raises(queue.Empty):
+        bob.get(timeout=0)  # bob is not watching C2/B
+
+
+def test_every_stream_of_a_student_gets_the_delta():
+    source = LocalChangeSource()
+    broker = AttendanceBroker(source)
+    tabs = [broker.subscribe('alice', [('C1', 'A')]) for _ in range(2)]
+    source.publish({('C1', 'A'): {'alice': {'present': 1, 'absent': -1}}})
+    for tab in tabs:
+        assert tab.get(timeout=0)['delta'] == {'present': 1, 'absent': -1}
+
+
+def test_subscription_limit_and_release():
+    broker = AttendanceBroker(LocalChangeSource(), max_clients=2)
+    first = broker.subscribe('a', [('C1', 'A')])
+    broker.subscribe('b', [('C1', 'A')])
+    with pytest.raises(StreamsFull):
+        broker.subscribe('c', [('C1', 'A')])
+
+    first.close()
+    first.close()  # closing twice releases one slot only
+    assert broker.client_count == 1
+    broker.subscribe('c', [('C1', 'A')])
+
+
+def test_watch_is_dropped_with_the_last_subscriber():
+    source = LocalChangeSource()
+    broker = AttendanceBroker(source)
+    subs = [broker.subscribe(sid, [('C1', 'A')]) for sid in ('a', 'b')]
+    assert len(source._watchers[('C1', 'A')]) == 1  # one watch per key
+    for sub in subs:
+        sub.close()
+    assert ('C1', 'A') not in source._watchers
+
+
+def test_slow_client_is_flagged_instead_of_blocking():
+    source = LocalChangeSource()
+    broker = AttendanceBroker(source, queue_size=2)
+    sub = broker.subscribe('a', [('C1', 'A')])
+    for _ in range(3):
+        source.publish({('C1', 'A'): {'a': {'present': 1}}})
+    assert sub.overflowed
+
+
+def test_stream_endpoint_sends_saved_deltas(trackit, client, monkeypatch):
+    from conftest import login_as
+    monkeypatch.setattr(trackit.settings, 'stream_heartbeat', 1)
+    trackit.create_class('C1', 'Physics', ['A'])
+    sid = trackit.insert_user({'name': 'Stu', 'email': 's@x', 'role': 'student', 'classes': []})
+    trackit.add_student_to_section(sid, 'C1', 'A')
+    trackit.add_class_to_user(sid, 'C1', 'A')
+    login_as(client, sid, 'student')
+
+    response = client.get('/api/student/stream', buffered=False, environ_overrides={'wsgi.multithread': True})
+    assert response.status_code == 200
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    trackit.save_attendance_to_section('C1', 'A', '2024-01-01', [{'student_id': sid, 'status': 'present'}])
+    assert next(chunks) == (b'event: attendance\ndata: {"class_code": "C1", "section": "A", '
+                            b'"delta": {"present": 1}}\n\n')
+    response.close()
+    assert trackit.state.attendance_broker.client_count == 0
+
+
+def test_stream_endpoint_refuses_single_threaded_servers(trackit, client):
+    from conftest import login_as
+    sid = trackit.insert_user({'name': 'Stu', 'email': 's@x', 'role': 'student', 'classes': []})
+    login_as(client, sid, 'student')
+    assert client.get('/api/student/stream').status_code == 503
@@ -0,0 +1,52 @@
+def _by_student(records):
+    return {r['student_id']: r for r in records}
+
+
+def test_pack_unpack_round_trip(trackit):
+    roster = ['a', 'b']
+    records = [
+        {'student_id': 'b', 'status': 'absent', 'note': 'sick'},
+        {'student_id': 'c', 'status': 'present'},       # appended to the roster
+        {'student_id': 'd', 'status': 'late'},          # unknown status goes to extra
+        {'student_id': 'e', 'status': 'excused'},
+    ]
+    body = trackit.pack_attendance(records, roster)
+    assert roster == ['a', 'b', 'c', 'd', 'e']
+    assert body['count'] == 5 and len(body['codes']) == 2
+    assert _by_student(trackit.unpack_attendance(body, roster)) == _by_student(records)
+
+
+def test_packed_days_decode_against_a_grown_roster(trackit):
+    roster = ['a']
+    first = trackit.pack_attendance([{'student_id': 'a', 'status': 'present'}], roster)
+    trackit.pack_attendance([{'student_id': 'b', 'status': 'absent'}], roster)
+    # An older day stays valid after later days append students.
+    assert trackit.unpack_attendance(first, roster) == [{'student_id': 'a', 'status': 'present'}]
+
+
+def test_packed_saves_and_conversion_keep_records(trackit, monkeypatch):
+    monkeypatch.setattr(trackit.settings, 'attendance_format', 'packed')
+    trackit.create_class('C1', 'Physics', ['A'])
+    days = {
+        '2024-01-01': [{'student_id': 's1', 'status': 'present'}, {'student_id': 's2', 'status': 'absent'}],
+        '2024-01-02': [{'student_id': 's3', 'status': 'excused'}, {'student_id': 's1', 'status': 'absent'}],
+    }
+    for d, records in days.items():
+        trackit.save_attendance_to_section('C1', 'A', d, records)
+    stored = trackit.attendance_collection('C1', 'A').document('2024-01-01').get().to_dict()
+    assert stored['format'] == 'packed'
+    assert trackit.get_section_roster('C1', 'A') == ['s1', 's2', 's3']
+
+    def read_back():
+        page, _ = trackit.get_attendance_page('C1', 'A')
+        return {d['date']: _by_student(d['records']) for d in page}
+
+    expected = {d: _by_student(r) for d, r in days.items()}
+    assert read_back() == expected
+
+    runner = trackit.app.test_cli_runner()
+    assert 'Converted 2 attendance days to records' in runner.invoke(args=['convert-attendance', '--to', 'records']).output
+    assert 'records' in trackit.attendance_collection('C1', 'A').document('2024-01-02').get().to_dict()
+    assert read_back() == expected
+    assert 'Converted 2 attendance days to packed' in runner.invoke(args=['convert-attendance', '--to', 'packed']).output
+    assert read_back() == expected
@@ -0,0 +1,26 @@
+from werkzeug.security import generate_password_hash
+
+
+def test_fresh_hash_does_not_need_rehash(trackit, monkeypatch):
+    for method in ('pbkdf2:sha256', 'pbkdf2:sha256:1000', 'scrypt'):
+        monkeypatch.setattr(trackit.settings, 'password_hash_method', method)
+        trackit._hash_prefix.cache_clear()
+        assert not trackit.needs_rehash(trackit.hash_password('secret'))
+    trackit._hash_prefix.cache_clear()
+
+
+def test_legacy_hash_needs_rehash(trackit, monkeypatch):
+    monkeypatch.setattr(trackit.settings, 'password_hash_method', 'scrypt')
+    trackit._hash_prefix.cache_clear()
+    assert trackit.needs_rehash(generate_password_hash('secret', 'pbkdf2:sha256:1000'))
+    trackit._hash_prefix.cache_clear()
+
+
+def test_login_does_not_rewrite_current_hash(trackit, client):
+    user_id = trackit.insert_user({'name': 'T', 'email': 't@x', 'role': 'teacher', 'classes': [],
+                                   'password_hash': trackit.hash_password('pw')})
+    ref = trackit.db.collection('users').document(user_id)
+    before = ref.get().update_time
+    response = client.post('/login', data={'email': 't@x', 'password': 'pw'})
+    assert response.status_code == 302
+    assert ref.get().update_time == before
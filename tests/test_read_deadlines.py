@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from conftest import login_as
+
+
+@pytest.fixture
+def student(trackit, client):
+    trackit.create_class('C1', 'Physics', ['A'])
+    sid = trackit.insert_user({'name': 'Stu', 'email': 's@x', 'role': 'student', 'classes': []})
+    trackit.add_student_to_section(sid, 'C1', 'A')
+    trackit.add_class_to_user(sid, 'C1', 'A')
+    trackit.save_attendance_to_section('C1', 'A', '2024-01-01', [{'student_id': sid, 'status': 'present'}])
+    login_as(client, sid, 'student')
+    return sid
+
+
+def slow_store(trackit, monkeypatch, latency=0.3):
+    store = trackit.get_db()
+    store = getattr(store, '_wrapped', store)
+    monkeypatch.setattr(trackit.settings, 'read_attempt_deadline', 0.05)
+    monkeypatch.setattr(store, 'latency', latency)
+    return store
+
+
+STUDENT_READS = ['/dashboard', '/api/student/attendance-summary', '/api/student/joined-classes-summary',
+                 '/api/student/class-details/C1/A']
+
+
+def test_student_reads_serve_warm_copies_when_the_store_is_slow(trackit, client, student, monkeypatch):
+    fresh = {path: client.get(path) for path in STUDENT_READS}
+    assert all(r.status_code == 200 for r in fresh.values())
+
+    slow_store(trackit, monkeypatch)
+    for path in STUDENT_READS:
+        # Each read gets a fresh identity map, so every request goes to the store.
+        response = client.get(path)
+        assert response.status_code == 200, path
+        assert response.headers['Warning'] == '110 - "Response is Stale"'
+        assert response.data == fresh[path].data
+    assert trackit.state.read_stats['stale_served'] >= len(STUDENT_READS)
+
+
+def test_slow_store_without_copies_is_503(trackit, client, student, monkeypatch):
+    slow_store(trackit, monkeypatch)
+    response = client.get('/api/student/class-details/C1/A')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_each_read_is_capped_below_the_route_budget(trackit):
+    with trackit.app.test_request_context('/'):
+        trackit.g._trackit_deadline = time.monotonic() + 10
+        assert trackit.read_timeout() == pytest.approx(trackit.settings.read_attempt_deadline)
+        trackit.g._trackit_deadline = time.monotonic() + trackit.settings.read_attempt_deadline / 4
+        assert trackit.read_timeout() < trackit.settings.read_attempt_deadline / 4 + 0.01
+
+
+def test_hedged_read_counts_only_the_winning_attempt(trackit, monkeypatch):
+    monkeypatch.setattr(trackit.settings, 'hedge_after_ms', 10)
+    attempts = []
+
+    def read(timeout):
+        attempts.append(timeout)
+        trackit.current_io()['calls'] += 1
+        if len(attempts) == 1:
+            time.sleep(0.2)
+        return 'ok'
+
+    with trackit.app.test_request_context('/'):
+        trackit.g._trackit_io = trackit.new_tally()
+        assert trackit.hedged_read(read, 1) == 'ok'
+        assert len(attempts) == 2
+        assert trackit.g._trackit_io['calls'] == 1
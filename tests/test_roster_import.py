@@ -0,0 +1,40 @@
+def _rows(trackit, *rows):
+    return [trackit._normalize_roster_row(r) for r in rows]
+
+
+def test_import_reuses_legacy_account_without_email_index(trackit):
+    trackit.create_class('C1', 'Physics', ['A'])
+    legacy = trackit.db.collection('users').document('legacy1')
+    legacy.set({'name': 'Old', 'email': 'old@x', 'role': 'student', 'classes': []})
+
+    errors, results = trackit.import_roster(_rows(
+        trackit,
+        {'email': 'old@x', 'role': 'student', 'class_code': 'C1', 'section': 'A'},
+        {'email': 'new@x', 'role': 'student', 'name': 'New', 'password': 'pw'},
+    ))
+
+    assert errors == []
+    assert [(r['email'], r['status'], r['user_id']) for r in results][0] == ('old@x', 'exists', 'legacy1')
+    users = [u.to_dict()['email'] for u in trackit.db.collection('users').stream()]
+    assert sorted(users) == ['new@x', 'old@x']
+
+
+def test_import_route_runs_as_job(trackit, client):
+    from conftest import login_as
+    trackit.create_class('C1', 'Physics', ['A'])
+    login_as(client, 'admin', 'admin')
+    rows = [{'email': f's{i}@x', 'name': f'S{i}', 'password': 'pw', 'class_code': 'C1', 'section': 'A'}
+            for i in range(3)]
+
+    bad = client.post('/admin/import_roster', json={'rows': [{'email': 'nope'}]})
+    assert bad.status_code == 400
+
+    response = client.post('/admin/import_roster', json={'rows': rows})
+    assert response.status_code == 202
+    trackit.state.job_runner._queue.join()
+
+    job = client.get(response.get_json()['status_url']).get_json()
+    assert job['status'] == 'succeeded'
+    assert job['params'] == {'rows': 3}  # the rows themselves are not stored
+    assert job['result'] == {'status': 'success', 'summary': {'created': 3}, 'failed': []}
+    assert len(trackit.db.collection('classes').document('C1').get().to_dict()['sections']['A']['students']) == 3
@@ -0,0 +1,110 @@
+import pytest
+from google.api_core.exceptions import AlreadyExists, DeadlineExceeded, NotFound
+from google.cloud.firestore_v1 import transforms
+
+from sqlite_store import DESCENDING, SQLiteStore
+
+
+@pytest.fixture
+def store():
+    s = SQLiteStore(':memory:')
+    yield s
+    s.close()
+
+
+def test_set_get_update_and_nested_fields(store):
+    ref = store.collection('classes').document('C1')
+    ref.set({'name': 'Physics', 'sections': {'A': {'students': ['s1']}}})
+    ref.update({'sections.A.teacher': 't1', 'sections.B': {'students': []}})
+    snap = ref.get()
+    assert snap.exists and snap.id == 'C1'
+    assert snap.to_dict() == {'name': 'Physics', 'sections': {'A': {'students': ['s1'], 'teacher': 't1'},
+                                                              'B': {'students': []}}}
+    with pytest.raises(NotFound):
+        store.collection('classes').document('missing').update({'x': 1})
+    with pytest.raises(AlreadyExists):
+        ref.create({'name': 'again'})
+
+
+def test_transforms(store):
+    ref = store.collection('counters').document('c')
+    ref.set({'n': 1, 'ids': ['a']})
+    batch = store.batch()
+    batch.update(ref, {'n': transforms.Increment(2), 'ids': transforms.ArrayUnion(['a', 'b'])})
+    batch.update(ref, {'n': transforms.Increment(3)})
+    batch.set(store.collection('counters').document('new'), {'n': transforms.Increment(4)}, merge=True)
+    batch.commit()
+    assert ref.get().to_dict() == {'n': 6, 'ids': ['a', 'b']}
+    assert store.collection('counters').document('new').get().to_dict() == {'n': 4}
+
+    ref.update({'ids': transforms.ArrayRemove(['a']), 'at': transforms.SERVER_TIMESTAMP})
+    data = ref.get().to_dict()
+    assert data['ids'] == ['b'] and data['at'] is not None
+
+
+def test_get_all_keeps_missing_documents_and_dedupes(store):
+    col = store.collection('users')
+    col.document('a').set({'name': 'A'})
+    snaps = list(store.get_all([col.document('a'), col.document('zz'), col.document('a')]))
+    assert [(s.id, s.exists) for s in snaps] == [('a', True), ('zz', False)]
+    assert snaps[1].to_dict() is None
+
+
+def test_transaction_commits_all_or_nothing(store):
+    a, b = store.collection('t').document('a'), store.collection('t').document('b')
+    a.set({'n': 1})
+
+    def move(transaction):
+        n = a.get(transaction=transaction).to_dict()['n']
+        transaction.update(a, {'n': n - 1})
+        transaction.set(b, {'n': n})
+        return n
+
+    assert store.run_transaction(move) == 1
+    assert (a.get().to_dict(), b.get().to_dict()) == ({'n': 0}, {'n': 1})
+
+    def fail(transaction):
+        transaction.update(a, {'n': 100})
+        transaction.create(b, {'n': 5})  # b exists: the whole transaction is rolled back
+
+    with pytest.raises(AlreadyExists):
+        store.run_transaction(fail)
+    assert a.get().to_dict() == {'n': 0}
+
+
+def test_where_order_limit_and_cursor(store):
+    col = store.collection('days')
+    for i, cls in enumerate(['x', 'y', 'x', 'x', 'y', 'x']):
+        col.document(f"d{i}").set({'date': f"2024-01-0{i + 1}", 'cls': cls})
+
+    query = col.where('cls', '==', 'x').order_by('date')
+    assert [s.id for s in query.stream()] == ['d0', 'd2', 'd3', 'd5']
+    assert [s.id for s in query.start_after({'date': '2024-01-03'}).limit(2).stream()] == ['d3', 'd5']
+
+    newest = col.order_by('date', direction=DESCENDING)
+    assert [s.id for s in newest.limit(2).stream()] == ['d5', 'd4']
+    assert [s.id for s in newest.start_after({'date': '2024-01-05'}).limit(2).stream()] == ['d3', 'd2']
+
+    assert [s.id for s in col.where('date', '>=', '2024-01-05').stream()] == ['d4', 'd5']
+    assert sorted(s.id for s in col.where('cls', 'in', ['y']).stream()) == ['d1', 'd4']
+
+
+def test_subcollections_are_separate(store):
+    store.collection('classes/C1/sections').document('A').set({'roster': ['a']})
+    store.collection('classes/C2/sections').document('A').set({'roster': ['b']})
+    assert [s.to_dict()['roster'] for s in store.collection('classes/C1/sections').stream()] == [['a']]
+    assert [r.id for r in store.collection('classes/C2/sections').list_documents()] == ['A']
+
+
+def test_latency_injection_honours_timeouts():
+    slow = SQLiteStore(':memory:', latency=0.05)
+    ref = slow.collection('c').document('a')
+    ref.set({'n': 1})
+    assert ref.get(timeout=1).to_dict() == {'n': 1}
+    with pytest.raises(DeadlineExceeded):
+        ref.get(timeout=0.01)
+    with pytest.raises(DeadlineExceeded):
+        list(slow.collection('c').stream(timeout=0.01))
+    # Reads inside a transaction are not delayed.
+    assert slow.run_transaction(lambda t: ref.get(transaction=t).to_dict()) == {'n': 1}
+    slow.close()
@@ -0,0 +1,51 @@
+from conftest import login_as
+from user_search import UserIndex, index_keys, normalize
+
+
+def test_normalize_and_keys():
+    assert normalize('  José   ÁLVAREZ ') == 'jose alvarez'
+    assert index_keys({'name': 'Anna Maria Smith', 'email': 'Anna@X.org', 'student_id': 'S-1'}) == {
+        'anna maria smith', 'maria smith', 'smith', 'anna@x.org', 's-1'}
+
+
+def test_search_ranks_exact_then_shorter_keys():
+    index = UserIndex()
+    index.upsert('u1', {'name': 'Samantha Jones', 'role': 'student'})
+    index.upsert('u2', {'name': 'Sam', 'role': 'teacher'})
+    index.upsert('u3', {'name': 'Sami Lee', 'role': 'student'})
+    index.upsert('u4', {'name': 'Bob Samson', 'role': 'student'})
+
+    assert [u['id'] for u in index.search('sam')] == ['u2', 'u4', 'u3', 'u1']
+    assert [u['id'] for u in index.search('SAM', role='student')] == ['u4', 'u3', 'u1']
+    # An exact match sorts first among the keys, so a limit never drops it.
+    assert [u['id'] for u in index.search('sam', limit=2)][0] == 'u2'
+    assert index.search('') == [] and index.search('zzz') == []
+
+
+def test_upsert_replaces_old_keys():
+    index = UserIndex()
+    index.upsert('u1', {'name': 'Old Name', 'email': 'a@x'})
+    index.upsert('u1', {'name': 'New Name', 'email': 'a@x'})
+    assert index.search('old') == []
+    assert [u['name'] for u in index.search('new')] == ['New Name']
+    assert len(index) == 1
+
+
+def test_load_keeps_users_written_while_loading():
+    index = UserIndex()
+    index.upsert('u2', {'name': 'Fresh Name'})  # arrived through a live write
+    index.load([('u1', {'name': 'Alice'}), ('u2', {'name': 'Stale Name'})])
+    assert index.ready.is_set()
+    assert [u['id'] for u in index.search('alice')] == ['u1']
+    assert [u['id'] for u in index.search('fresh')] == ['u2']
+    assert index.search('stale') == []
+
+
+def test_search_endpoint_is_admin_only(trackit, client):
+    trackit.insert_user({'name': 'Anna Smith', 'email': 'anna@x', 'role': 'student', 'classes': []})
+    login_as(client, 't1', 'teacher')
+    assert client.get('/api/search/users?q=anna').status_code == 403
+
+    login_as(client, 'admin', 'admin')
+    users = client.get('/api/search/users?q=smi').get_json()['users']
+    assert [u['email'] for u in users] == ['anna@x']
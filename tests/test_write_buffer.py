@@ -0,0 +1,81 @@
+import logging
+
+import pytest
+from google.api_core.exceptions import Aborted, NotFound
+
+from write_buffer import CoalescingWriter
+
+
+def add_counts(old, new):
+    merged = dict(old)
+    for field, n in new.items():
+        merged[field] = merged.get(field, 0) + n
+    return merged
+
+
+class FakeCommit:
+    """Records committed batches; errors are raised in order before succeeding."""
+
+    def __init__(self, errors=(), fail_keys=()):
+        self.batches = []
+        self.errors = list(errors)
+        self.fail_keys = set(fail_keys)
+
+    def __call__(self, updates):
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.fail_keys & set(updates):
+            raise NotFound('gone')
+        self.batches.append(dict(updates))
+
+
+def test_updates_within_the_window_are_combined():
+    commit = FakeCommit()
+    writer = CoalescingWriter(commit, add_counts, window=0.2)
+    futures = [writer.submit('C1', {'n': 1}) for _ in range(4)] + [writer.submit('C2', {'n': 5})]
+    for future in futures:
+        future.result(timeout=5)
+    assert commit.batches == [{'C1': {'n': 4}, 'C2': {'n': 5}}]
+    assert writer.stats['submitted'] == 5 and writer.stats['commits'] == 1
+
+
+def test_retryable_errors_are_retried():
+    commit = FakeCommit(errors=[Aborted('busy'), Aborted('busy')])
+    writer = CoalescingWriter(commit, add_counts, window=0, backoff=0.001,
+                              is_retryable=lambda e: isinstance(e, Aborted))
+    writer.submit('C1', {'n': 1}).result(timeout=5)
+    assert commit.batches == [{'C1': {'n': 1}}]
+    assert writer.stats['retries'] == 2
+
+
+def test_retries_give_up_after_max_attempts():
+    commit = FakeCommit(errors=[Aborted('busy')] * 3)
+    writer = CoalescingWriter(commit, add_counts, window=0, backoff=0.001, max_attempts=3,
+                              is_retryable=lambda e: isinstance(e, Aborted))
+    with pytest.raises(Aborted):
+        writer.submit('C1', {'n': 1}).result(timeout=5)
+    assert writer.stats['failures'] == 1
+
+
+def test_non_retryable_error_fails_only_its_key():
+    commit = FakeCommit(fail_keys={'gone'})
+    writer = CoalescingWriter(commit, add_counts, window=0.05)
+    ok = writer.submit('C1', {'n': 1})
+    bad = writer.submit('gone', {'n': 1})
+    ok.result(timeout=5)
+    with pytest.raises(NotFound):
+        bad.result(timeout=5)
+    assert {'C1': {'n': 1}} in commit.batches
+
+
+def test_failing_on_flush_does_not_stop_the_writer(caplog):
+    def on_flush(updates, attempts):
+        raise RuntimeError('hook broke')
+
+    writer = CoalescingWriter(FakeCommit(), add_counts, window=0, on_flush=on_flush,
+                              logger=logging.getLogger('test_write_buffer'))
+    with caplog.at_level(logging.ERROR):
+        writer.submit('C1', {'n': 1}).result(timeout=5)
+        writer.submit('C1', {'n': 1}).result(timeout=5)
+    assert writer._thread.is_alive()
+    assert 'on_flush hook failed' in caplog.text
@@ -0,0 +1,101 @@
+"""In-process prefix index over users for search and autocomplete.
+
+Every user gets a few normalized keys: the full name and each later word of it
+(so "smi" finds "Anna Smith"), the email, and the student or teacher id. The
+keys are kept in one sorted list of (key, user_id) pairs. A lookup bisects to
+the query and walks forward while keys still start with it, so its cost
+depends on the number of matches returned, not on the number of users.
+"""
+import bisect
+import threading
+import unicodedata
+
+FIELDS = ('name', 'email', 'role', 'student_id', 'teacher_id')
+
+
+def normalize(text):
+    """Casefold, strip accents and collapse whitespace."""
+    text = unicodedata.normalize('NFKD', str(text or '')).casefold()
+    return ' '.join(''.join(ch for ch in text if not unicodedata.combining(ch)).split())
+
+
+def index_keys(user):
+    keys = set()
+    words = normalize(user.get('name')).split(' ')
+    for i in range(len(words)):
+        keys.add(' '.join(words[i:]))
+    for field in ('email', 'student_id', 'teacher_id'):
+        keys.add(normalize(user.get(field)))
+    keys.discard('')
+    return keys
+
+
+class UserIndex:
+    def __init__(self):
+        self._entries = []      # sorted (key, user_id)
+        self._users = {}        # user_id -> public fields
+        self._keys = {}         # user_id -> set of keys
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def __len__(self):
+        return len(self._users)
+
+    def upsert(self, user_id, data):
+        user = {f: data[f] for f in FIELDS if data.get(f)}
+        keys = index_keys(user)
+        with self._lock:
+            old = self._keys.get(user_id, set())
+            for key in old - keys:
+                i = bisect.bisect_left(self._entries, (key, user_id))
+                if i < len(self._entries) and self._entries[i] == (key, user_id):
+                    del self._entries[i]
+            for key in keys - old:
+                bisect.insort(self._entries, (key, user_id))
+            self._keys[user_id] = keys
+            self._users[user_id] = user
+
+    def load(self, users):
+        """Replace the index with (user_id, data) pairs, sorting once instead of per insert."""
+        entries, keys, profiles = [], {}, {}
+        for user_id, data in users:
+            user = {f: data[f] for f in FIELDS if data.get(f)}
+            keys[user_id] = index_keys(user)
+            profiles[user_id] = user
+            entries.extend((key, user_id) for key in keys[user_id])
+        entries.sort()
+        with self._lock:
+            # Users written while the pages were being read win over the loaded copy.
+            stale, fresh = set(), set()
+            for user_id, user in self._users.items():
+                stale.update((key, user_id) for key in keys.get(user_id, ()))
+                fresh.update((key, user_id) for key in self._keys[user_id])
+                keys[user_id], profiles[user_id] = self._keys[user_id], user
+            if stale or fresh:
+                entries = sorted((set(entries) - stale) | fresh)
+            self._entries, self._keys, self._users = entries, keys, profiles
+        self.ready.set()
+
+    def search(self, query, limit=10, role=None, max_scan=5000):
+        """Users with a key starting with the normalized query, exact and shorter keys first.
+
+        At most max_scan keys are examined, so a one-letter query filtered by a
+        rare role stays cheap.
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = {}
+        with self._lock:
+            i = bisect.bisect_left(self._entries, (prefix,))
+            end = min(len(self._entries), i + max_scan)
+            while i < end and len(found) < limit:
+                key, user_id = self._entries[i]
+                if not key.startswith(prefix):
+                    break
+                user = self._users[user_id]
+                if user_id not in found and (role is None or user.get('role') == role):
+                    found[user_id] = (key != prefix, len(key), user)
+                i += 1
+        ranked = sorted(found.items(), key=lambda item: item[1][:2])
+        return [dict(user, id=user_id) for user_id, (_, _, user) in ranked]
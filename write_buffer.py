@@ -0,0 +1,111 @@
+"""Write-behind coalescing of field updates to hot documents.
+
+Callers submit (key, updates) and get a Future. A flusher thread waits
+`window` seconds after the first pending update. It then merges everything
+queued for the same key into one update and commits all keys in one batch.
+A Future resolves only after its commit lands. Commits that fail with a
+retryable error are retried with exponential backoff and jitter; after the
+last attempt every waiting caller gets the error.
+"""
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+
+class CoalescingWriter:
+    def __init__(self, commit, combine, window=0.01, is_retryable=None, max_attempts=5,
+                 backoff=0.05, max_backoff=1.0, max_batch=500, on_flush=None, logger=None):
+        """commit({key: updates}) applies one atomic batch; combine(old, new) merges two updates.
+
+        is_retryable(error) says whether a failed commit is worth another attempt
+        (contention, timeouts). Other errors fail the callers at once.
+        """
+        self._commit = commit
+        self._combine = combine
+        self.window = window
+        self._is_retryable = is_retryable or (lambda error: False)
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._max_batch = max_batch
+        self._on_flush = on_flush
+        self._logger = logger
+        self._pending = {}       # key -> [updates, [Future]]
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {'submitted': 0, 'commits': 0, 'documents': 0, 'retries': 0, 'failures': 0}
+
+    def submit(self, key, updates):
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trackit-write-buffer', daemon=True)
+                self._thread.start()
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [dict(updates), [future]]
+            else:
+                entry[0] = self._combine(entry[0], updates)
+                entry[1].append(future)
+            self.stats['submitted'] += 1
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            if self.window > 0:
+                time.sleep(self.window)  # let concurrent writers join this batch
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            keys = list(pending)
+            for i in range(0, len(keys), self._max_batch):
+                self._flush({k: pending[k] for k in keys[i:i + self._max_batch]})
+
+    def _flush(self, group):
+        updates = {key: entry[0] for key, entry in group.items()}
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                self._commit(updates)
+                break
+            except Exception as e:
+                if not self._is_retryable(e):
+                    if len(group) > 1:
+                        # One bad document (e.g. a deleted class) must not fail the others.
+                        for key, entry in group.items():
+                            self._flush({key: entry})
+                        return
+                    self._fail(group, e)
+                    return
+                if attempts >= self._max_attempts:
+                    self._fail(group, e)
+                    return
+                self.stats['retries'] += 1
+                delay = min(self._max_backoff, self._backoff * 2 ** (attempts - 1))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+        self.stats['commits'] += 1
+        self.stats['documents'] += len(group)
+        for _, futures in group.values():
+            for future in futures:
+                future.set_result(None)
+        if self._on_flush is not None:
+            try:
+                self._on_flush(sum(len(entry[1]) for entry in group.values()), attempts)
+            except Exception:
+                # A broken hook must not stop the flusher thread.
+                if self._logger:
+                    self._logger.exception("Write buffer on_flush hook failed")
+
+    def _fail(self, group, error):
+        self.stats['failures'] += 1
+        if self._logger:
+            self._logger.warning("Coalesced write to %s failed: %s", ', '.join(map(str, group)), error)
+        for _, futures in group.values():
+            for future in futures:
+                future.set_exception(error)